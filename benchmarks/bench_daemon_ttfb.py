@@ -0,0 +1,131 @@
+"""Time to first byte of a backup started through the command line and through the daemon.
+
+Every run uploads a one byte file as soon as its IaaS client is ready; the time is taken from the start of the
+process (command line) or the job request (daemon) until the file shows up in the container. The daemon keeps the
+imported SDKs and its warm clients between the jobs, its first job pays for them as the command line does every time.
+
+By default the BOSH-Lite client is used (interpreter start-up, imports and client creation only). Pass the arguments
+of a real backup after the number of runs to include the authentication and connection set-up of a provider, e.g.
+--iaas=aws ... (the container check of the provider is part of the measured time).
+
+Usage: python3 -m benchmarks.bench_daemon_ttfb [runs] [backup arguments]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from lib.daemon import Daemon, request
+
+BLOB_NAME = 'ttfb'
+DEFAULT_ARGUMENTS = ['--iaas=boshlite', '--type=online', '--backup_guid=bench-ttfb', '--instance_id=vm-bench',
+                     '--secret=secret', '--container=bench-ttfb', '--job_name=service']
+
+
+def backup(iaas_client, configuration):
+    path = os.path.join(os.environ['BENCH_TTFB_DIRECTORY'], BLOB_NAME)
+    with open(path, 'w') as first_byte:
+        first_byte.write('x')
+    iaas_client.upload_to_blobstore(path, '{}/{}'.format(configuration['backup_guid'], BLOB_NAME),
+                                   throw_exception=True)
+    iaas_client.finalize()
+
+
+def cli(arguments):
+    from lib.config import parse_options
+    from lib.clients.index import create_iaas_client
+    configuration = parse_options('backup', arguments)
+    backup(create_iaas_client('backup', configuration, '/var/vcap/store', ['/tmp']), configuration)
+
+
+def serve(address):
+    daemon = Daemon(address)
+    daemon.register('backup', backup, '/var/vcap/store', ['/tmp'])
+    daemon.serve_forever()
+
+
+def wait_for(path, running, timeout=600):
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        if time.time() > deadline or not running():
+            raise Exception('{} did not show up, see the logs of the run'.format(path))
+        time.sleep(0.001)
+
+
+def blob_path(arguments):
+    # blobs of the BOSH-Lite client end up in a local folder, the other providers are checked through the job state
+    options = dict(argument[2:].split('=', 1) for argument in arguments if argument.startswith('--') and
+                   '=' in argument)
+    if options.get('iaas') != 'boshlite':
+        return None
+    return os.path.join('/tmp/service_fabrik_backup_restore', options['container'], options['backup_guid'], BLOB_NAME)
+
+
+def remove(path):
+    if path:
+        subprocess.call(['rm', '-rf', path])
+
+
+def measure_cli(arguments, runs, environment):
+    path = blob_path(arguments)
+    durations = []
+    for _ in range(runs):
+        remove(path)
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_daemon_ttfb', 'cli'] + arguments,
+                                   env=environment, stdout=subprocess.DEVNULL)
+        if path:
+            wait_for(path, lambda: process.poll() is None)
+            durations.append(time.perf_counter() - start)
+        process.wait()
+        if not path:
+            durations.append(time.perf_counter() - start)
+    return durations
+
+
+def measure_daemon(arguments, runs, environment, address):
+    path = blob_path(arguments)
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_daemon_ttfb', 'serve', address],
+                               env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while not os.path.exists(address):
+            time.sleep(0.01)
+        durations = []
+        for _ in range(runs):
+            remove(path)
+            start = time.perf_counter()
+            status, job = request(address, 'POST', '/jobs', {'operation': 'backup', 'arguments': arguments})
+            if path:
+                wait_for(path, lambda: process.poll() is None)
+                durations.append(time.perf_counter() - start)
+            while job['state'] in ('queued', 'running'):
+                time.sleep(0.001)
+                job = request(address, 'GET', '/jobs/{}'.format(job['id']))[1]
+            if not path:
+                durations.append(time.perf_counter() - start)
+        return durations
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def report(name, durations):
+    rest = sorted(durations[1:]) or durations
+    print('{:<8} first {:>8.1f} ms   following median {:>8.1f} ms   min {:>8.1f} ms'.format(
+        name, durations[0] * 1e3, rest[len(rest) // 2] * 1e3, rest[0] * 1e3))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'cli':
+        cli(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        serve(sys.argv[2])
+    else:
+        runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+        arguments = sys.argv[2:] or DEFAULT_ARGUMENTS
+        with tempfile.TemporaryDirectory() as directory:
+            environment = dict(os.environ, BENCH_TTFB_DIRECTORY=directory, SF_BACKUP_RESTORE_LOG_DIRECTORY=directory,
+                               SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY=directory)
+            os.environ.update(environment)
+            report('cli', measure_cli(arguments, runs, environment))
+            report('daemon', measure_daemon(arguments, runs, environment, os.path.join(directory, 'agent.sock')))
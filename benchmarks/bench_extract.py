@@ -0,0 +1,51 @@
+"""Time to restore a tarball of many small files.
+
+Compares 'tar -xzf' (what the restores run by default) with extract_file on one and on FILESYSTEM_WORKERS threads,
+optionally with the fsync of every file. Without a path a tree of small files (100 per directory) is created and
+archived with GNU tar in a temporary directory; pass a tarball (e.g. a decrypted backup) to measure that instead.
+
+Usage: python3 -m benchmarks.bench_extract [files | tarball]
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from lib.utils import extractor, filesystem
+from .bench_survey import create_tree
+
+
+def measure(name, function, target):
+    os.makedirs(target)
+    start = time.perf_counter()
+    result = function()
+    print('{:<32} {:>8.2f} s'.format(name, time.perf_counter() - start))
+    shutil.rmtree(target)
+    return result
+
+
+def run(tarball, root):
+    target = os.path.join(root, 'target')
+    measure('tar -xzf', lambda: subprocess.check_call(['tar', '-xzf', tarball, '-C', target]), target)
+    for workers in sorted({1, filesystem.FILESYSTEM_WORKERS}):
+        for fsync in (False, True):
+            result = measure('extract_file ({} threads{})'.format(workers, ', fsync' if fsync else ''),
+                             lambda: extractor.extract_file(tarball, target, workers, fsync), target)
+    print(result)
+
+
+if __name__ == '__main__':
+    argument = sys.argv[1] if len(sys.argv) > 1 else '50000'
+    with tempfile.TemporaryDirectory() as root:
+        if argument.isdigit():
+            source = os.path.join(root, 'source')
+            create_tree(source, int(argument))
+            tarball = os.path.join(root, 'source.tar.gz')
+            start = time.perf_counter()
+            subprocess.check_call(['tar', '-cpzf', tarball, '-C', source, '.'])
+            print('archived {} files in {:.1f} s'.format(argument, time.perf_counter() - start))
+            shutil.rmtree(source)
+            run(tarball, root)
+        else:
+            run(argument, root)
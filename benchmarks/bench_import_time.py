@@ -0,0 +1,114 @@
+"""Start-up import time of the command line and the IaaS client modules, checked against budgets.
+
+Every scenario is imported in a fresh interpreter started with -X importtime; the per module times written to
+stderr are summed up per top-level package and the slowest ones are reported. A scenario fails if it imports one of
+the SDKs it must leave to the code paths using them, or if its cumulative import time exceeds its budget (the
+interpreter start-up itself, i.e. site and encodings, is not counted). Python < 3.7 has no -X importtime, there the
+wall time of the import is compared against the budget and no report is printed.
+
+The budgets are in milliseconds and can be changed through SF_BACKUP_RESTORE_IMPORT_BUDGET_<SCENARIO> (e.g.
+SF_BACKUP_RESTORE_IMPORT_BUDGET_AWS=80) or SF_BACKUP_RESTORE_IMPORT_BUDGET_SCALE for slow machines.
+
+Usage: python3 -m benchmarks.bench_import_time [runs] [scenario ...]
+Exits with status 1 if a scenario is over its budget or imports an SDK.
+"""
+import collections
+import os
+import re
+import subprocess
+import sys
+import time
+
+# name: (imported modules, budget in ms, SDKs which must not be imported)
+SCENARIOS = collections.OrderedDict([
+    ('cli', (['lib.config', 'lib.clients.index'], 100, ['requests', 'cryptography'])),
+    ('daemon', (['lib.daemon'], 200, ['requests', 'cryptography'])),
+    ('aws', (['lib.clients.AwsClient'], 150, ['boto3', 'botocore'])),
+    ('azure', (['lib.clients.AzureClient'], 150, ['azure', 'msrestazure'])),
+    ('gcp', (['lib.clients.GcpClient'], 150, ['googleapiclient', 'google.cloud', 'google.oauth2'])),
+    ('ali', (['lib.clients.AliClient'], 150, ['oss2', 'aliyunsdkcore'])),
+    ('openstack', (['lib.clients.OpenstackClient'], 150, ['keystoneauth1', 'novaclient', 'cinderclient',
+                                                          'swiftclient'])),
+    ('boshlite', (['lib.clients.BoshliteClient'], 150, []))
+])
+# modules of the interpreter start-up, imported before the measured statement
+STARTUP = ('site', 'encodings', 'sitecustomize', 'usercustomize', '_distutils_hack')
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOP = 5
+
+
+def budget(name):
+    scale = float(os.getenv('SF_BACKUP_RESTORE_IMPORT_BUDGET_SCALE', 1))
+    return float(os.getenv('SF_BACKUP_RESTORE_IMPORT_BUDGET_' + name.upper(), SCENARIOS[name][1])) * scale
+
+
+def script(modules, sdks):
+    return ('import sys, time\n'
+            'start = time.perf_counter()\n'
+            'import {}\n'
+            'print((time.perf_counter() - start) * 1e3)\n'
+            'print(",".join(name for name in {!r} if name in sys.modules))\n').format(', '.join(modules), sdks)
+
+
+def parse(stderr):
+    """(cumulative ms of the top-level imports, self ms per top-level package) of -X importtime output."""
+    total = 0
+    packages = collections.Counter()
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        own, cumulative, indent, name = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+        package = name.split('.')[0]
+        if package in STARTUP:
+            continue
+        packages[package] += own / 1e3
+        if len(indent) == 1:
+            total += cumulative / 1e3
+    return total, packages
+
+
+def measure(name, runs):
+    modules, _, sdks = SCENARIOS[name]
+    import_time = sys.version_info >= (3, 7)
+    command = [sys.executable] + (['-X', 'importtime'] if import_time else []) + ['-c', script(modules, sdks)]
+    results = []
+    for _ in range(runs):
+        process = subprocess.run(command, cwd=ROOT_DIRECTORY, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 universal_newlines=True)
+        if process.returncode != 0:
+            raise Exception('Importing {} failed: {}'.format(', '.join(modules), process.stderr.strip()))
+        wall_time, imported = process.stdout.splitlines()
+        total, packages = parse(process.stderr) if import_time else (float(wall_time), collections.Counter())
+        results.append((total, packages, [sdk for sdk in imported.split(',') if sdk]))
+    # the fastest run has the least noise of the machine
+    return min(results, key=lambda result: result[0])
+
+
+def check(name, runs):
+    total, packages, sdks = measure(name, runs)
+    allowed = budget(name)
+    failures = []
+    if sdks:
+        failures.append('imports {}'.format(', '.join(sdks)))
+    if total > allowed:
+        failures.append('over budget')
+    print('{:<10} {:>8.1f} ms  budget {:>6.0f} ms  {}'.format(name, total, allowed,
+                                                             'FAILED: ' + ', '.join(failures) if failures else 'ok'))
+    for package, own in packages.most_common(TOP):
+        print('           {:>8.1f} ms  {}'.format(own, package))
+    return not failures
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    runs = int(arguments.pop(0)) if arguments and arguments[0].isdigit() else 5
+    names = arguments or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        sys.exit('Unknown scenarios {}, choose from {}'.format(', '.join(unknown), ', '.join(SCENARIOS)))
+    start = time.perf_counter()
+    passed = [check(name, runs) for name in names]
+    print('{} of {} scenarios within budget ({:.1f} s)'.format(sum(passed), len(passed), time.perf_counter() - start))
+    sys.exit(0 if all(passed) else 1)
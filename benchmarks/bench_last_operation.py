@@ -0,0 +1,56 @@
+"""Per-update cost of writing the last operation state.
+
+Compares the former implementation (write the blue/green file, then fork 'ln -sf' through the shell) with
+LastOperationWriter, once writing every update and once coalescing updates as it does by default.
+
+Usage: python3 -m benchmarks.bench_last_operation [updates]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from lib.utils.last_operation import LastOperationWriter
+
+
+def content(i):
+    return {'state': 'processing', 'stage': 'Waiting for snapshot {} to get ready...'.format(i),
+            'updated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+
+def shell_writer(directory, updates):
+    symlink = os.path.join(directory, 'backup.lastoperation.json')
+    blue = os.path.join(directory, 'backup.lastoperation.blue.json')
+    green = os.path.join(directory, 'backup.lastoperation.green.json')
+    open(blue, 'w').close()
+    os.symlink(blue, symlink)
+    for i in range(updates):
+        filename = green if os.readlink(symlink) == blue else blue
+        with open(filename, 'w') as f:
+            f.write(json.dumps(content(i)))
+        subprocess.check_output('ln -sf {} {}'.format(filename, symlink), shell=True)
+
+
+def native_writer(interval):
+    def run(directory, updates):
+        writer = LastOperationWriter(directory, 'backup', interval=interval)
+        for i in range(updates):
+            writer.write(content(i))
+        writer.close()
+    return run
+
+
+def measure(name, function, updates):
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        function(directory, updates)
+        duration = time.perf_counter() - start
+    print('{:<28} {:>10.1f} us/update'.format(name, duration / updates * 1e6))
+
+
+if __name__ == '__main__':
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    measure('shell ln -sf', shell_writer, updates)
+    measure('LastOperationWriter (each)', native_writer(0), updates)
+    measure('LastOperationWriter (1s)', native_writer(1), updates)
@@ -0,0 +1,80 @@
+"""Throughput of the ways the archiver can read a file, and what they leave in the page cache.
+
+Reads a file with plain 64 KiB reads (like tar) and with the SequentialReader: the sequential hint only, with
+read-ahead windows, dropping the read pages and with O_DIRECT. Before each run the page cache is dropped if possible
+(root), else the numbers are warm ones; afterwards the cached bytes of the file are counted with fincore (util-linux)
+if it is installed. Without a path a file of random data is created in a temporary directory.
+
+Usage: python3 -m benchmarks.bench_read [MiB | path]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from lib.utils.reader import MIB, SequentialReader
+
+
+def drop_caches():
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3')
+        return True
+    except OSError:
+        return False
+
+
+def cached_bytes(path):
+    try:
+        output = subprocess.check_output(['fincore', '--bytes', '--noheadings', '--output', 'RES', path])
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return int(output.split()[0])
+
+
+def read_plain(path):
+    with open(path, 'rb', buffering=0) as f:
+        while f.read(64 * 1024):
+            pass
+
+
+def read_sequential(path, **options):
+    with SequentialReader(path, **options) as source:
+        while source.read(MIB):
+            pass
+
+
+def run(path):
+    size = os.path.getsize(path)
+    cold = drop_caches()
+    print('{} MiB, {} page cache'.format(size // MIB, 'cold' if cold else 'warm (not root)'))
+    for name, function in [
+            ('read 64 KiB', lambda: read_plain(path)),
+            ('sequential', lambda: read_sequential(path, read_ahead=0)),
+            ('sequential, read-ahead 8 MiB', lambda: read_sequential(path, read_ahead=8 * MIB)),
+            ('sequential, read-ahead 32 MiB', lambda: read_sequential(path, read_ahead=32 * MIB)),
+            ('read-ahead 8 MiB, drop cache', lambda: read_sequential(path, read_ahead=8 * MIB, drop_cache=True)),
+            ('O_DIRECT 1 MiB', lambda: read_sequential(path, direct=True)),
+            ('O_DIRECT 8 MiB', lambda: read_sequential(path, buffer_size=8 * MIB, direct=True))]:
+        drop_caches()
+        start = time.perf_counter()
+        function()
+        duration = time.perf_counter() - start
+        cached = cached_bytes(path)
+        print('{:<32} {:>8.1f} MiB/s   cached afterwards: {}'.format(
+            name, size / MIB / duration, '?' if cached is None else '{} MiB'.format(cached // MIB)))
+
+
+if __name__ == '__main__':
+    argument = sys.argv[1] if len(sys.argv) > 1 else '1024'
+    if argument.isdigit():
+        # not in /tmp, which may be a tmpfs without O_DIRECT and page cache
+        with tempfile.TemporaryDirectory(dir=os.getcwd()) as root:
+            path = os.path.join(root, 'data')
+            with open(path, 'wb') as f:
+                for _ in range(int(argument)):
+                    f.write(os.urandom(MIB))
+            run(path)
+    else:
+        run(argument)
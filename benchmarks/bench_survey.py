@@ -0,0 +1,62 @@
+"""Time to survey a tree of many small files before a backup.
+
+Compares survey_tree with one and with FILESYSTEM_WORKERS threads against a serial os.walk with lstat and against
+'du -s --apparent-size'. Without a path a tree of small files (100 per directory) is created in a temporary directory;
+the page cache is warm for all runs, pass a real data directory and drop the caches in between for cold numbers.
+
+Usage: python3 -m benchmarks.bench_survey [files | path]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from lib.utils import filesystem
+
+FILES_PER_DIRECTORY = 100
+
+
+def create_tree(root, files):
+    for index in range(files):
+        directory = os.path.join(root, str(index // FILES_PER_DIRECTORY // 100), str(index // FILES_PER_DIRECTORY))
+        if index % FILES_PER_DIRECTORY == 0:
+            os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, str(index)), 'w') as f:
+            f.write('x' * (index % 4096))
+
+
+def walk(root):
+    files = size = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            size += os.lstat(os.path.join(directory, name)).st_size
+            files += 1
+    return files, size
+
+
+def measure(name, function):
+    start = time.perf_counter()
+    result = function()
+    print('{:<26} {:>8.2f} s'.format(name, time.perf_counter() - start))
+    return result
+
+
+def run(root):
+    print(measure('os.walk + lstat', lambda: walk(root)))
+    measure('du --apparent-size', lambda: subprocess.check_call(
+        ['du', '-s', '--apparent-size', root], stdout=subprocess.DEVNULL))
+    for workers in sorted({1, filesystem.FILESYSTEM_WORKERS}):
+        survey = measure('survey_tree ({} threads)'.format(workers), lambda: filesystem.survey_tree(root, workers))
+    print(survey.as_dict())
+
+
+if __name__ == '__main__':
+    argument = sys.argv[1] if len(sys.argv) > 1 else '200000'
+    if argument.isdigit():
+        with tempfile.TemporaryDirectory() as root:
+            start = time.perf_counter()
+            create_tree(root, int(argument))
+            print('created {} files in {:.1f} s'.format(argument, time.perf_counter() - start))
+            run(root)
+    else:
+        run(argument)
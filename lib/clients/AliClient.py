@@ -1,11 +1,11 @@
-import oss2
-from oss2.headers import RequestHeader
 from .BaseClient import BaseClient
-from aliyunsdkcore.request import CommonRequest
-from aliyunsdkcore.client import AcsClient
 from ..models.Snapshot import Snapshot
 from ..models.Volume import Volume
 from ..models.Attachment import Attachment
+from ..utils import devices
+from ..utils.progress import GIB
+from ..utils.container_access import ACCESS_TEST_BLOB
+from ..utils.retry_policy import SDK_MAX_RETRIES
 from .. import constants
 
 import json
@@ -13,6 +13,7 @@ import json
 class AliClient(BaseClient):
     def __init__(self, operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time,
                  poll_maximum_time):
+        self.__compute_client = None
         super(AliClient, self).__init__(operation_name, configuration, directory_persistent, directory_work_list,
                                         poll_delay_time, poll_maximum_time)
         if configuration['credhub_url'] is None:
@@ -25,9 +26,8 @@ class AliClient(BaseClient):
         self.endpoint = configuration['endpoint']
         self.max_retries = (configuration.get('max_retries') if
                             type(configuration.get('max_retries'))
-                            == int else 10)
-        # +-> Create compute and storage clients
-        self.compute_client = self.create_compute_client()
+                            == int else SDK_MAX_RETRIES)
+        # +-> Create the storage client, the compute client is created on first use (never for blob operations)
         self.storage_client = self.create_storage_client()
 
         # +-> Check whether the given container exists
@@ -54,17 +54,32 @@ class AliClient(BaseClient):
             'region_name': region_name
         }
 
+    @property
+    def compute_client(self):
+        if self.__compute_client is None:
+            self.__compute_client = self._trace_client(self.create_compute_client(), 'ecs', depth=0,
+                                                       describe=lambda name, args: args[0].get_action_name())
+        return self.__compute_client
+
+    @compute_client.setter
+    def compute_client(self, compute_client):
+        self.__compute_client = compute_client
+
     def create_compute_client(self):
+        # The SDKs are imported where they are used, blob operations never load the compute SDK
+        from aliyunsdkcore.client import AcsClient
         try:
             credentials = self.__aliCredentials
-            compute_client = AcsClient(credentials['access_key_id'], credentials['secret_access_key'], credentials['region_name'], auto_retry=True,
-            max_retry_time=self.max_retries, timeout=30)
+            compute_client = self._warm_client('ecs', dict(credentials, max_retries=self.max_retries), lambda binding:
+                AcsClient(credentials['access_key_id'], credentials['secret_access_key'], credentials['region_name'],
+                          auto_retry=True, max_retry_time=self.max_retries, timeout=30))
             return compute_client
         except Exception as error:
             raise Exception(
                 'Creation of compute client failed: {}'.format(error))
 
     def create_storage_client(self):
+        import oss2
         try:
             credentials = self.__aliCredentials
             storage_client = oss2.Auth(
@@ -75,6 +90,7 @@ class AliClient(BaseClient):
                 'Creation of storage client failed: {}'.format(error))
 
     def _get_common_compute_request(self, action_name, params, tags=None):
+        from aliyunsdkcore.request import CommonRequest
         request = CommonRequest()
         request.set_domain(constants.APIS['ALI']['DOMAIN'])
         request.set_version(constants.APIS['ALI']['VERSION'])
@@ -110,13 +126,18 @@ class AliClient(BaseClient):
             return None
 
     def get_container(self):
+        import oss2
         try:
             container = oss2.Bucket(self.storage_client, self.endpoint, self.CONTAINER)
             # Test if the container is accessible
-            key = '{}/{}'.format(self.BLOB_PREFIX,
-                                 'AccessTestByServiceFabrikPythonLibrary')
-            container.put_object(key, 'This is a sample text')
-            container.delete_object(key)
+            key = '{}/{}'.format(self.BLOB_PREFIX, ACCESS_TEST_BLOB)
+
+            def probe():
+                container.put_object(key, 'This is a sample text')
+                container.delete_object(key)
+
+            self._check_container_access([self.__aliCredentials, self.endpoint], probe,
+                                         lambda: container.get_bucket_info())
             return container
         except Exception as error:
             self.logger.error('[OSS] ERROR: Unable to find or access container {}.\n{}'.format(
@@ -124,6 +145,7 @@ class AliClient(BaseClient):
             return None
 
     def _upload_to_blobstore(self, blob_to_upload_path, blob_target_name):
+        from oss2.headers import RequestHeader
         log_prefix = '[OSS] [UPLOAD]'
 
         if self.container:
@@ -133,7 +155,8 @@ class AliClient(BaseClient):
                 requestHeader = RequestHeader()
                 requestHeader.set_server_side_encryption("AES256")
                 self.container.put_object_from_file(
-                    blob_target_name, blob_to_upload_path, headers=requestHeader)
+                    blob_target_name, blob_to_upload_path, headers=requestHeader,
+                    progress_callback=self._upload_progress_callback())
                 self.logger.info('{} SUCCESS: blob_to_upload={}, blob_target_name={}, container={}'
                                  .format(log_prefix, blob_to_upload_path, blob_target_name, self.CONTAINER))
                 return True
@@ -151,7 +174,8 @@ class AliClient(BaseClient):
                              .format(log_prefix, blob_download_target_path))
             try:
                 self.container.get_object_to_file(
-                    blob_to_download_name, blob_download_target_path)
+                    blob_to_download_name, blob_download_target_path,
+                    progress_callback=lambda consumed, total: self._check_cancellation())
                 self.logger.info('{} SUCCESS: blob_to_download={}, blob_target_name={}, container={}'.format(
                     log_prefix, blob_to_download_name, blob_download_target_path, self.CONTAINER))
                 return True
@@ -178,6 +202,7 @@ class AliClient(BaseClient):
             snapshot_creation_operation = self.compute_client.do_action_with_exception(snpshot_creation_request)
             snapshot_details_json = json.loads(snapshot_creation_operation.decode('utf-8'))
             snapshot_id = snapshot_details_json['SnapshotId']
+            self._start_progress('snapshot')
             self._wait('Waiting for snapshot {} to get ready...'.format(snapshot_name),
                        (lambda snapshot_id: self._is_snapshot_ready(snapshot_id)),
                        None,
@@ -187,6 +212,7 @@ class AliClient(BaseClient):
             if snapshot.status == 'accomplished':
                 self._add_snapshot(snapshot.id)
                 self.output_json['snapshotId'] = snapshot.id
+                self._finish_progress()
                 self.logger.info('{} SUCCESS: snapshot-id={}, volume-id={}, status={} with tags {}'.format(
                     log_prefix, snapshot.id, volume_id, snapshot.status, self.tags))
             else:
@@ -194,6 +220,7 @@ class AliClient(BaseClient):
                     log_prefix, snapshot_name, snapshot.status)
                 raise Exception(message)
         except Exception as error:
+            self._finish_progress(False)
             message = '{} ERROR: volume-id={} and tags={}\n{}'.format(
                 log_prefix, volume_id, self.tags, error)
             self.logger.error(message)
@@ -245,6 +272,10 @@ class AliClient(BaseClient):
         # Retries for failures also
         try:
             snapshot_list = self._get_snapshot_list(snapshot_id)
+            if len(snapshot_list) == 1:
+                # Progress is reported as a percentage string, e.g. '42%', SourceDiskSize in GiB
+                self._report_progress(snapshot_list[0].get('Progress'),
+                                      total_bytes=int(snapshot_list[0].get('SourceDiskSize', 0)) * GIB or None)
             if len(snapshot_list) > 1 or (len(snapshot_list) == 1 and snapshot_list[0]['Status'] in ('accomplished','failed')):
                 return True
             return False
@@ -314,8 +345,7 @@ class AliClient(BaseClient):
             return []
 
     def get_persistent_volume_for_instance(self, instance_id):
-        device = self.shell(
-            'cat {} | grep {}'.format(self.FILE_MOUNTS, self.DIRECTORY_PERSISTENT)).split(' ')[0][:8]
+        device = devices.get_mounted_device(self.DIRECTORY_PERSISTENT, self.FILE_MOUNTS)[:8]
         # --> /dev/vdb on machine will be /dev/xvdb on AliCloud for "I/O Optimized" instances
         # --> https://www.alibabacloud.com/help/doc-detail/25426.htm
         device = device.replace('/v', '/xv')
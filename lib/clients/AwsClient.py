@@ -1,9 +1,14 @@
-import boto3
-from botocore.config import Config
+import time
 from .BaseClient import BaseClient
 from ..models.Snapshot import Snapshot
 from ..models.Volume import Volume
 from ..models.Attachment import Attachment
+from ..utils import devices
+from ..utils import rate_limiter
+from ..utils.container_access import ACCESS_TEST_BLOB
+from ..utils.retry_policy import SDK_MAX_RETRIES, THROTTLING_CODES
+from ..utils.progress import GIB
+from ..utils.warm_clients import Binding
 
 
 class AwsClient(BaseClient):
@@ -22,7 +27,17 @@ class AwsClient(BaseClient):
 
         self.max_retries = (configuration.get('max_retries') if
                             type(configuration.get('max_retries'))
-                            == int else 10)
+                            == int else SDK_MAX_RETRIES)
+        # copy:   snapshots are copied into an encrypted snapshot after creation
+        # volume: snapshots are kept as they are and volumes get encrypted when they are created at restore time
+        self.encryption_strategy = configuration.get('encryption_strategy') or 'copy'
+        if self.encryption_strategy not in ('copy', 'volume'):
+            msg = 'Invalid encryption strategy {}, possible values: copy/volume'.format(self.encryption_strategy)
+            self.last_operation(msg, 'failed')
+            raise Exception(msg)
+        self.kms_key_id = configuration.get('kms_key_id')
+        # boto3 is imported by the first client which needs it (see create_aws_session)
+        from botocore.config import Config
         # skipping some actions for blob operation
         if operation_name != 'blob_operation':
             self.ec2_config = Config(retries={'max_attempts': self.max_retries})
@@ -60,33 +75,82 @@ class AwsClient(BaseClient):
     def format_tags(self):
         return [{'Key': key, 'Value': value} for key, value in self.tags.items()]
 
-    def create_aws_session(self):
-        return boto3.Session(
+    def create_aws_session(self, binding=None):
+        import boto3
+        session = boto3.Session(
             aws_access_key_id=self.__awsCredentials['access_key_id'],
             aws_secret_access_key=self.__awsCredentials['secret_access_key'],
             region_name=self.__awsCredentials['region_name']
         )
+        # Rate limit and trace every API call of the clients created from this session (botocore retries count as
+        # attempts). The handlers call the AwsClient through the binding, as warm sessions outlive it.
+        binding = binding or Binding(self)
+        session.events.register('before-call', binding.method('_trace_before_call'))
+        session.events.register('needs-retry', binding.method('_trace_retry'))
+        session.events.register('after-call', binding.method('_trace_after_call'))
+        return session
+
+    @staticmethod
+    def __is_throttled(response):
+        http_response, parsed = response
+        error_code = (parsed or {}).get('Error', {}).get('Code', '')
+        return http_response.status_code in (429, 503) or error_code.lower() in THROTTLING_CODES
+
+    def _trace_before_call(self, model, context, **kwargs):
+        endpoint_prefix = model.service_model.endpoint_prefix
+        family = rate_limiter.STORAGE if endpoint_prefix == 's3' else rate_limiter.api_family(model.name)
+        queued = self.rate_limiter.acquire(family)
+        context['family'] = family
+        context['span'] = self.tracer.start_span('{}.{}'.format(endpoint_prefix, model.name), 'client',
+                                                 queued=round(queued, 3) if queued else None)
+
+    def _trace_retry(self, attempts, request_dict, response=None, **kwargs):
+        context = request_dict.get('context', {})
+        span = context.get('span')
+        if span:
+            span.attempt = attempts
+        if response is not None and 'family' in context and self.__is_throttled(response):
+            self.rate_limiter.record(context['family'], throttled=True)
+
+    def _trace_after_call(self, http_response, parsed, context, **kwargs):
+        span = context.pop('span', None)
+        if span:
+            self.tracer.finish_span(span, 'HTTP {}'.format(http_response.status_code)
+                                    if http_response.status_code >= 300 else None)
+        if 'family' in context:
+            self.rate_limiter.record(context.pop('family'), self.__is_throttled((http_response, parsed)))
+
+    def __warm_client(self, kind, config, factory):
+        return self._warm_client(kind, dict(self.__awsCredentials, max_retries=self.max_retries),
+                                 lambda binding: factory(self.create_aws_session(binding), config))
 
     def create_ec2_resource(self):
-        return self.create_aws_session().resource('ec2', config=self.ec2_config)
+        return self.__warm_client('ec2.resource', self.ec2_config,
+                                  lambda session, config: session.resource('ec2', config=config))
 
     def create_ec2_client(self):
         try:
-            client = self.create_aws_session().client('ec2', config=self.ec2_config)
-            return client
+            return self.__warm_client('ec2.client', self.ec2_config,
+                                      lambda session, config: session.client('ec2', config=config))
         except Exception as error:
             raise Exception('Connection to AWS EC2 failed: {}'.format(error))
 
     def create_s3_resource(self):
-        return self.create_aws_session().resource('s3', config=self.s3_config)
+        return self.__warm_client('s3.resource', self.s3_config,
+                                  lambda session, config: session.resource('s3', config=config))
 
     def create_s3_client(self):
-        return self.create_aws_session().client('s3', config=self.s3_config)
+        return self.__warm_client('s3.client', self.s3_config,
+                                  lambda session, config: session.client('s3', config=config))
+
+    def _get_instance(self, instance_id):
+        instance = self.ec2.Instance(instance_id)
+        instance.load()
+        return instance
 
     def _get_availability_zone_of_server(self, instance_id):
         try:
-            instance = self.ec2.Instance(instance_id)
-            instance.load()
+            instance = self._get_cached_instance(instance_id)
             return instance.placement['AvailabilityZone']
         except Exception as error:
             self.logger.error(
@@ -97,13 +161,18 @@ class AwsClient(BaseClient):
         try:
             container = self.s3.Bucket(self.CONTAINER)
             # Test if the container is accessible
-            key = '{}/{}'.format(self.BLOB_PREFIX, 'AccessTestByServiceFabrikPythonLibrary')
-            container.put_object(Key=key)
-            container.delete_objects(Delete={
-               'Objects': [{
-                    'Key': key
-               }]
-            })
+            key = '{}/{}'.format(self.BLOB_PREFIX, ACCESS_TEST_BLOB)
+
+            def probe():
+                container.put_object(Key=key)
+                container.delete_objects(Delete={
+                   'Objects': [{
+                        'Key': key
+                   }]
+                })
+
+            self._check_container_access(self.__awsCredentials, probe,
+                                         lambda: self.s3.client.head_bucket(Bucket=self.CONTAINER))
             return container
         except Exception as error:
             self.logger.error('[S3] ERROR: Unable to find or access container {}.\n{}'.format(
@@ -125,17 +194,23 @@ class AwsClient(BaseClient):
             return None
 
     def get_attached_volumes_for_instance(self, instance_id):
-        instance = self.ec2.Instance(instance_id)
         try:
-            return [Volume(details['VolumeId'], 'none', self.ec2.Volume(details['VolumeId']).size, details['Device'])
-                    for volumes in instance.volumes.all()
-                    for details in volumes.attachments]
+            # A single filtered describe call returns the size and the attachments of all volumes of the instance
+            paginator = self.ec2.client.get_paginator('describe_volumes')
+            pages = paginator.paginate(Filters=[{
+                'Name': 'attachment.instance-id',
+                'Values': [instance_id]
+            }])
+            return [Volume(volume['VolumeId'], 'none', volume['Size'], details['Device'])
+                    for page in pages
+                    for volume in page['Volumes']
+                    for details in volume['Attachments']
+                    if details['InstanceId'] == instance_id]
         except:
             return []
 
     def has_nvme_persistent_volume(self):
-        device = self.shell(
-            'cat /proc/mounts | grep {}'.format(self.DIRECTORY_PERSISTENT))
+        device = devices.get_mounted_device(self.DIRECTORY_PERSISTENT, self.FILE_MOUNTS)
         nvme_dev_pattern = '/dev/nvme'
         if nvme_dev_pattern in device:
             return True
@@ -144,10 +219,8 @@ class AwsClient(BaseClient):
 
     def get_persistent_volume_for_instance(self, instance_id):
         if self.has_nvme_persistent_volume() == True:
-            device = self.shell('cat /proc/mounts | grep {}'.format(self.DIRECTORY_PERSISTENT)).split(' ')[0][:14]
-            vol_id = self.shell("nvme id-ctrl -v {} | egrep -wo 'vol.*'".format(device))
-            vol_id = "vol-" + vol_id.split("vol")[1]
-            vol_id = vol_id.rstrip("\n")
+            device = devices.get_mounted_device(self.DIRECTORY_PERSISTENT, self.FILE_MOUNTS)[:14]
+            vol_id = devices.get_nvme_volume_id(device)
             self.logger.info('Found volume id {} for device {}'.format(vol_id, device))
             for volume in self.get_attached_volumes_for_instance(instance_id):
                 if volume.id == vol_id:
@@ -155,8 +228,7 @@ class AwsClient(BaseClient):
                     return volume
             return None
         else:
-            device = self.shell(
-                'cat /proc/mounts | grep {}'.format(self.DIRECTORY_PERSISTENT)).split(' ')[0][:9]
+            device = devices.get_mounted_device(self.DIRECTORY_PERSISTENT, self.FILE_MOUNTS)[:9]
             # http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/device_naming.html
             # --> /dev/xvdk on machine will be /dev/sdk on AWS
             device = device.replace('xv', 's')
@@ -178,11 +250,13 @@ class AwsClient(BaseClient):
                 VolumeId=volume_id,
                 Description=description
             )
+            self._start_progress('snapshot', snapshot.volume_size * GIB)
 
             self._wait('Waiting for snapshot {} to get ready...'.format(snapshot.id),
                        lambda snap: snap.state == 'completed',
-                       snapshot.reload,
+                       lambda: self._reload_snapshot_progress(snapshot),
                        snapshot)
+            self._finish_progress()
 
             snapshot = Snapshot(
                 snapshot.id, snapshot.volume_size, snapshot.start_time, snapshot.state)
@@ -198,6 +272,7 @@ class AwsClient(BaseClient):
             self.logger.info('{} SUCCESS: snapshot-id={}, volume-id={} with tags {}'.format(
                 log_prefix, snapshot.id, volume_id, self.formatted_tags))
         except Exception as error:
+            self._finish_progress(False)
             message = '{} ERROR: volume-id={} and tags={}\n{}'.format(
                 log_prefix, volume_id, self.formatted_tags, error)
             self.logger.error(message)
@@ -208,29 +283,55 @@ class AwsClient(BaseClient):
 
         return snapshot
 
+    def _reload_snapshot_progress(self, snapshot):
+        # EC2 reports the progress of pending snapshots as a percentage string, e.g. '42%'
+        snapshot.reload()
+        self._report_progress(snapshot.progress)
+
     def _copy_snapshot(self, snapshot_id):
         log_prefix = '[SNAPSHOT] [COPY]'
         snapshot = None
         ec2_snapshot = self.ec2.Snapshot(snapshot_id)
+        # Snapshots of encrypted volumes (e.g. with EBS encryption by default) are encrypted already, and with the
+        # 'volume' strategy encryption happens when restoring. The snapshot itself then becomes the backup.
+        if ec2_snapshot.encrypted or self.encryption_strategy == 'volume':
+            snapshot = Snapshot(
+                ec2_snapshot.id, ec2_snapshot.volume_size, ec2_snapshot.start_time, ec2_snapshot.state)
+            self._remove_snapshot(snapshot.id)
+            self.output_json['snapshotId'] = snapshot.id
+            self.output_json['snapshotEncryption'] = 'snapshot' if ec2_snapshot.encrypted else 'volume'
+            self.logger.info('{} SKIPPED: snapshot-id={}, encrypted={}, encryption-strategy={}'.format(
+                log_prefix, snapshot.id, ec2_snapshot.encrypted, self.encryption_strategy))
+            return snapshot
+
+        start_time = time.time()
         try:
-            snapshot = ec2_snapshot.copy(
-                DryRun=False,
-                SourceRegion=self.__awsCredentials['region_name'],
-                Description='Service-Fabrik: Encrypted Backup',
-                Encrypted=True
-            )
+            copy_kwargs = {
+                'DryRun': False,
+                'SourceRegion': self.__awsCredentials['region_name'],
+                'Description': 'Service-Fabrik: Encrypted Backup',
+                'Encrypted': True
+            }
+            if self.kms_key_id:
+                copy_kwargs['KmsKeyId'] = self.kms_key_id
+            snapshot = ec2_snapshot.copy(**copy_kwargs)
             new_snapshot = self.ec2.Snapshot(snapshot['SnapshotId'])
+            self._start_progress('snapshotCopy', ec2_snapshot.volume_size * GIB)
 
             self._wait('Waiting for snapshot {} to get ready...'.format(new_snapshot.id),
                        lambda snap: snap.state == 'completed',
-                       new_snapshot.reload,
+                       lambda: self._reload_snapshot_progress(new_snapshot),
                        new_snapshot)
+            self._finish_progress()
 
             snapshot = Snapshot(
                 new_snapshot.id, new_snapshot.volume_size, new_snapshot.start_time, new_snapshot.state)
-            self.logger.info('{} SUCCESS: snapshot-id={}, unencrypted-snapshot_id={}'.format(
-                log_prefix, snapshot.id, snapshot_id))
+            duration = round(time.time() - start_time, 3)
+            self.logger.info('{} SUCCESS: snapshot-id={}, unencrypted-snapshot_id={}, duration={}s'.format(
+                log_prefix, snapshot.id, snapshot_id, duration))
             self.output_json['snapshotId'] = snapshot.id
+            self.output_json['snapshotEncryption'] = 'copy'
+            self.output_json['snapshotCopyDuration'] = duration
 
             self.ec2.create_tags(
                 Resources=[
@@ -240,6 +341,7 @@ class AwsClient(BaseClient):
             )
 
         except Exception as error:
+            self._finish_progress(False)
             message = '{} ERROR: snapshot-id={}\n{}'.format(
                 log_prefix, snapshot_id, error)
             self.logger.error(message)
@@ -289,6 +391,12 @@ class AwsClient(BaseClient):
             }
             if snapshot_id:
                 kwargs['SnapshotId'] = snapshot_id
+            # EBS encrypts the new volume even if the snapshot it is created from is unencrypted. Backups of the
+            # 'volume' strategy are unencrypted snapshots, whatever strategy the restoring client is configured with.
+            if self.encryption_strategy == 'volume' or (snapshot_id and not self.ec2.Snapshot(snapshot_id).encrypted):
+                kwargs['Encrypted'] = True
+                if self.kms_key_id:
+                    kwargs['KmsKeyId'] = self.kms_key_id
 
             volume = self.ec2.create_volume(**kwargs)
 
@@ -431,17 +539,15 @@ class AwsClient(BaseClient):
         pass
 
     def get_nvme_mountpoint(self, volume_id):
-        device_list = self.shell("lsblk --noheadings --raw -p -o NAME,TYPE | awk '$2 == \"part\" {print $1}'")
-        device_list = device_list.split("\n")
-        for device in device_list:
-            vol_id = self.shell("nvme id-ctrl -v {} | egrep -wo 'vol.*'".format(device))
-            vol_id = "vol-" + vol_id.split("vol")[1]
-            vol_id = vol_id.rstrip("\n")
-            if vol_id == volume_id:
-                return device
-        
-        return None
-        
+        # The partition of a freshly attached volume may show up shortly after the attachment completes
+        def find_partition():
+            for device in devices.list_partitions():
+                if devices.get_nvme_volume_id(device) == volume_id:
+                    return device
+            return None
+
+        return devices.wait_for(find_partition, devices.DIRECTORY_DEV, self.configuration['poll_delay_time'])
+
     def get_mountpoint(self, volume_id, partition=None):
         if self.has_nvme_persistent_volume() == True:
             return self.get_nvme_mountpoint(volume_id)
@@ -463,8 +569,16 @@ class AwsClient(BaseClient):
             self.logger.info(
                 '{} Started to upload the tarball to the object storage.'.format(log_prefix))
             try:
+                # the part size and concurrency of the multipart upload follow the backup plan (if any)
+                options = {}
+                if self.backup_plan:
+                    from boto3.s3.transfer import TransferConfig
+                    options['Config'] = TransferConfig(multipart_threshold=self.backup_plan.part_size,
+                                                       multipart_chunksize=self.backup_plan.part_size,
+                                                       max_concurrency=self.backup_plan.concurrency)
+                # every transfer thread reports the bytes it sent, and waits there for the upload limit
                 self.container.upload_file(
-                    blob_to_upload_path, blob_target_name)
+                    blob_to_upload_path, blob_target_name, Callback=self._upload_progress, **options)
                 self.logger.info('{} SUCCESS: blob_to_upload={}, blob_target_name={}, container={}'
                                  .format(log_prefix, blob_to_upload_path, blob_target_name, self.CONTAINER))
                 return True
@@ -482,7 +596,8 @@ class AwsClient(BaseClient):
                              .format(log_prefix, blob_download_target_path))
             try:
                 self.container.download_file(
-                    blob_to_download_name, blob_download_target_path)
+                    blob_to_download_name, blob_download_target_path,
+                    Callback=lambda transferred: self._check_cancellation())
                 self.logger.info('{} SUCCESS: blob_to_download={}, blob_target_name={}, container={}'.format(
                     log_prefix, blob_to_download_name, self.CONTAINER, blob_download_target_path))
                 return True
@@ -497,6 +612,8 @@ class AwsClient(BaseClient):
             self.CONTAINER, blob_to_download_name).get()['Body']
         chunk = s3_object_body.read(segment_size)
         while chunk:
+            self._check_cancellation()
+            self.metrics.add('bytesIn', len(chunk))
             process.stdin.write(chunk)
             chunk = s3_object_body.read(segment_size)
 
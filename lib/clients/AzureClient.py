@@ -1,16 +1,12 @@
-from azure.common.credentials import ServicePrincipalCredentials
-from azure.mgmt.compute import ComputeManagementClient
-from azure.mgmt.compute.models import StorageAccountTypes
-from azure.mgmt.compute.models import SnapshotStorageAccountTypes
-from azure.storage.blob import BlockBlobService
-from msrestazure.azure_exceptions import CloudError
-from azure.mgmt.compute.models import DiskCreateOption
-from azure.mgmt.compute.models import DiskCreateOptionTypes
 import glob
+import os
+import time
 from .BaseClient import BaseClient
 from ..models.Snapshot import Snapshot
 from ..models.Volume import Volume
 from ..models.Attachment import Attachment
+from ..utils import devices
+from ..utils import rate_limiter
 
 
 class AzureClient(BaseClient):
@@ -35,8 +31,8 @@ class AzureClient(BaseClient):
             self.storage_account_key = azure_config['storageAccessKey']
             self.subscription_id = azure_config['subscription_id']
 
-        self.block_blob_service = BlockBlobService(
-            account_name=self.storage_account_name, account_key=self.storage_account_key)
+        self.block_blob_service = self._trace_client(self.create_block_blob_service(), 'blob', depth=0,
+                                                     family=rate_limiter.STORAGE)
 
         # +-> Check whether the given container exists and accessible
         if (not self.get_container()) or (not self.access_container()):
@@ -46,8 +42,7 @@ class AzureClient(BaseClient):
 
         # skipping some actions for blob operation
         if operation_name != 'blob_operation':
-            self.compute_client = ComputeManagementClient(
-                self.__azureCredentials, self.subscription_id)
+            self.compute_client = self._trace_client(self.create_compute_client(), 'compute')
             self.instance_location = self.get_instance_location(
                 configuration['instance_id'])
             if not self.instance_location:
@@ -68,11 +63,28 @@ class AzureClient(BaseClient):
         self.zrs_supported_regions = ['westeurope', 'centralus','southeastasia', 'eastus2', 'northeurope', 'francecentral']
 
     def __setCredentials(self, client_id, client_secret, tenant_id):
-        self.__azureCredentials = ServicePrincipalCredentials(
-            client_id=client_id,
-            secret=client_secret,
-            tenant=tenant_id
-        )
+        # The service principal is only needed (and authenticated) by the compute client
+        self.__azureCredentials = {
+            'client_id': client_id,
+            'secret': client_secret,
+            'tenant': tenant_id
+        }
+
+    def create_block_blob_service(self):
+        # The SDKs are imported where they are used, blob operations never load the compute SDK
+        from azure.storage.blob import BlockBlobService
+        return self._warm_client('blob', [self.storage_account_name, self.storage_account_key],
+                                 lambda binding: BlockBlobService(account_name=self.storage_account_name,
+                                                                  account_key=self.storage_account_key))
+
+    def create_compute_client(self):
+        from azure.common.credentials import ServicePrincipalCredentials
+        from azure.mgmt.compute import ComputeManagementClient
+        # The credentials acquire their token on creation, warm ones keep (and refresh) it
+        credentials = self._warm_client('credentials', self.__azureCredentials,
+                                        lambda binding: ServicePrincipalCredentials(**self.__azureCredentials))
+        return self._warm_client('compute', [self.__azureCredentials, self.subscription_id],
+                                 lambda binding: ComputeManagementClient(credentials, self.subscription_id))
 
     def get_container(self):
         try:
@@ -105,9 +117,12 @@ class AzureClient(BaseClient):
                 self.CONTAINER, error))
             return False
 
+    def _get_instance(self, instance_id):
+        return self.compute_client.virtual_machines.get(self.resource_group, instance_id)
+
     def _get_availability_zone_of_server(self, instance_id):
         try:
-            instance = self.compute_client.virtual_machines.get(self.resource_group, instance_id)
+            instance = self._get_cached_instance(instance_id)
             return instance.zones
         except Exception as error:
             self.logger.error('[Azure] ERROR: Unable to find or access attached volume for instance_id {}.{}'.format(instance_id, error))
@@ -143,9 +158,8 @@ class AzureClient(BaseClient):
         '''
         host_number = None
         try:
-            device_persistent_volume = self.shell(
-                'cat {} | grep {}'
-                .format(self.FILE_MOUNTS, self.DIRECTORY_PERSISTENT)).split(' ')[0][5:-1]
+            device_persistent_volume = devices.get_mounted_device(
+                self.DIRECTORY_PERSISTENT, self.FILE_MOUNTS)[5:-1]
             device_paths = glob.glob(
                 '/sys/bus/scsi/devices/*:*:*:*/block/{}'.format(device_persistent_volume))
             if len(device_paths) > 1:
@@ -162,8 +176,7 @@ class AzureClient(BaseClient):
 
     def get_instance_location(self, instance_id):
         try:
-            instance = self.compute_client.virtual_machines.get(
-                self.resource_group, instance_id)
+            instance = self._get_cached_instance(instance_id)
             return instance.location
         except Exception as error:
             self.logger.error(
@@ -171,23 +184,23 @@ class AzureClient(BaseClient):
                     instance_id, error))
             return None
 
+    def _get_device_of_lun(self, lun):
+        device_path = glob.glob(
+            self.DEVICE_PATH_TEMPLATE.format(self.scsi_host_number, lun))
+        if len(device_path) != 1:
+            raise Exception(
+                'Expected number of device path not matching 1 != {} fo lun {}'.format(
+                    len(device_path), lun))
+        # The block directory of a SCSI device contains exactly one entry: the kernel name of the device
+        return '/dev/{}'.format(os.listdir(device_path[0])[0])
+
     def get_attached_volumes_for_instance(self, instance_id):
         try:
-            instance = self.compute_client.virtual_machines.get(
-                self.resource_group, instance_id)
+            instance = self._get_cached_instance(instance_id)
             self.availability_zones = instance.zones
             volume_list = []
             for disk in instance.storage_profile.data_disks:
-                device = None
-                device_path = glob.glob(
-                    self.DEVICE_PATH_TEMPLATE.format(self.scsi_host_number, disk.lun))
-                if len(device_path) != 1:
-                    raise Exception(
-                        'Expected number of device path not matching 1 != {} fo lun {}'.format(
-                            len(device_path), disk.lun))
-                device = '/dev/{}'.format(self.shell(
-                    'ls {}'.format(device_path[0])).rstrip())
-
+                device = self._get_device_of_lun(disk.lun)
                 volume_list.append(
                     Volume(disk.name, 'none', disk.disk_size_gb, device))
             return volume_list
@@ -199,8 +212,7 @@ class AzureClient(BaseClient):
 
     def get_persistent_volume_for_instance(self, instance_id):
         try:
-            device = self.shell(
-                'cat {} | grep {}'.format(self.FILE_MOUNTS, self.DIRECTORY_PERSISTENT)).split(' ')[0][:8]
+            device = devices.get_mounted_device(self.DIRECTORY_PERSISTENT, self.FILE_MOUNTS)[:8]
             for volume in self.get_attached_volumes_for_instance(instance_id):
                 if volume.device == device:
                     self._add_volume_device(volume.id, device)
@@ -216,6 +228,7 @@ class AzureClient(BaseClient):
         return location in self.zrs_supported_regions
 
     def _create_snapshot(self, volume_id):
+        from azure.mgmt.compute.models import DiskCreateOption
         log_prefix = '[SNAPSHOT] [CREATE]'
         snapshot = None
         self.logger.info(
@@ -224,38 +237,23 @@ class AzureClient(BaseClient):
             disk_info = self.compute_client.disks.get(
                 self.resource_group, volume_id)
             snapshot_name = self.generate_name_by_prefix(self.SNAPSHOT_PREFIX)
-            if self.location_supports_zrs(disk_info.location):
-                snapshot_creation_operation = self.compute_client.snapshots.create_or_update(
-                    self.resource_group,
-                    snapshot_name,
-                    {
-                        'location': disk_info.location,
-                        'tags': self.tags,
-                        'creation_data': {
-                            'create_option': DiskCreateOption.copy,
-                            'source_uri': disk_info.id
-                        },
-                        'sku': {
-                            'name': 'Standard_ZRS'
-                        }
-                    }
-                )
-            else:
-                snapshot_creation_operation = self.compute_client.snapshots.create_or_update(
-                    self.resource_group,
-                    snapshot_name,
-                    {
-                        'location': disk_info.location,
-                        'tags': self.tags,
-                        'creation_data': {
-                            'create_option': DiskCreateOption.copy,
-                            'source_uri': disk_info.id
-                        },
-                        'sku': {
-                            'name': 'Standard_LRS'
-                        }
-                    }
-                )
+            snapshot_body = {
+                'location': disk_info.location,
+                'tags': self.tags,
+                'creation_data': {
+                    'create_option': DiskCreateOption.copy,
+                    'source_uri': disk_info.id
+                },
+                'sku': {
+                    'name': 'Standard_ZRS' if self.location_supports_zrs(disk_info.location) else 'Standard_LRS'
+                }
+            }
+            start_time = time.time()
+            snapshot_creation_operation = self.compute_client.snapshots.create_or_update(
+                self.resource_group,
+                snapshot_name,
+                snapshot_body
+            )
 
             self._wait('Waiting for snapshot {} to get ready...'.format(snapshot_name),
                        lambda operation: operation.done() is True,
@@ -268,9 +266,17 @@ class AzureClient(BaseClient):
             snapshot = Snapshot(
                 snapshot_info.name, snapshot_info.disk_size_gb, snapshot_info.time_created, snapshot_info.provisioning_state)
             self._add_snapshot(snapshot.id)
+            duration = round(time.time() - start_time, 3)
             self.logger.info(
-                '{} SUCCESS: snapshot-id={}, volume-id={} , tags={} '.format(log_prefix, snapshot.id, volume_id, self.tags))
+                '{} SUCCESS: snapshot-id={}, volume-id={} , tags={}, duration={}s'.format(
+                    log_prefix, snapshot.id, volume_id, self.tags, duration))
             self.output_json['snapshotId'] = snapshot.id
+            self.output_json['snapshotDuration'] = duration
+            # Full snapshots are billed for the provisioned size of the source disk
+            self.output_json['snapshotSizeGb'] = snapshot.size
+        except Exception as error:
+                    self.logger.warning('{} Unable to prune snapshot chain of volume-id={}\n{}'.format(
+                        log_prefix, volume_id, error))
         except Exception as error:
             message = '{} ERROR: volume-id={}\n{}'.format(
                 log_prefix, volume_id, error)
@@ -313,6 +319,7 @@ class AzureClient(BaseClient):
             raise Exception(message)
 
     def _create_volume(self, size, snapshot_id=None):
+        from azure.mgmt.compute.models import DiskCreateOption, StorageAccountTypes
         log_prefix = '[VOLUME] [CREATE]'
         volume = None
 
@@ -401,6 +408,7 @@ class AzureClient(BaseClient):
             raise Exception(message)
 
     def _create_attachment(self, volume_id, instance_id):
+        from azure.mgmt.compute.models import DiskCreateOptionTypes
         log_prefix = '[ATTACHMENT] [CREATE]'
         attachment = None
 
@@ -448,8 +456,8 @@ class AzureClient(BaseClient):
             if len(new_devices_path) > 1:
                 raise Exception(
                     'Found more than one new devices while attaching volume!')
-            device = '/dev/{}'.format(self.shell(
-                'ls {}'.format(new_devices_path[0])).rstrip())
+            device = '/dev/{}'.format(os.listdir(new_devices_path[0])[0])
+            self._invalidate_cached_instance(instance_id)
             self._add_volume_device(volume_id, device)
             attachment = Attachment(0, volume_id, instance_id)
             self._add_attachment(volume_id, instance_id)
@@ -504,6 +512,7 @@ class AzureClient(BaseClient):
                        disk_detach_operation)
 
             updated_vm = disk_detach_operation.result()
+            self._invalidate_cached_instance(instance_id)
             self._remove_volume_device(volume_id)
             self._remove_attachment(volume_id, instance_id)
             self.logger.info(
@@ -542,7 +551,8 @@ class AzureClient(BaseClient):
                 self.CONTAINER,
                 blob_target_name,
                 blob_to_upload_path,
-                max_connections=max_connections)
+                max_connections=max_connections,
+                progress_callback=self._upload_progress_callback())
             # TODO: need to check above 'blob_target_name'
             self.logger.info('{} SUCCESS: blob_to_upload={}, blob_target_name={}, container={}'.format(
                 log_prefix, blob_to_upload_path, blob_target_name, self.CONTAINER))
@@ -562,7 +572,8 @@ class AzureClient(BaseClient):
             self.block_blob_service.MAX_BLOCK_SIZE = self.max_block_size
             self.block_blob_service.get_blob_to_path(
                 self.CONTAINER, blob_to_download_name, blob_download_target_path,
-                max_connections=max_connections)
+                max_connections=max_connections,
+                progress_callback=lambda current, total: self._check_cancellation())
             self.logger.info('{} SUCCESS: blob_to_download={}, blob_target_name={}, container={}'
                              .format(log_prefix, blob_to_download_name, self.CONTAINER,
                                      blob_download_target_path))
@@ -577,5 +588,6 @@ class AzureClient(BaseClient):
     def _download_from_blobstore_and_pipe_to_process(self, process, blob_to_download_name, segment_size):
         self.block_blob_service.get_blob_to_stream(
             self.CONTAINER, blob_to_download_name, process.stdin,
-            snapshot=None, start_range=0, end_range=segment_size - 1)
+            snapshot=None, start_range=0, end_range=segment_size - 1,
+            progress_callback=lambda current, total: self._check_cancellation())
         return True
@@ -1,19 +1,133 @@
-import requests
 import datetime
 import json
 import signal
 import subprocess
+import threading
 import os
 import sys
 import time
-import types
 import random
-from retrying import retry
-from ..logger import create_logger
+import functools
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from ..logger import create_logger, flush_logger
 from ..config import initialize
+from ..utils.progress import ProgressTracker
+from ..utils.last_operation import LastOperationWriter
+from ..utils import filesystem
+from ..utils import archiver
+from ..utils import backup_plan
+from ..utils import extractor
+from ..utils import reader
+from ..utils import shards
+from ..utils import throttle
+from ..utils.cancellation import CancellationToken, OperationCancelled
+from ..utils.metrics import Metrics
+from ..utils.tracing import Tracer, TracedProxy
+from ..utils.retry_policy import RetryPolicy, CircuitBreaker
+from ..utils.rate_limiter import get_rate_limiter
+from ..utils.warm_clients import warm_clients, cache_key
+from ..utils.credhub import credhub
+from ..utils import container_access
+from ..utils.container_access import container_access_cache
+
+#   Defining the methods which should check (BEFORE and AFTER they get executed) whether the script was asked to abort
+# its execution. Basically, this list contains all methods which are used in backup.py or restore.py scripts. This is
+# done to ensure a 'safe' abortion process in terms of 'correctly cleaning up created resources'. All other methods
+# except those listed below will ignore the demand to abort as it may possibly be not safe in their current state.
+# Long running waits and transfers inside these methods stop early (OperationCancelled) once an abortion is requested.
+METHODS_ALLOW_ABORTING = frozenset([
+    'get_persistent_volume_for_instance', 'copy_snapshot', 'create_snapshot', 'create_volume',
+    'create_attachment', 'get_mountpoint', 'copy_directory', 'delete_directory', 'create_directory', 'format_device',
+    'mount_device', 'create_and_encrypt_tarball_of_directory', 'create_tarball_of_directory', 'encrypt_file',
+    'upload_to_blobstore', 'unmount_device', 'delete_attachment', 'delete_volume', 'delete_snapshot',
+    'download_from_blobstore', 'decrypt_and_extract_tarball_of_directory', 'extract_tarball_of_directory',
+    'decrypt_file', 'download_from_blobstore_decrypt_extract', 'create_and_encrypt_shards_of_directory',
+    'upload_shards_to_blobstore', 'download_from_blobstore_decrypt_extract_shards'
+])
+
+
+#   Stage (key in output.json's metrics) per public method, with the index of the positional argument holding the file
+# read (bytesIn) and written (bytesOut) by the method. The sizes are taken once the method returned.
+METHOD_STAGES = {
+    'stop_service_job': ('stop_service', None, None),
+    'start_service_job': ('start_service', None, None),
+    'get_persistent_volume_for_instance': ('volume_lookup', None, None),
+    'create_snapshot': ('snapshot', None, None),
+    'copy_snapshot': ('copy', None, None),
+    'create_volume': ('volume_create', None, None),
+    'create_attachment': ('attach', None, None),
+    'format_device': ('format', None, None),
+    'mount_device': ('mount', None, None),
+    'copy_directory': ('copy_directory', None, None),
+    'create_tarball_of_directory': ('tar', None, 1),
+    'create_and_encrypt_tarball_of_directory': ('tar_encrypt', None, 1),
+    'create_and_encrypt_shards_of_directory': ('tar_encrypt_shards', None, None),
+    'encrypt_file': ('encrypt', 0, 1),
+    'upload_to_blobstore': ('upload', None, 0),
+    'upload_shards_to_blobstore': ('upload_shards', None, None),
+    'download_from_blobstore': ('download', 1, None),
+    'decrypt_file': ('decrypt', 0, 1),
+    'decrypt_and_extract_tarball_of_directory': ('decrypt_extract', 0, None),
+    'extract_tarball_of_directory': ('extract', 0, None),
+    'download_from_blobstore_decrypt_extract': ('download_decrypt_extract', None, None),
+    'download_from_blobstore_decrypt_extract_shards': ('download_decrypt_extract_shards', None, None),
+    'unmount_device': ('unmount', None, None),
+    'delete_attachment': ('detach', None, None),
+    'delete_volume': ('volume_delete', None, None),
+    'delete_snapshot': ('snapshot_delete', None, None)
+}
+
+
+def _file_size(args, index):
+    if index is None or index >= len(args) or not isinstance(args[index], str):
+        return 0
+    try:
+        return os.path.getsize(args[index])
+    except OSError:
+        return 0
+
+
+def _measure_stage(method, stage, bytes_in_index, bytes_out_index):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.metrics.stage(stage) as measured:
+            if not measured.active:
+                return method(self, *args, **kwargs)
+            with self.tracer.span(method.__name__, stage=stage):
+                result = method(self, *args, **kwargs)
+            self.metrics.add('bytesIn', _file_size(args, bytes_in_index), stage)
+            self.metrics.add('bytesOut', _file_size(args, bytes_out_index), stage)
+            return result
+    return wrapper
+
+
+def _allow_aborting(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._abort_if_cancelled()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._abort_if_cancelled()
+    return wrapper
+
 
+class ClientMeta(type):
+    """Wraps the methods allowing an abortion and the measured stages once per class, so that normal attribute access
+    costs nothing."""
 
-class BaseClient:
+    def __new__(mcs, name, bases, namespace):
+        for attr in METHODS_ALLOW_ABORTING:
+            if callable(namespace.get(attr)):
+                namespace[attr] = _allow_aborting(namespace[attr])
+        for attr, (stage, bytes_in_index, bytes_out_index) in METHOD_STAGES.items():
+            if callable(namespace.get(attr)):
+                namespace[attr] = _measure_stage(namespace[attr], stage, bytes_in_index, bytes_out_index)
+        return super(ClientMeta, mcs).__new__(mcs, name, bases, namespace)
+
+
+class BaseClient(metaclass=ClientMeta):
     def __init__(self, operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time,
                  poll_maximum_time):
         self.OPERATION = operation_name
@@ -51,19 +165,55 @@ class BaseClient:
             assert len(self.SECRET) > 0, 'No encryption secret given.'
             assert len(self.JOB_NAME) > 0, 'No service job name given.'
 
+        # Timings and counters per stage, written into output.json
+        self.metrics = Metrics()
+        self.METRICS_TEXTFILE = os.getenv('SF_BACKUP_RESTORE_METRICS_TEXTFILE')
+        # Spans of the stages, retried attempts and SDK calls (providers hook their SDKs into the tracer)
+        self.PROVIDER = type(self).__name__.replace('Client', '').lower()
+        self.tracer = Tracer(self.PROVIDER, on_finish=self.__record_span)
+        # SDK calls queue for a token of their API family (describe, mutate, storage) before they are sent
+        self.rate_limiter = get_rate_limiter(self.PROVIDER)
+        # Bandwidth limits of the uploads and of the disk reads of the archiver, shared by all transfer threads
+        self.throttle = throttle.Throttle({
+            throttle.UPLOAD: throttle.parse_byte_rate(
+                configuration.get('upload_rate_limit') or throttle.UPLOAD_RATE_LIMIT),
+            throttle.DISK_READ: throttle.parse_byte_rate(
+                configuration.get('disk_read_rate_limit') or throttle.DISK_READ_RATE_LIMIT)
+        }, on_change=self.__throttle_changed, on_wait=self.__throttle_waited)
+
         # Handling abort signals
-        self.__ABORT = False
+        self.__cancellation = CancellationToken()
         signal.signal(signal.SIGINT, self.__schedule_abortion)
         signal.signal(signal.SIGTERM, self.__schedule_abortion)
+        # SIGUSR1 re-reads the limits from the throttle control file
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.throttle.reload())
+
+        # Retries of the IaaS operations depend on the class of the error (see lib/utils/retry_policy)
+        self.__retry_policy = RetryPolicy(breaker=CircuitBreaker(), sleep=self.__wait_for_retry,
+                                          on_retry=self.__log_retry)
+
+        # Progress of the long running operation currently polled (if any)
+        self.__progress = None
+
+        # Key of the container access check (see _check_container_access), None for clients without one
+        self.__container_access_key = None
+        self.__container_access_pending = False
 
         # Writing the last operation file
         initialize(operation_name)
         self.LAST_OPERATION_DIRECTORY = os.getenv(
             'SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY')
         self.LOG_DIRECTORY = os.getenv('SF_BACKUP_RESTORE_LOG_DIRECTORY')
+        self.TRACE_FILE = os.getenv('SF_BACKUP_RESTORE_TRACE_FILE') or os.path.join(
+            self.LOG_DIRECTORY, self.OPERATION + '.traces.json')
+        self.__last_operation_writer = LastOperationWriter(self.LAST_OPERATION_DIRECTORY, self.OPERATION)
+        self.throttle.watch(throttle.THROTTLE_CONTROL_FILE or (os.path.join(
+            self.LAST_OPERATION_DIRECTORY, self.OPERATION + '.throttle.json') if self.LAST_OPERATION_DIRECTORY else None))
         self.last_operation(
             'Initializing Backup & Restore Library ...', 'processing')
         self.logger = create_logger(self)
+        if any(self.throttle.limits().values()):
+            self.logger.info('[THROTTLE] Limits: {}'.format(throttle.format_limits(self.throttle.limits())))
         self.output_json = dict()
         self.json_output()
 
@@ -72,52 +222,126 @@ class BaseClient:
             'poll_delay_time': poll_delay_time if poll_delay_time is not None else 10,
             'poll_maximum_time': poll_maximum_time if poll_maximum_time is not None else 300
         }
+        # Settings chosen from a survey of the data (see plan_backup)
+        self.backup_plan = None
         self.__snapshots_ids = []
         self.__volumes_ids = []
         self.__volumes_attached_ids = []
         self.__mounted_devices = []
         self.__devices = {}
+        self.__instances = {}
 
-    def _get_credentials_from_credhub(self, *args):
-        access_token = self._retry(self.__getAccessToken, args)
-        params = [args[0], access_token]
-        return self._retry(self.__get_credentials_from_credhub, params)
-    
-    def __get_credentials_from_credhub(self, configuration, access_token):
-        params = {'name': configuration['credhub_key'],
-                  'current': 'true'}
-        headers = {'content-type': 'application/json',
-                   'authorization': 'bearer ' + access_token}
-        response = requests.get(url=configuration['credhub_url'].rstrip(
-            '/') + '/v1/data', headers=headers, params=params, verify=False)
-        credentials = response.json()
-        self.container_credentials = credentials['data'][0]['value']
+    def _get_credentials_from_credhub(self, configuration):
+        # The UAA token and the credentials are cached (see lib/utils/credhub), a retry reuses the token fetched by
+        # the failed attempt
+        self.container_credentials = self._retry(credhub.get_credentials, [configuration])
         return self.container_credentials
 
-    def __getAccessToken(self, configuration):
-        payload = {
-            'grant_type' : 'password',
-            'client_id' : configuration['credhub_client_id'],
-            'client_secret': configuration['credhub_client_secret'],
-            'response_type': 'token',
-            'username': configuration['credhub_username'],
-            'password': configuration['credhub_user_password']
-        }
-        response = requests.post(url = configuration['credhub_uaa_url']+ '/oauth/token', data = payload, verify=False)
-        authToken = response.json()
-        return authToken['access_token']
-
     def __schedule_abortion(self, signum, frame):
-        if self.__ABORT:
+        self.request_abortion('Received SIGINT/SIGTERM ({})'.format(signum))
+
+    def request_abortion(self, reason):
+        """Schedule a safe abortion, as on SIGINT/SIGTERM: the clean-up starts at the next method allowing it.
+
+        :param reason: a string explaining the request, logged with it
+
+        :Example:
+            ::
+
+                iaas_client.request_abortion('Abort requested through the agent API')
+        """
+        if self.__cancellation.cancelled:
             self.logger.info(
                 '[ABORT] REQUEST REJECTED: An abortion has already been scheduled.')
         else:
-            self.logger.info('[ABORT] REQUEST ACCEPTED: Received SIGINT/SIGTERM ({}). Preparing a safe abortion...'
-                             .format(signum), 'aborting')
-            self.__ABORT = True
+            self.logger.info('[ABORT] REQUEST ACCEPTED: {}. Preparing a safe abortion...'.format(reason), 'aborting')
+            self.__cancellation.cancel()
+
+    def __record_span(self, span):
+        if span.kind == 'client':
+            self.metrics.add('apiCalls')
+            if span.attributes.get('queued'):
+                self.metrics.add('rateLimitWait', span.attributes['queued'])
+
+    def _trace_client(self, client, prefix, depth=1, describe=None, family=None):
+        # Traces every method call of an SDK client (and of its operation groups up to depth) as a client span, after
+        # the call passed the rate limiter
+        return TracedProxy(client, self.tracer, prefix, depth, describe, self.rate_limiter, family)
+
+    def _warm_client(self, kind, credentials, factory):
+        # SDK clients are created by factory(binding) and kept warm for the following operations when running in the
+        # backup agent daemon (see lib/utils/warm_clients); hooks must call the IaaS client through the binding
+        return warm_clients.get(cache_key(self.PROVIDER, kind, credentials), factory, self)
+
+    def _check_container_access(self, identity, probe, head):
+        """Check the access to the container with the strategy of SF_BACKUP_RESTORE_CONTAINER_ACCESS_CHECK.
+
+        :param identity: what the container is accessed with, e.g. the credentials (hashed into the cache key)
+        :param probe: function writing and deleting a test blob
+        :param head: function checking that the container exists and can be read, without writing
+        :raises: the errors of probe and head
+
+        See lib/utils/container_access for the strategies; with lazy the first upload checks the access.
+        """
+        strategy = container_access.CONTAINER_ACCESS_CHECK
+        self.__container_access_key = container_access.access_key(self.PROVIDER, self.CONTAINER, identity)
+        if strategy == container_access.PROBE:
+            probe()
+        elif strategy == container_access.HEAD:
+            head()
+        elif strategy == container_access.CACHED:
+            if not container_access_cache.is_verified(self.__container_access_key):
+                probe()
+                container_access_cache.verified(self.__container_access_key)
+        elif strategy == container_access.LAZY:
+            self.__container_access_pending = True
+        else:
+            raise Exception('Invalid container access check {}, possible values: {}'.format(
+                strategy, '/'.join(container_access.STRATEGIES)))
+
+    def __upload_failed(self, error):
+        # a cached probe may be outdated (e.g. revoked permissions), the next client probes the container again
+        container_access_cache.forget(self.__container_access_key)
+        if self.__container_access_pending and not isinstance(error, OperationCancelled):
+            self.logger.error('[CONTAINER] {} {}\n{}'.format(container_access.ACCESS_ERROR, self.CONTAINER, error))
+            self.last_operation(container_access.ACCESS_ERROR, 'failed')
+            return Exception('{}\n{}'.format(container_access.ACCESS_ERROR, error))
+        return error
+
+    def _abort_if_cancelled(self):
+        # only the main thread cleans up and exits (signal handlers, sys.exit); threads of a concurrent stage stop
+        # with OperationCancelled and leave the abortion to the wrapper of the stage in the main thread
+        if threading.current_thread() is not threading.main_thread():
+            self.__cancellation.check()
+        elif self.__cancellation.cancelled:
+            self.__abort()
+
+    def _check_cancellation(self):
+        # Safe point for long running loops: raises OperationCancelled if an abortion was requested
+        self.__cancellation.check()
+
+    def _upload_progress(self, transferred):
+        # Progress callback of the uploads with the bytes sent since the last call (by any transfer thread): waits for
+        # the upload limit, then checks for an abortion
+        self.throttle.acquire(throttle.UPLOAD, transferred)
+        self._check_cancellation()
+
+    def _upload_progress_callback(self):
+        # _upload_progress as a callback of the bytes uploaded so far and the total (Azure, OSS)
+        return throttle.increments(self._upload_progress)
+
+    def __throttle_changed(self, limits, error):
+        if error is not None:
+            self.logger.error('[THROTTLE] ERROR: The control file {} could not be read: {}'.format(
+                self.throttle.control_file, error))
+        else:
+            self.logger.info('[THROTTLE] Limits changed: {}'.format(throttle.format_limits(limits)))
+
+    def __throttle_waited(self, kind, seconds):
+        self.metrics.add('throttleWait', seconds)
 
     def __abort(self):
-        self.__ABORT = False
+        self.__cancellation.reset()
         # Prevent multiple abortion requests
         signal.signal(signal.SIGINT, lambda *args: None)
         signal.signal(signal.SIGTERM, lambda *args: None)
@@ -129,30 +353,16 @@ class BaseClient:
         self.start_service_job()
         self.wait_for_service_job_status('running')
         self.logger.info('[ABORT] Clean-up finished. Aborting now.')
+        self.export_traces()
+        self.json_output()
         self.last_operation(
             'SIGINT/SIGTERM received: Abortion completed.', 'aborted')
+        flush_logger()
         sys.exit()
 
-    def __getattribute__(self, attr):
-        method = object.__getattribute__(self, attr)
-        #   Defining the methods which should check (BEFORE they get executed) whether the script was asked to abort its
-        # execution. Basically, this list contains all methods which are used in backup.py or restore.py scripts. This is
-        # done to ensure a 'safe' abortion process in terms of 'correctly cleaning up created resources'. All other methods
-        # except those listed below will ignore the demand to abort as it may possibly be not safe in their current state.
-        methods_allow_aborting = [
-            'get_persistent_volume_for_instance', 'copy_snapshot', 'create_snapshot', 'create_volume',
-            'create_attachment', 'get_mountpoint', 'copy_directory', 'delete_directory', 'create_directory', 'format_device',
-            'mount_device', 'create_and_encrypt_tarball_of_directory', 'create_tarball_of_directory', 'encrypt_file', 'upload_to_blobstore', 'unmount_device', 'delete_attachment',
-            'delete_volume', 'delete_snapshot', 'download_from_blobstore', 'decrypt_and_extract_tarball_of_directory', 'extract_tarball_of_directory', 'decrypt_file'
-        ]
-        if isinstance(method, types.MethodType) and attr in methods_allow_aborting and self.__ABORT:
-            self.__abort()
-        else:
-            return method
-
     def _retry(self, function, args, throw_exception=None):
         try:
-            return self.__retry_rescuer(function, args)
+            return self.__retry_policy.run(lambda attempt: self.__retry_attempt(function, args, attempt))
         except Exception as error:
             if throw_exception == True:
                 self.logger.error(error)
@@ -160,25 +370,74 @@ class BaseClient:
             else:
                 return None
 
-    # Retrying configuration parameters currently hard-coded - can be made configurable in future (if needed by anybody)
-    @retry(stop_max_attempt_number=5, stop_max_delay=600000, wait_fixed=10000)
-    def __retry_rescuer(self, function, args):
+    def __retry_attempt(self, function, args, attempt):
+        self.__cancellation.check()
+        self.metrics.add('attempts')
         try:
-            return function(*args)
+            with self.tracer.span(getattr(function, '__name__', 'call'), attempt=attempt):
+                return function(*args)
         except Exception as error:
             self.logger.error(error)
+            if self.__cancellation.cancelled:
+                raise OperationCancelled(error)
             raise error
 
+    def __log_retry(self, error, error_class, attempt, delay):
+        self.metrics.add('retries')
+        self.metrics.add('retryWait', delay)
+        self.logger.debug('[RETRY] Attempt {} failed ({} error), retrying in {:.1f}s'.format(attempt, error_class, delay))
+
+    def __wait_for_retry(self, delay):
+        if self.__cancellation.wait(delay):
+            raise OperationCancelled('Abortion requested while waiting for a retry')
+
     def _wait(self, log_message, success_condition_function, update_function, *success_condition_arguments):
         timeout = time.time() + self.configuration['poll_maximum_time']
         while not success_condition_function(*success_condition_arguments):
             if time.time() > timeout:
                 raise Exception('Maximum polling time exceeded.')
             self.logger.info(log_message)
-            time.sleep(self.configuration['poll_delay_time'])
+            self.metrics.add('polls')
+            started_waiting = time.time()
+            cancelled = self.__cancellation.wait(self.configuration['poll_delay_time'])
+            self.metrics.add('waitTime', time.time() - started_waiting)
+            if cancelled:
+                raise OperationCancelled('Abortion requested while {}'.format(log_message))
             if update_function:
                 update_function()
 
+    def _start_progress(self, name, total_bytes=None):
+        self.__progress = ProgressTracker(name, total_bytes)
+
+    def _report_progress(self, percent=None, bytes_done=None, total_bytes=None):
+        # Providers report whatever their polling calls return; without a started operation this is a no-op
+        if self.__progress:
+            self.__progress.update(percent, bytes_done, total_bytes)
+
+    def _finish_progress(self, succeeded=True):
+        if not self.__progress:
+            return
+        if succeeded:
+            self.__progress.finish()
+        self.output_json.setdefault('progress', {})[self.__progress.name] = self.__progress.as_dict()
+        self.__progress = None
+
+    def _get_instance(self, instance_id):
+        raise NotImplementedError()
+
+    def _get_cached_instance(self, instance_id):
+        # Instance metadata is fetched at most once per run and shared between the availability zone lookup and
+        # the attached volumes lookup. Attaching or detaching volumes must invalidate the cached entry.
+        if instance_id not in self.__instances:
+            self.__instances[instance_id] = self._get_instance(instance_id)
+        return self.__instances[instance_id]
+
+    def _set_cached_instance(self, instance_id, instance):
+        self.__instances[instance_id] = instance
+
+    def _invalidate_cached_instance(self, instance_id):
+        self.__instances.pop(instance_id, None)
+
     def _add_volume_device(self, volume_id, device):
         self.__devices[volume_id] = device
 
@@ -256,6 +515,7 @@ class BaseClient:
                 iaas_client.finalize('A log messages before the program ends.')
         """
         # write stored json to file
+        self.export_traces()
         self.json_output()
         if message:
             self.logger.info(message)
@@ -265,6 +525,8 @@ class BaseClient:
             self.OPERATION.upper(), self.TYPE, time.strftime("%Y-%m-%dT%H-%M-%SZ")))
         self.last_operation('{} completed successfully'.format(
             self.OPERATION.title()), 'succeeded')
+        # queued log records are written before the caller exits
+        flush_logger()
 
     def exit(self, message):
         """Clean up all created resources, start the service job and exit the process.
@@ -280,21 +542,64 @@ class BaseClient:
         self.clean_up()
         self.start_service_job()
         self.wait_for_service_job_status('running')
+        self.export_traces()
+        self.json_output()
         self.last_operation(message, 'failed')
+        flush_logger()
         sys.exit()
 
     def json_output(self):
-        """Write the current output_json into file.
+        """Write the current output_json into file, together with the metrics collected so far.
+
+        If SF_BACKUP_RESTORE_METRICS_TEXTFILE is set, the metrics are written into this file as well (in the Prometheus
+        text format, to be picked up by the node exporter's textfile collector).
 
         :Example:
             ::
 
                 iaas_client.json_output()
         """
+        self.output_json['metrics'] = self.metrics.as_dict()
         filepath = os.path.join(
             self.LOG_DIRECTORY, self.OPERATION + '.output.json')
         with open(filepath, 'w') as json_output_file:
             json_output_file.write(json.dumps(self.output_json))
+        if self.METRICS_TEXTFILE:
+            try:
+                self.metrics.write_prometheus(self.METRICS_TEXTFILE, {
+                    'operation': self.OPERATION,
+                    'type': self.TYPE,
+                    'job': getattr(self, 'JOB_NAME', ''),
+                    'instance_id': getattr(self, 'INSTANCE_ID', '')
+                })
+            except OSError as error:
+                self.logger.error('[METRICS] Could not write {}: {}'.format(self.METRICS_TEXTFILE, error))
+
+    def export_traces(self):
+        """Write the recorded spans as OTLP/JSON into the trace file and their latency summary into output_json.
+
+        The trace file is SF_BACKUP_RESTORE_TRACE_FILE or <log directory>/<operation>.traces.json.
+
+        :Example:
+            ::
+
+                iaas_client.export_traces()
+        """
+        self.output_json['latencies'] = {
+            name: {key: summary[key] for key in ('count', 'errors', 'p50', 'p95', 'max', 'sum')}
+            for name, summary in self.tracer.histogram().items()
+        }
+        self.logger.debug('[TRACING] Latencies of {} spans ({} dropped):\n{}'.format(
+            len(self.tracer.spans), self.tracer.dropped, '\n'.join(self.tracer.format_histogram())))
+        try:
+            self.tracer.export(self.TRACE_FILE, {
+                'operation': self.OPERATION,
+                'backup.type': self.TYPE,
+                'backup.guid': getattr(self, 'GUID', ''),
+                'instance.id': getattr(self, 'INSTANCE_ID', '')
+            })
+        except OSError as error:
+            self.logger.error('[TRACING] Could not write {}: {}'.format(self.TRACE_FILE, error))
 
     def last_operation(self, stage, state=None):
         """Write the current state and the current stage to the file storing information about the last operation.
@@ -309,30 +614,29 @@ class BaseClient:
                 iaas_client.last_operation('Creating Volume')
                 iaas_client.last_operation('Backup completed successfully', 'succeeded')
         """
-        SYMLINK = os.path.join(self.LAST_OPERATION_DIRECTORY,
-                               self.OPERATION + '.lastoperation.json')
-        BLUE = os.path.join(self.LAST_OPERATION_DIRECTORY,
-                            self.OPERATION + '.lastoperation.blue.json')
-        GREEN = os.path.join(self.LAST_OPERATION_DIRECTORY,
-                             self.OPERATION + '.lastoperation.green.json')
-
-        def read_link():
-            return os.readlink(SYMLINK)
-
-        def set_link(target):
-            return self.shell('ln -sf {} {}'.format(target, SYMLINK), False)
-
         if state:
             self.last_operation_state = state
-        content = json.dumps({
+        content = {
             'state': self.last_operation_state,
             'stage': stage,
             'updated_at': datetime.datetime.utcfromtimestamp(time.time()).strftime('%Y-%m-%dT%H:%M:%SZ')
-        })
-        filename = GREEN if read_link() == BLUE else BLUE
-        with open(filename, 'w') as last_operation_file:
-            last_operation_file.write(content)
-        set_link(filename)
+        }
+        if self.__progress:
+            content['progress'] = self.__progress.as_dict()
+        # State changes are written immediately, other updates are coalesced (see LastOperationWriter)
+        self.__last_operation_writer.write(content)
+
+    def close(self):
+        """Write pending last operation updates and log records, for processes running further operations (e.g. the
+        daemon).
+
+        :Example:
+            ::
+
+                iaas_client.close()
+        """
+        self.__last_operation_writer.close()
+        flush_logger()
 
     def shell(self, command, log_command=True):
         """Execute a shell command.
@@ -397,6 +701,10 @@ class BaseClient:
 
                 iaas_client.wait_for_service_job_status('running')
         """
+        with self.metrics.stage('start_service' if status == 'running' else 'stop_service'):
+            return self.__wait_for_service_job_status(status)
+
+    def __wait_for_service_job_status(self, status):
         timeout = time.time() + self.configuration['poll_maximum_time']
         while True:
             job_status = self.get_service_job_status().lower()
@@ -413,6 +721,8 @@ class BaseClient:
             else:
                 self.logger.info(
                     'Waiting for job "{}" to have status "{}"...'.format(self.JOB_NAME, status))
+                self.metrics.add('polls')
+                self.metrics.add('waitTime', self.configuration['poll_delay_time'])
                 time.sleep(self.configuration['poll_delay_time'])
 
     def clean_up(self):
@@ -457,7 +767,7 @@ class BaseClient:
 
                 iaas_client.create_directory('/tmp/backup/files')
         """
-        return self.shell('mkdir -p {}'.format(directory))
+        return self._check_filesystem_result(filesystem.make_directory(directory))
 
     def delete_directory(self, directory):
         """Delete a directory.
@@ -469,7 +779,7 @@ class BaseClient:
 
                 iaas_client.delete_directory('/tmp/backup/files')
         """
-        return self.shell('rm -rf {}'.format(directory))
+        return self._check_filesystem_result(filesystem.remove_tree(directory))
 
     def copy_directory(self, source, dest):
         """copy a directory.
@@ -482,7 +792,36 @@ class BaseClient:
 
                 iaas_client.copy_directory('/tmp/backup/files', '/var/vcap/store/files')
         """
-        return self.shell('cp -r {} {}'.format(source, dest))
+        return self._check_filesystem_result(filesystem.copy_tree(source, dest))
+
+    def _check_filesystem_result(self, result):
+        # The FilesystemResult evaluates to False if any entry failed, like shell() returning None
+        if result:
+            self.logger.debug('[FILESYSTEM] {}'.format(result))
+        else:
+            self.logger.error('[FILESYSTEM] ERROR: {}'.format(result))
+        return result
+
+    def _extract_output(self, process, directory):
+        """Extract the tar stream process writes to its stdout into directory with the parallel extractor.
+
+        The extraction runs in a thread, so that the caller can feed the stdin of process; join the returned thread
+        before reading the result (a FilesystemResult) from the returned list.
+        """
+        results = []
+
+        def extract():
+            try:
+                results.append(extractor.extract_stream(process.stdout, directory))
+                # the padding after the end of the archive, gpg must not fail writing it to a closed pipe
+                while process.stdout.read(65536):
+                    pass
+            finally:
+                process.stdout.close()
+
+        thread = threading.Thread(target=extract, name='extractor', daemon=True)
+        thread.start()
+        return thread, results
 
     def format_device(self, device, filesystem='ext4'):
         """Create an ext4 filesystem on a volume identified by its device name.
@@ -536,6 +875,34 @@ class BaseClient:
             self._remove_mounted_device(device)
         return cmd
 
+    def plan_backup(self, directory):
+        """Survey a directory and choose the settings of its backup from the file sizes and a compressibility sample.
+
+        The plan (codec, sparse files, part size and concurrency of the upload, maximum polling time) is used by
+        create_and_encrypt_tarball_of_directory and the uploads of the providers supporting it, raises the configured
+        maximum polling time if needed and is written into the output json.
+
+        :param directory: the path to the directory to be backed up
+        :returns: a ``BackupPlan``
+
+        :Example:
+            ::
+
+                iaas_client.plan_backup('/var/vcap/store/blueprint/files')
+        """
+        self.logger.info('[PLAN] Started surveying {} ...'.format(directory))
+        survey = filesystem.survey_tree(directory)
+        if not survey:
+            self.logger.warning('[PLAN] {} entries could not be surveyed: {}'.format(
+                len(survey.errors), survey.errors[:10]))
+        self.backup_plan = backup_plan.plan_backup(survey, self.configuration['poll_maximum_time'])
+        self.configuration['poll_maximum_time'] = self.backup_plan.poll_maximum_time
+        self.output_json['backupPlan'] = self.backup_plan.as_dict()
+        self.logger.info('[PLAN] ... finished: {} files, {} bytes ({} allocated), compression ratio {} in {:.1f}s: {}'
+                         .format(survey.files, survey.size, survey.allocated, survey.compression_ratio,
+                                 survey.duration, self.backup_plan))
+        return self.backup_plan
+
     def create_and_encrypt_tarball_of_directory(self, directory_to_encrypt, encrypted_tarball_name):
         """Create a tarball of a directory and encrypt it with the secret provided at class instantiation.
 
@@ -549,11 +916,140 @@ class BaseClient:
         """
         self.logger.info(
             '[ENCRYPTION] Started creating, encrypting and copying a tarball ...')
-        result = self.shell('tar -cpz -C {} . | gpg --symmetric --no-use-agent --cipher-algo aes256 --passphrase {} -o {}'
-                            .format(directory_to_encrypt, self.SECRET, encrypted_tarball_name), False)
+        if self._use_archiver():
+            result = self._archive_and_encrypt(directory_to_encrypt, encrypted_tarball_name)
+        else:
+            result = self.shell(self._encrypted_archive_command(directory_to_encrypt, '.', encrypted_tarball_name),
+                                False)
         self.logger.info('[ENCRYPTION] ... finished.')
         return result
 
+    def _use_archiver(self):
+        # the adaptive archiver does not detect holes, sparse files are left to GNU tar; the disk read limit needs the
+        # in-process reads of the archiver
+        return (archiver.ARCHIVER == archiver.ADAPTIVE or self.throttle.limited(throttle.DISK_READ)) and \
+            not (self.backup_plan and self.backup_plan.sparse)
+
+    def _archive_and_encrypt(self, directory, encrypted_tarball_name, names=None):
+        """Archive directory (or the names in it) with the adaptive archiver and encrypt the archive with gpg.
+
+        The codec decisions and the compression time saved are added to the metrics of the running stage. The files
+        are read sequentially (see reader.SequentialReader) within the disk read limit (if any); online backups drop
+        the pages they read from the page cache by default, so that the working set of the running service stays cached.
+
+        :returns: None if an error occurred, or True
+        """
+        level = 1 if self.backup_plan and self.backup_plan.codec == 'gzip-fast' else archiver.COMPRESSION_LEVEL
+        process = subprocess.Popen('gpg --symmetric --no-use-agent --cipher-algo aes256 --passphrase {} -o {}'.format(
+            self.SECRET, encrypted_tarball_name), shell=True, stdin=subprocess.PIPE)
+        try:
+            report = archiver.write_archive(directory, process.stdin, names, level, functools.partial(
+                reader.SequentialReader, drop_cache=reader.drop_cache(self.TYPE), throttle=self.throttle))
+            process.stdin.close()
+        except OSError as error:
+            # gpg failed, its exit code is reported below
+            self.logger.error('[ARCHIVE] ERROR: {}: {}'.format(encrypted_tarball_name, error))
+            report = None
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+        exitcode = process.wait()
+        if exitcode != 0:
+            self.logger.error('[ARCHIVE] ERROR: gpg returned with exit code {}.'.format(exitcode))
+        if report is None:
+            return None
+        for counter, value in (('filesCompressed', report.files_compressed), ('filesStored', report.files_stored),
+                               ('bytesCompressed', report.bytes_compressed), ('bytesStored', report.bytes_stored),
+                               ('compressionTime', report.compression_time),
+                               ('compressionTimeSaved', report.compression_time_saved)):
+            self.metrics.add(counter, value)
+        if report:
+            self.logger.info('[ARCHIVE] {}'.format(report))
+        else:
+            self.logger.error('[ARCHIVE] ERROR: {}'.format(report))
+        return True if report and exitcode == 0 else None
+
+    def _encrypted_archive_command(self, directory, members, encrypted_tarball_name):
+        # the codec and the archiving of sparse files follow the backup plan (if any)
+        sparse = 'S' if self.backup_plan and self.backup_plan.sparse else ''
+        if self.backup_plan and self.backup_plan.codec == 'gzip-fast':
+            archive = 'tar -cp{} -C {} {} | gzip -1'.format(sparse, directory, members)
+        else:
+            archive = 'tar -cpz{} -C {} {}'.format(sparse, directory, members)
+        return '{} | gpg --symmetric --no-use-agent --cipher-algo aes256 --passphrase {} -o {}'.format(
+            archive, self.SECRET, encrypted_tarball_name)
+
+    def create_and_encrypt_shards_of_directory(self, directory_to_encrypt, encrypted_tarball_name, shard_count=None):
+        """Archive a directory as shards of balanced sizes, created and encrypted concurrently, and a manifest.
+
+        The files are split into shard_count (default: SF_BACKUP_RESTORE_ARCHIVE_SHARDS) lists, each archived by its
+        own tar | gzip | gpg pipeline into <encrypted_tarball_name>.shard-<n>; the directories are archived into
+        <encrypted_tarball_name>.directories. <encrypted_tarball_name>.manifest.json ties them together, see
+        upload_shards_to_blobstore and download_from_blobstore_decrypt_extract_shards.
+
+        :param directory_to_encrypt: the path to the directory to be archived and encrypted
+        :param encrypted_tarball_name: the path prefix of the resulting archives
+        :param shard_count: the maximum number of archives of the files
+        :returns: None if an error occurred, or the ``ArchiveManifest``
+
+        :Example:
+            ::
+
+                iaas_client.create_and_encrypt_shards_of_directory('/var/vcap/store/blueprint/files', '/tmp/backup/files.tar.gz')
+        """
+        log_prefix = '[ENCRYPTION] [SHARDS]'
+        self.logger.info('{} Started creating and encrypting the shards of {} ...'.format(
+            log_prefix, directory_to_encrypt))
+        try:
+            directories, partition = shards.partition_tree(directory_to_encrypt, shard_count or shards.ARCHIVE_SHARDS)
+        except OSError as error:
+            self.logger.error('{} ERROR: {}'.format(log_prefix, error))
+            return None
+        archives = [(shards.DIRECTORIES_SUFFIX, directories)] + [
+            (shards.shard_suffix(index), names) for index, (_, names) in enumerate(partition)]
+        if self._use_archiver():
+            # the archives are written by threads, zlib releases the GIL while it compresses
+            with ThreadPoolExecutor(max_workers=len(archives)) as executor:
+                results = list(executor.map(lambda archive: self._check_cancellation() or self._archive_and_encrypt(
+                    directory_to_encrypt, encrypted_tarball_name + archive[0], archive[1]), archives))
+            errors = ['{} failed'.format(suffix) for (suffix, _), result in zip(archives, results) if not result]
+        else:
+            errors = self.__run_archive_commands(directory_to_encrypt, encrypted_tarball_name, archives)
+        if errors:
+            self.logger.error('{} ERROR: {}'.format(log_prefix, errors))
+            return None
+
+        manifest = shards.create_manifest(directories, partition)
+        shards.write_manifest(encrypted_tarball_name + shards.MANIFEST_SUFFIX, manifest)
+        self.metrics.add('bytesOut', sum(_file_size([encrypted_tarball_name + suffix], 0) for suffix, _ in archives))
+        self.output_json['archiveManifest'] = manifest.as_dict()
+        self.logger.info('{} ... finished: {}'.format(log_prefix, manifest))
+        return manifest
+
+    def __run_archive_commands(self, directory, encrypted_tarball_name, archives):
+        # one tar | gzip | gpg pipeline per (suffix, names) archive, all running at the same time
+        processes = []
+        try:
+            for suffix, names in archives:
+                list_path = encrypted_tarball_name + suffix + shards.LIST_SUFFIX
+                shards.write_list(list_path, names)
+                command = self._encrypted_archive_command(directory, '--no-recursion --null -T {}'.format(list_path),
+                                                          encrypted_tarball_name + suffix)
+                processes.append((suffix, subprocess.Popen(command, shell=True)))
+            exitcodes = [(suffix, process.wait()) for suffix, process in processes]
+            return ['{} returned {}'.format(suffix, exitcode) for suffix, exitcode in exitcodes if exitcode != 0]
+        except OSError as error:
+            for _, process in processes:
+                process.wait()
+            return [str(error)]
+        finally:
+            for suffix, _ in archives:
+                try:
+                    os.remove(encrypted_tarball_name + suffix + shards.LIST_SUFFIX)
+                except OSError:
+                    pass
+
     def decrypt_and_extract_tarball_of_directory(self, encrypted_tarball_name, directory_to_extract):
         """Decrypt with the secret provided at class instantiation, and extract an encrypted tarball of a directory.
 
@@ -569,11 +1065,21 @@ class BaseClient:
             return None
         self.logger.info(
             '[DECRYPTION] Started cleaning the directory\'s old contents ...')
-        if self.shell('rm -rf {}/*'.format(directory_to_extract)):
+        if self._check_filesystem_result(filesystem.clear_directory(directory_to_extract)):
             self.logger.info(
                 '[DECRYPTION] ... finished. Started decrypting and extracting a tarball ...')
-            result = self.shell('gpg --no-use-agent --passphrase {} -d {} | tar -xzf - -C {}/'
-                                .format(self.SECRET, encrypted_tarball_name, directory_to_extract), False)
+            if extractor.EXTRACTOR == extractor.PARALLEL:
+                process = subprocess.Popen('gpg --no-use-agent --passphrase {} -d {}'.format(
+                    self.SECRET, encrypted_tarball_name), shell=True, stdout=subprocess.PIPE)
+                thread, results = self._extract_output(process, directory_to_extract)
+                thread.join()
+                exitcode = process.wait()
+                if exitcode != 0:
+                    self.logger.error('[DECRYPTION] ERROR: gpg returned with exit code {}.'.format(exitcode))
+                result = (exitcode == 0 and results and self._check_filesystem_result(results[0])) or None
+            else:
+                result = self.shell('gpg --no-use-agent --passphrase {} -d {} | tar -xzf - -C {}/'
+                                    .format(self.SECRET, encrypted_tarball_name, directory_to_extract), False)
             self.logger.info('[DECRYPTION] ... finished.')
             return result
         return None
@@ -609,11 +1115,15 @@ class BaseClient:
             return None
         self.logger.info(
             '[DECOMPRESSION] Started cleaning the directory\'s old contents ...')
-        if self.shell('rm -rf {}/*'.format(directory_to_extract)):
+        if self._check_filesystem_result(filesystem.clear_directory(directory_to_extract)):
             self.logger.info(
                 '[DECOMPRESSION] Started extracting a tarball ...')
-            result = self.shell('tar -xvf {} -C {}'
-                                .format(tarball_name, directory_to_extract), False)
+            if extractor.EXTRACTOR == extractor.PARALLEL:
+                result = self._check_filesystem_result(
+                    extractor.extract_file(tarball_name, directory_to_extract)) or None
+            else:
+                result = self.shell('tar -xvf {} -C {}'
+                                    .format(tarball_name, directory_to_extract), False)
             self.logger.info('[DECOMPRESSION] ... finished.')
             return result
         return None
@@ -650,7 +1160,7 @@ class BaseClient:
         if not decrypted_file_name or len(decrypted_file_name) == 0:
             return None
         self.logger.info('[DECRYPTION] Started removing the old file ...')
-        if self.shell('rm -f {}'.format(decrypted_file_name)):
+        if self._check_filesystem_result(filesystem.remove_tree(decrypted_file_name)):
             self.logger.info(
                 '[DECRYPTION] ... finished. Started decrypting a file ...')
             result = self.shell('gpg --no-use-agent --passphrase {} -d -o {} {}'
@@ -900,7 +1410,64 @@ class BaseClient:
 
                 iaas_client.upload_to_blobstore('/tmp/backup/files.tar.gz', 'files.tar.gz', True)
         """
-        return self._retry(self._upload_to_blobstore, args, throw_exception)
+        return self.__upload(args, throw_exception)
+
+    def __upload(self, args, throw_exception):
+        # upload_to_blobstore without its stage and abortion checks, for the threads of upload_shards_to_blobstore
+        if self.__container_access_key is None:
+            return self._retry(self._upload_to_blobstore, args, throw_exception)
+        try:
+            result = self._retry(self._upload_to_blobstore, args, True)
+        except Exception as error:
+            error = self.__upload_failed(error)
+            if throw_exception == True:
+                raise error
+            return None
+        if self.__container_access_pending:
+            self.__container_access_pending = False
+            self.logger.info('[CONTAINER] The first upload verified the access to container {}.'.format(self.CONTAINER))
+        return result
+
+    def upload_shards_to_blobstore(self, encrypted_tarball_name, blob_target_name, throw_exception=None):
+        """Upload the shards created by create_and_encrypt_shards_of_directory concurrently, and then their manifest.
+
+        The blobs are named like the files, with blob_target_name as prefix; as the manifest is uploaded last, a
+        backup without it is incomplete.
+
+        :param encrypted_tarball_name: the path prefix of the archives
+        :param blob_target_name: the name prefix of the uploaded files in the BLOB storage
+        :param throw_exception: flag which determines if the exception should be thrown back to the invoker (default: False)
+
+        :Example:
+            ::
+
+                iaas_client.upload_shards_to_blobstore('/tmp/backup/files.tar.gz', 'a3e8d7f2/files.tar.gz')
+        """
+        manifest_path = encrypted_tarball_name + shards.MANIFEST_SUFFIX
+        try:
+            manifest = shards.read_manifest(manifest_path)
+            suffixes = [manifest.directories['name']] + [shard['name'] for shard in manifest.shards]
+            with ThreadPoolExecutor(max_workers=max(1, min(len(suffixes), shards.ARCHIVE_SHARDS))) as executor:
+                results = list(executor.map(lambda suffix: self.__upload_shard(
+                    encrypted_tarball_name + suffix, blob_target_name + suffix), suffixes))
+            if not all(results):
+                raise Exception('{} of {} shards were not uploaded.'.format(
+                    len([result for result in results if not result]), len(results)))
+        except Exception as error:
+            self.logger.error('[UPLOAD] [SHARDS] ERROR: blob_target_name={}, container={}\n{}'.format(
+                blob_target_name, self.CONTAINER, error))
+            if throw_exception == True:
+                raise
+            return None
+        result = self.__upload([manifest_path, blob_target_name + shards.MANIFEST_SUFFIX], throw_exception)
+        # the uploads of the threads are measured here, in the stage of the shards
+        self.metrics.add('bytesOut', sum(_file_size([encrypted_tarball_name + suffix], 0)
+                                         for suffix in suffixes + [shards.MANIFEST_SUFFIX]))
+        return result
+
+    def __upload_shard(self, blob_to_upload_path, blob_target_name):
+        self._check_cancellation()
+        return self.__upload([blob_to_upload_path, blob_target_name], True)
 
     def download_from_blobstore(self, *args, throw_exception=None):
         """Download a file from the BLOB storage.
@@ -929,20 +1496,33 @@ class BaseClient:
 
                 iaas_client.download_from_blobstore_decrypt_extract('files.tar.gz.enc', '/store/service/data')
         """
+        return self._download_from_blobstore_decrypt_extract(blob_to_download_name, blob_download_target_path)
+
+    def _download_from_blobstore_decrypt_extract(self, blob_to_download_name, blob_download_target_path):
+        # download_from_blobstore_decrypt_extract without its stage and abortion checks, also run by the threads of
+        # download_from_blobstore_decrypt_extract_shards
+        self._check_cancellation()
         log_prefix = '[DOWNLOAD, DECRYPT, EXTRACT]'
         base_log = 'blob_to_download={}, blob_target_path={}, container={}'.format(
             blob_to_download_name, blob_download_target_path, self.CONTAINER)
 
         segment_size = 65536  # 64 KiB
-        command = 'gpg --batch --cipher-algo aes256 --passphrase {} --decrypt | tar -xzf - -C {}/'.format(
-            self.SECRET, blob_download_target_path)
+        parallel = extractor.EXTRACTOR == extractor.PARALLEL
+        if parallel:
+            command = 'gpg --batch --cipher-algo aes256 --passphrase {} --decrypt'.format(self.SECRET)
+        else:
+            command = 'gpg --batch --cipher-algo aes256 --passphrase {} --decrypt | tar -xzf - -C {}/'.format(
+                self.SECRET, blob_download_target_path)
 
         if self._retry(self.get_container, []):
             try:
                 self.logger.info('{} Started to download, decryt, extract and copy backup to {}.'.format(
                     log_prefix, blob_download_target_path))
                 process = subprocess.Popen(
-                    command, stdin=subprocess.PIPE, shell=True, bufsize=segment_size, universal_newlines=False)
+                    command, stdin=subprocess.PIPE, stdout=subprocess.PIPE if parallel else None, shell=True,
+                    bufsize=segment_size, universal_newlines=False)
+                if parallel:
+                    thread, results = self._extract_output(process, blob_download_target_path)
                 args = [process, blob_to_download_name, segment_size]
                 self._retry(
                     self._download_from_blobstore_and_pipe_to_process, args)
@@ -951,6 +1531,10 @@ class BaseClient:
                 if exitcode != 0:
                     raise Exception(
                         'Worker subprocess for decryption and extracting returned with non zero exit code.')
+                if parallel:
+                    thread.join()
+                    if not (results and self._check_filesystem_result(results[0])):
+                        raise Exception('Extracting the backup failed: {}'.format(results[0] if results else None))
 
                 self.logger.info('{} SUCCESS: {}'.format(log_prefix, base_log))
                 return True
@@ -960,6 +1544,47 @@ class BaseClient:
                 self.logger.error(error)
                 raise Exception(error)
 
+    def download_from_blobstore_decrypt_extract_shards(self, blob_to_download_name, blob_download_target_path):
+        """Download, decrypt and extract the shards uploaded by upload_shards_to_blobstore into a directory.
+
+        The shards of the files are restored concurrently (see download_from_blobstore_decrypt_extract), the archive
+        of the directories last, so that their mode and mtime are not changed by the files extracted into them.
+
+        :param blob_to_download_name: the name prefix of the files in the BLOB storage
+        :param blob_download_target_path: the path where the files should be extracted to
+
+        :Example:
+            ::
+
+                iaas_client.download_from_blobstore_decrypt_extract_shards('a3e8d7f2/files.tar.gz', '/store/service/data')
+        """
+        log_prefix = '[DOWNLOAD, DECRYPT, EXTRACT] [SHARDS]'
+        descriptor, manifest_path = tempfile.mkstemp(suffix=shards.MANIFEST_SUFFIX)
+        os.close(descriptor)
+        try:
+            self.download_from_blobstore(blob_to_download_name + shards.MANIFEST_SUFFIX, manifest_path,
+                                         throw_exception=True)
+            manifest = shards.read_manifest(manifest_path)
+            self.logger.info('{} Started to restore {} to {}: {}'.format(
+                log_prefix, blob_to_download_name, blob_download_target_path, manifest))
+            suffixes = [shard['name'] for shard in manifest.shards]
+            with ThreadPoolExecutor(max_workers=max(1, min(len(suffixes), shards.ARCHIVE_SHARDS))) as executor:
+                results = list(executor.map(lambda suffix: self._download_from_blobstore_decrypt_extract(
+                    blob_to_download_name + suffix, blob_download_target_path), suffixes))
+            results.append(self._download_from_blobstore_decrypt_extract(
+                blob_to_download_name + manifest.directories['name'], blob_download_target_path))
+            if not all(results):
+                raise Exception('{} of {} archives were not restored.'.format(
+                    len([result for result in results if not result]), len(results)))
+        except Exception as error:
+            self.logger.error('{} Error: blob_to_download={}, container={}\n{}'.format(
+                log_prefix, blob_to_download_name, self.CONTAINER, error))
+            raise Exception(error)
+        finally:
+            os.remove(manifest_path)
+        self.logger.info('{} SUCCESS: {} shards'.format(log_prefix, len(manifest.shards)))
+        return True
+
     def generate_name_by_prefix(self, prefix):
         return '{}-{}-{}'.format(prefix,
                                  random.randrange(10000, 99999),
@@ -4,6 +4,8 @@ from .BaseClient import BaseClient
 from ..models.Snapshot import Snapshot
 from ..models.Volume import Volume
 from ..models.Attachment import Attachment
+from ..utils import devices
+from ..utils import filesystem
 
 
 class BoshliteClient(BaseClient):
@@ -45,7 +47,7 @@ class BoshliteClient(BaseClient):
 
     def get_persistent_volume_for_instance(self, instance_id):
         try:
-            device = self.shell('cat /proc/mounts | grep {}'.format(self.DIRECTORY_PERSISTENT)).split(' ')[0][:10]
+            device = devices.get_mounted_device(self.DIRECTORY_PERSISTENT, self.FILE_MOUNTS)[:10]
             volume = Volume(1, 'none', 1, device)
             self._add_volume_device(volume.id, device)
             return volume
@@ -216,9 +218,10 @@ class BoshliteClient(BaseClient):
         if self.container:
             self.logger.info('{} Started to upload the tarball to the object storage.'.format(log_prefix))
 
-            self.shell('mkdir -p {}/{}'.format(self.container, blob_target_name.split('/', 1)[0]), False)
+            filesystem.make_directory('{}/{}'.format(self.container, blob_target_name.split('/', 1)[0]))
 
-            if self.shell('cp -R {} {}/{}'.format(blob_to_upload_path, self.container, blob_target_name), False):
+            if self._check_filesystem_result(
+                    filesystem.copy_tree(blob_to_upload_path, '{}/{}'.format(self.container, blob_target_name))):
                 self.logger.info('{} SUCCESS: blob_to_upload={}, blob_target_name={}, container={}'
                                 .format(log_prefix, blob_to_upload_path, blob_target_name, self.CONTAINER))
                 return True
@@ -235,13 +238,15 @@ class BoshliteClient(BaseClient):
         if self.container:
             self.logger.info('{} Started to download the tarball to target.'.format(log_prefix,
                                                                                     blob_download_target_path))
-            if self.shell('cp {}/{} {}'.format(self.container, blob_to_download_name, blob_download_target_path), False):
+            result = self._check_filesystem_result(
+                filesystem.copy_tree('{}/{}'.format(self.container, blob_to_download_name), blob_download_target_path))
+            if result:
                 self.logger.info('{} SUCCESS: blob_to_download={}, blob_target_name={}, container={}'
                                  .format(log_prefix, blob_to_download_name, self.CONTAINER,
                                          blob_download_target_path))
                 return True
             else:
                 message = '{} ERROR: blob_to_download={}, blob_target_name={}, container={}\n{}'.format(log_prefix,
-                          blob_to_download_name, blob_download_target_path, self.CONTAINER, error)
+                          blob_to_download_name, blob_download_target_path, self.CONTAINER, result.errors)
                 self.logger.error(message)
                 raise Exception(message)
@@ -1,19 +1,24 @@
-from googleapiclient import discovery
-from google.oauth2 import service_account
-from google.cloud import storage
-from google.cloud.storage import Blob
 from .BaseClient import BaseClient
 from ..models.Snapshot import Snapshot
 from ..models.Volume import Volume
 from ..models.Attachment import Attachment
+from ..utils import devices
+from ..utils import rate_limiter
+from ..utils import throttle
+from ..utils.retry_policy import classify_error, THROTTLING
+from ..utils.discovery_cache import discovery_document
+from ..utils.container_access import ACCESS_TEST_BLOB
 import json
 import glob
+import mimetypes
 import iso8601
 import pytz
+import os
 
 class GcpClient(BaseClient):
     def __init__(self, operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time,
                  poll_maximum_time):
+        self.__compute_client = None
         super(GcpClient, self).__init__(operation_name, configuration, directory_persistent, directory_work_list,
                                         poll_delay_time, poll_maximum_time)
 
@@ -30,8 +35,8 @@ class GcpClient(BaseClient):
         self.compute_api_version = 'v1'
         self.device_path_template = '/dev/disk/by-id/google-{}'
 
-        # +-> Create compute and storage clients
-        self.compute_client = self.create_compute_client()
+        # +-> Create the storage client, the compute client is created on first use (never for blob operations)
+        self.credentials = self.create_credentials()
         self.storage_client = self.create_storage_client()
 
         # +-> Check whether the given container exists and is accessible
@@ -51,23 +56,62 @@ class GcpClient(BaseClient):
                 self.last_operation(msg, 'failed')
                 raise Exception(msg)
 
+    @property
+    def compute_client(self):
+        if self.__compute_client is None:
+            self.__compute_client = self.create_compute_client()
+        return self.__compute_client
+
+    @compute_client.setter
+    def compute_client(self, compute_client):
+        self.__compute_client = compute_client
+
+    def create_credentials(self):
+        # The SDKs are imported where they are used, blob operations never load the compute SDK (googleapiclient)
+        from google.oauth2 import service_account
+        # One set of credentials (and access token) for the compute and the storage client
+        return self._warm_client('credentials', self.__gcpCredentials, lambda binding:
+                                 service_account.Credentials.from_service_account_info(self.__gcpCredentials))
+
     def create_compute_client(self):
+        from googleapiclient import discovery
         try:
-            credentials = service_account.Credentials.from_service_account_info(
-                self.__gcpCredentials)
-            compute_client = discovery.build(
-                self.compute_api_name, self.compute_api_version, credentials=credentials)
-            return compute_client
+            # The discovery document is cached on disk (see lib/utils/discovery_cache) instead of being fetched by
+            # every process
+            return self._warm_client('compute', self.__gcpCredentials, lambda binding: discovery.build_from_document(
+                discovery_document(self.compute_api_name, self.compute_api_version), credentials=self.credentials,
+                requestBuilder=self.__traced_request_builder(binding)))
         except Exception as error:
             raise Exception(
                 'Creation of compute client failed: {}'.format(error))
 
+    @staticmethod
+    def __traced_request_builder(binding):
+        from googleapiclient.http import HttpRequest
+        # Requests of the discovery client execute through this class: each execution waits for the rate limiter and
+        # is traced as a client span of the GcpClient the (possibly warm) discovery client is bound to
+        class TracedHttpRequest(HttpRequest):
+            def execute(self, http=None, num_retries=0):
+                tracer = binding.client.tracer
+                limiter = binding.client.rate_limiter
+                name = self.methodId or self.uri
+                family = rate_limiter.api_family(name)
+                queued = limiter.acquire(family)
+                try:
+                    with tracer.span(name, 'client', queued=round(queued, 3) if queued else None):
+                        result = super(TracedHttpRequest, self).execute(http=http, num_retries=num_retries)
+                except Exception as error:
+                    limiter.record(family, classify_error(error) == THROTTLING)
+                    raise
+                limiter.record(family)
+                return result
+        return TracedHttpRequest
+
     def create_storage_client(self):
+        from google.cloud import storage
         try:
-            credentials = service_account.Credentials.from_service_account_info(
-                self.__gcpCredentials)
-            storage_client = storage.Client(self.project_id, credentials)
-            return storage_client
+            return self._warm_client('storage', [self.project_id, self.__gcpCredentials], lambda binding:
+                                     storage.Client(self.project_id, self.credentials))
         except Exception as error:
             raise Exception(
                 'Creation of storage client failed: {}'.format(error))
@@ -83,6 +127,8 @@ class GcpClient(BaseClient):
                     if 'instances' in instances_scoped_list:
                         for instance in instances_scoped_list['instances']:
                             if instance['name'] == instance_id:
+                                # The aggregated list already returns the complete instance resource
+                                self._set_cached_instance(instance_id, instance)
                                 # Assuming the last part of the url is zone-name
                                 return instance['zone'].rsplit('/', 1)[1]
 
@@ -98,15 +144,20 @@ class GcpClient(BaseClient):
             return None
 
     def get_container(self):
+        from google.cloud.storage import Blob
         try:
+            # Fetching the bucket checks that it exists and can be read (the head check)
             container = self.storage_client.get_bucket(self.CONTAINER)
             # Test if the container is accessible
-            blob_name = '{}/{}'.format(self.BLOB_PREFIX,
-                                       'AccessTestByServiceFabrikPythonLibrary')
-            blob = Blob(blob_name, container)
-            blob.upload_from_string(
-                'Sample Message for AccessTestByServiceFabrikPythonLibrary', content_type='text/plain')
-            blob.delete()
+            blob_name = '{}/{}'.format(self.BLOB_PREFIX, ACCESS_TEST_BLOB)
+
+            def probe():
+                blob = Blob(blob_name, container)
+                blob.upload_from_string(
+                    'Sample Message for {}'.format(ACCESS_TEST_BLOB), content_type='text/plain')
+                blob.delete()
+
+            self._check_container_access([self.project_id, self.__gcpCredentials], probe, lambda: None)
             return container
         except Exception as error:
             self.logger.error('[GCP] [STORAGE] ERROR: Unable to find or access container {}.\n{}'.format(
@@ -167,15 +218,40 @@ class GcpClient(BaseClient):
                 self.logger.error(message)
                 raise Exception(message)
 
+    def _get_instance(self, instance_id):
+        return self.compute_client.instances().get(
+            project=self.project_id,
+            zone=self.availability_zone,
+            instance=instance_id
+        ).execute()
+
+    def _list_disks(self, disk_names):
+        # Fetch the details of all given disks with one (paginated) list call instead of one get call per disk;
+        # disks missing from the list are fetched with get, which raises the error of a disk that cannot be accessed
+        disks = {}
+        if not disk_names:
+            return disks
+        request = self.compute_client.disks().list(
+            project=self.project_id,
+            zone=self.availability_zone,
+            filter='name eq ({})'.format('|'.join(disk_names)))
+        while request is not None:
+            response = request.execute()
+            for disk in response.get('items', []):
+                disks[disk['name']] = disk
+            request = self.compute_client.disks().list_next(
+                previous_request=request, previous_response=response)
+        for disk_name in disk_names:
+            if disk_name not in disks:
+                disks[disk_name] = self.compute_client.disks().get(
+                    project=self.project_id, zone=self.availability_zone, disk=disk_name).execute()
+        return disks
+
     def get_attached_volumes_for_instance(self, instance_id):
         try:
-            instance = self.compute_client.instances().get(
-                project=self.project_id,
-                zone=self.availability_zone,
-                instance=instance_id
-            ).execute()
+            instance = self._get_cached_instance(instance_id)
 
-            volume_list = []
+            attached_disks = []
             for disk in instance['disks']:
                 device = self._find_volume_device(disk['deviceName'])
 
@@ -184,14 +260,14 @@ class GcpClient(BaseClient):
                     # Also, from https://cloud.google.com/compute/docs/regions-zones/
                     # the disk and instance must belong to the same zone.
                     # So, we can use instance zone.
-                    disk_name = disk['source'].rsplit('/', 1)[1]
-                    disk_details = self.compute_client.disks().get(
-                        project=self.project_id,
-                        zone=self.availability_zone,
-                        disk=disk_name
-                    ).execute()
-                    volume_list.append(
-                        Volume(disk_details['name'], disk_details['status'], disk_details['sizeGb'], device))
+                    attached_disks.append((disk['source'].rsplit('/', 1)[1], device))
+
+            disk_details = self._list_disks([disk_name for disk_name, device in attached_disks])
+            volume_list = []
+            for disk_name, device in attached_disks:
+                details = disk_details[disk_name]
+                volume_list.append(
+                    Volume(details['name'], details['status'], details['sizeGb'], device))
 
             return volume_list
         except Exception as error:
@@ -202,8 +278,7 @@ class GcpClient(BaseClient):
 
     def get_persistent_volume_for_instance(self, instance_id):
         try:
-            device = self.shell(
-                'cat {} | grep {}'.format(self.FILE_MOUNTS, self.DIRECTORY_PERSISTENT)).split(' ')[0][:8]
+            device = devices.get_mounted_device(self.DIRECTORY_PERSISTENT, self.FILE_MOUNTS)[:8]
 
             for volume in self.get_attached_volumes_for_instance(instance_id):
                 if volume.device == device:
@@ -231,6 +306,7 @@ class GcpClient(BaseClient):
                 log_prefix, volume_id, self.tags, snapshot_name))
             snapshot_creation_operation = self.compute_client.disks().createSnapshot(
                 project=self.project_id, zone=self.availability_zone, disk=volume_id, body=snapshot_body).execute()
+            self._start_progress('snapshot')
 
             self._wait('Waiting for snapshot {} to get ready...'.format(snapshot_name),
                        (lambda operation_id, zonal_operation: self.get_operation_status(
@@ -242,6 +318,7 @@ class GcpClient(BaseClient):
             if snapshot.status == 'READY':
                 self._add_snapshot(snapshot.id)
                 self.output_json['snapshotId'] = snapshot.id
+                self._finish_progress()
                 self.logger.info('{} SUCCESS: snapshot-id={}, volume-id={}, status={} with tags {}'.format(
                     log_prefix, snapshot.id, volume_id, snapshot.status, self.tags))
             else:
@@ -249,6 +326,7 @@ class GcpClient(BaseClient):
                     log_prefix, snapshot_name, snapshot.status)
                 raise Exception(message)
         except Exception as error:
+            self._finish_progress(False)
             message = '{} ERROR: volume-id={} and tags={}\n{}'.format(
                 log_prefix, volume_id, self.tags, error)
             self.logger.error(message)
@@ -403,6 +481,8 @@ class GcpClient(BaseClient):
                        None,
                        disk_attach_operation['name'], True)
 
+            self._invalidate_cached_instance(instance_id)
+
             # Here volume_id is the device name.
             # Raise exception if device returned in None,
             # as it might mean that disk was not attached properly
@@ -455,6 +535,7 @@ class GcpClient(BaseClient):
                        None,
                        disk_detach_operation['name'], True)
 
+            self._invalidate_cached_instance(instance_id)
             self._remove_volume_device(volume_id)
             self._remove_attachment(volume_id, instance_id)
             self.logger.info(
@@ -484,8 +565,7 @@ class GcpClient(BaseClient):
                     'Expected number of device path not matching 1 != {} for disk {}'.format(
                         len(device_path), volume_id))
 
-            device = self.shell(
-                'readlink -e {}'.format(device_path[0])).rstrip()
+            device = devices.resolve_device(device_path[0])
             return device
         except Exception as error:
             self.logger.error(
@@ -508,15 +588,24 @@ class GcpClient(BaseClient):
                            resumable uploads should be used.
                            If you wish to use resumable upload, pass chunk_size param to this function.
                            This must be a multiple of 256 KB per the API specification.
+                           Defaults to the part size of the backup plan (if any).
         """
+        from google.cloud.storage import Blob
         log_prefix = '[Google Cloud Storage] [UPLOAD]'
+        if chunk_size is None and self.backup_plan:
+            chunk_size = self.backup_plan.part_size
         if self.container:
             self.logger.info(
                 '{} Started to upload the tarball to the object storage.'.format(log_prefix))
             try:
                 blob = Blob(blob_target_name, self.container,
                             chunk_size=chunk_size)
-                blob.upload_from_filename(blob_to_upload_path)
+                # the content type upload_from_filename guessed from the name of the file
+                content_type = mimetypes.guess_type(blob_to_upload_path)[0] or 'application/octet-stream'
+                with open(blob_to_upload_path, 'rb') as blob_file:
+                    # every chunk read by the SDK waits for the upload limit
+                    blob.upload_from_file(throttle.ThrottledFile(blob_file, self.throttle),
+                                          size=os.path.getsize(blob_to_upload_path), content_type=content_type)
                 self.logger.info('{} SUCCESS: blob_to_upload={}, blob_target_name={}, container={}'
                                  .format(log_prefix, blob_to_upload_path, blob_target_name, self.CONTAINER))
                 return True
@@ -539,6 +628,7 @@ class GcpClient(BaseClient):
                            To do so, pass chunk_size param to this function.
                            This must be a multiple of 256 KB per the API specification.
         """
+        from google.cloud.storage import Blob
         log_prefix = '[Google Cloud Storage] [DOWNLOAD]'
         if self.container:
             self.logger.info('{} Started to download the tarball to target.'.format(
@@ -598,6 +688,8 @@ class GcpClient(BaseClient):
             self.logger.error(message)
             raise Exception(message)
 
+        self._report_progress(result.get('progress'))
+
         if result['status'] == 'DONE':
             if 'error' in result:
                 message = '[Google Cloud Storage] [GET_OPERATION] ERROR: operation id={}\n{}'.format(
@@ -1,15 +1,12 @@
 import time
 import os
-from keystoneauth1.identity.v3 import Password as KeystonePassword
-from keystoneauth1.session import Session as KeystoneSession
-from novaclient.client import Client as NovaClient
-from cinderclient.client import Client as CinderClient
-from swiftclient.client import Connection as SwiftClient
-from swiftclient.service import SwiftService, SwiftUploadObject
 from .BaseClient import BaseClient
 from ..models.Snapshot import Snapshot
 from ..models.Volume import Volume
 from ..models.Attachment import Attachment
+from ..utils import devices
+from ..utils import rate_limiter
+from ..utils import throttle
 
 
 class OpenstackClient(BaseClient):
@@ -28,9 +25,14 @@ class OpenstackClient(BaseClient):
         # OpenStack are already pre-installed on the VMs (/etc/ssl/certs)
         certificates_path = os.getenv('SF_BACKUP_RESTORE_CERTS')
         self.__certificatesPath = '/etc/ssl/certs' if certificates_path is None else certificates_path
-        self.nova = self.create_nova_client()
-        self.cinder = self.create_cinder_client()
-        self.swift = self.create_swift_client()
+        # The authenticated clients are kept warm when running in the daemon (see lib/utils/warm_clients)
+        self.nova = self._trace_client(self._warm_client(
+            'nova', self.__keystoneCredentials, lambda binding: self.create_nova_client()), 'nova')
+        self.cinder = self._trace_client(self._warm_client(
+            'cinder', self.__keystoneCredentials, lambda binding: self.create_cinder_client()), 'cinder')
+        self.swift = self._trace_client(self._warm_client(
+            'swift', self.__keystoneCredentials, lambda binding: self.create_swift_client()), 'swift',
+            family=rate_limiter.STORAGE)
         self.swift.service = self.create_swift_service(self.swift.get_auth()[0])
 
         # +-> Check whether the given container exists
@@ -58,6 +60,8 @@ class OpenstackClient(BaseClient):
         }
     
     def create_keystone_session(self):
+        from keystoneauth1.identity.v3 import Password as KeystonePassword
+        from keystoneauth1.session import Session as KeystoneSession
         try:
             auth = KeystonePassword(**self.__keystoneCredentials)
             session = KeystoneSession(auth=auth, verify=self.__certificatesPath)
@@ -68,16 +72,19 @@ class OpenstackClient(BaseClient):
 
 
     def create_nova_client(self):
+        from novaclient.client import Client as NovaClient
         return NovaClient(version='2',
                                  session=self.create_keystone_session())
 
 
     def create_cinder_client(self):
+        from cinderclient.client import Client as CinderClient
         return CinderClient(version='2',
                                    session=self.create_keystone_session())
 
 
     def create_swift_client(self):
+        from swiftclient.client import Connection as SwiftClient
         try:
             swift = SwiftClient(auth_version='3',
                                            os_options=self.__keystoneCredentials,
@@ -92,6 +99,7 @@ class OpenstackClient(BaseClient):
 
 
     def create_swift_service(self, storage_url):
+        from swiftclient.service import SwiftService
         try:
             return SwiftService(options={
                 'user': self.__keystoneCredentials['username'],
@@ -156,7 +164,7 @@ class OpenstackClient(BaseClient):
 
 
     def get_persistent_volume_for_instance(self, instance_id):
-        device = self.shell('cat /proc/mounts | grep {}'.format(self.DIRECTORY_PERSISTENT)).split(' ')[0][:-1]
+        device = devices.get_mounted_device(self.DIRECTORY_PERSISTENT, self.FILE_MOUNTS)[:-1]
         # Cut the last letter which marks the partition as we only need the 'plain' device name
 
         for volume in self.get_attached_volumes_for_instance(instance_id):
@@ -333,13 +341,14 @@ class OpenstackClient(BaseClient):
                 raise Exception(message)
 
     def _find_volume_device(self, volume_id):
-        self.shell('udevadm trigger', False)
-        # create symbol links at /dev/disk/by-id/virtio-<uuid> pointing to the real device name
-        time.sleep(3)
-        result = self.shell('ls /dev/disk/by-id/ | egrep {}'.format(volume_id[:20].replace('-', '-?')), False)
-        if result:
-            result = '/dev/disk/by-id/{}'.format(result.split('\n')[0])
-        return result
+        # udev creates symbol links at /dev/disk/by-id/virtio-<uuid> pointing to the real device name
+        devices.trigger_block_uevents()
+        pattern = volume_id[:20].replace('-', '-?')
+        links = devices.wait_for(lambda: devices.find_by_id_links(pattern), devices.DIRECTORY_DISK_BY_ID,
+                                 self.configuration['poll_delay_time'])
+        if links:
+            return '{}/{}'.format(devices.DIRECTORY_DISK_BY_ID, links[0])
+        return None
 
 
     def get_mountpoint(self, volume_id, partition=None):
@@ -352,6 +361,7 @@ class OpenstackClient(BaseClient):
 
 
     def _upload_to_blobstore(self, blob_to_upload_path, blob_target_name):
+        from swiftclient.service import SwiftUploadObject
         log_prefix = '[SWIFT] [UPLOAD]'
         segment_size = (1 << 30) # 1 GiB segment size
 
@@ -364,7 +374,11 @@ class OpenstackClient(BaseClient):
                     'segment_size': segment_size,
                     'segment_container': self.CONTAINER
                 }
-                for response in self.swift.service.upload(self.CONTAINER, [blob_to_upload_object], options):
+                if self.throttle.limited(throttle.UPLOAD):
+                    responses = self.__upload_throttled(blob_to_upload_path, blob_target_name, segment_size)
+                else:
+                    responses = self.swift.service.upload(self.CONTAINER, [blob_to_upload_object], options)
+                for response in responses:
                     # Swift client will try to create the container in case it is not existing - we want to
                     # hide the error which may occur due to missing priviledges for those operations
                     if response['action'] != 'create_container' and not response['success']:
@@ -393,6 +407,34 @@ class OpenstackClient(BaseClient):
             raise Exception(message)
 
 
+    def __upload_throttled(self, blob_to_upload_path, blob_target_name, segment_size):
+        # The upload service of the Swift client reads the segments from the path in its own threads. With an upload
+        # limit the tarball is read through the throttle and uploaded segment by segment instead, in the layout of the
+        # service (one object, or the segments and a manifest if it is larger than a segment) and yielding the same
+        # responses; failed requests raise.
+        from urllib.parse import quote
+        size = os.path.getsize(blob_to_upload_path)
+        mtime = '{:f}'.format(os.path.getmtime(blob_to_upload_path))
+        with open(blob_to_upload_path, 'rb') as blob_file:
+            if size <= segment_size:
+                self.swift.put_object(self.CONTAINER, blob_target_name,
+                                      throttle.ThrottledFile(blob_file, self.throttle), content_length=size,
+                                      headers={'x-object-meta-mtime': mtime})
+                yield {'action': 'upload_object', 'success': True}
+                return
+            prefix = '{}/{}/{}/{}/'.format(blob_target_name, mtime, size, segment_size)
+            for index, start in enumerate(range(0, size, segment_size)):
+                length = min(segment_size, size - start)
+                blob_file.seek(start)
+                self.swift.put_object(self.CONTAINER, '{}{:08d}'.format(prefix, index),
+                                      throttle.ThrottledFile(blob_file, self.throttle, length=length),
+                                      content_length=length)
+                yield {'action': 'upload_segment', 'success': True}
+                self._check_cancellation()
+        self.swift.put_object(self.CONTAINER, blob_target_name, '', content_length=0, headers={
+            'x-object-meta-mtime': mtime, 'x-object-manifest': '{}/{}'.format(quote(self.CONTAINER), quote(prefix))})
+        yield {'action': 'upload_object', 'success': True}
+
     def _download_from_blobstore(self, blob_to_download_name, blob_download_target_path):
         log_prefix = '[SWIFT] [DOWNLOAD]'
         segment_size = 65536 # 64 KiB  
@@ -404,6 +446,7 @@ class OpenstackClient(BaseClient):
                 swift_object = self.swift.get_object(self.CONTAINER, blob_to_download_name, resp_chunk_size=segment_size)
                 with open(blob_download_target_path, 'wb') as downloaded_file:
                     for chunk in swift_object[1]:
+                        self._check_cancellation()
                         downloaded_file.write(chunk)
 
                 self.logger.info('{} SUCCESS: blob_to_download={}, blob_target_name={}, container={}'
@@ -420,6 +463,8 @@ class OpenstackClient(BaseClient):
     def _download_from_blobstore_and_pipe_to_process(self, process, blob_to_download_name, segment_size):
         swift_object = self.swift.get_object(self.CONTAINER, blob_to_download_name, resp_chunk_size=segment_size)
         for chunk in swift_object[1]:
+            self._check_cancellation()
+            self.metrics.add('bytesIn', len(chunk))
             process.stdin.write(chunk)
 
         return True
@@ -1,24 +1,35 @@
 import sys
 import os
-from retrying import retry
+from ..utils.retry_policy import DEFAULT_BACKOFFS, TRANSIENT, Backoff, RetryPolicy
+from ..utils.credhub import credhub
 
 # configurable
 iaas_client_max_retries = int(os.getenv('SF_IAAS_CLIENT_MAX_RETRY')) if os.getenv('SF_IAAS_CLIENT_MAX_RETRY') is not None else 8
-# between subsequent attempts, waiting_time = (2 ** attempt) * iaas_client_exp_multiplier milliseconds
-iaas_client_exp_multiplier = 1000
 
 # configurable
 iaas_client_max_delay = 600000
 
-# a random jitter would be added as part of exponential backoff to further minimize conflicts
-iaas_client_jitter = 1000
 
-# wait_time_between_attempts = (2 ** attempt) * iaas_client_exp_multiplier + random.random() * iaas_client_jitter milliseconds
-# https://github.com/rholder/retrying/blob/master/retrying.py#L247
+def _create_retry_policy(max_retries):
+    # The waits between the attempts depend on the class of the error (exponential backoff with jitter, none for
+    # permanent errors like a not implemented IaaS), see lib/utils/retry_policy.py. SF_IAAS_CLIENT_MAX_RETRY is the
+    # number of attempts on transient errors and an upper limit for the other classes, e.g. 1 disables the retries.
+    transient = DEFAULT_BACKOFFS[TRANSIENT]
+    return RetryPolicy(backoffs={TRANSIENT: Backoff(max_retries, transient.base, transient.cap)},
+                       budget=iaas_client_max_delay / 1000.0, max_attempts=max_retries)
+
+
+iaas_client_retry_policy = _create_retry_policy(iaas_client_max_retries)
+
 
-@retry(stop_max_attempt_number=iaas_client_max_retries, wait_exponential_multiplier=iaas_client_exp_multiplier, stop_max_delay=iaas_client_max_delay, wait_jitter_max=iaas_client_jitter)
 def _create_iaas_client(operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time=None,
                        poll_maximum_time=None):
+    return iaas_client_retry_policy.run(lambda attempt: _instantiate_iaas_client(
+        operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time, poll_maximum_time))
+
+
+def _instantiate_iaas_client(operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time,
+                             poll_maximum_time):
     iaas = configuration['iaas'].title() + 'Client'
     try:
         return getattr(__import__(iaas, globals(), locals(), [], 1), iaas)\
@@ -29,6 +40,9 @@ def _create_iaas_client(operation_name, configuration, directory_persistent, dir
         raise error
     except Exception as error:
         print('[CONFIG] ERROR: Could not create {}: {}'.format(iaas, error), file=sys.stderr)
+        if configuration.get('credhub_url'):
+            # the cached credentials may have been rotated, the next attempt fetches them again
+            credhub.invalidate(configuration)
         raise error
         
 def create_iaas_client(operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time=None,
@@ -1,6 +1,8 @@
 import os
 from argparse import ArgumentParser
 from .utils.merge_dict import merge_dict
+from .utils.last_operation import replace_symlink
+from .utils.profiling import start_profiling
 from .logger import init_logger
 
 parameters = {
@@ -13,7 +15,9 @@ parameters_credentials = {
         'access_key_id': 'AWS Access Key ID',
         'secret_access_key': 'AWS Secret Access Key',
         'region_name': 'AWS Region Name',
-        'max_retries': 'Max number of retries for SDK AWS client'
+        'max_retries': 'Max number of retries for SDK AWS client',
+        'encryption_strategy': 'How backups get encrypted [possible values: copy/volume], default: copy',
+        'kms_key_id': 'KMS key used for encrypted snapshot copies and volumes, default: the EBS default key'
     },
     'ali': {
         'access_key_id': 'Ali Access Key ID',
@@ -77,6 +81,11 @@ parameters_blob_operation = {
     'container': 'a container in the object storage from which to restore data'
 }
 
+parameters_throttle = {
+    'upload_rate_limit': 'Upload bandwidth limit in bytes per second as rate[/burst], e.g. 20M or 20M/40M',
+    'disk_read_rate_limit': 'Disk read limit of the archiver in bytes per second as rate[/burst], e.g. 50M'
+}
+
 parameters_restore_optional = {
     'agent_id': 'the agent id',
     'agent_ip': 'IP of the agent VM'
@@ -96,6 +105,9 @@ def _get_parameters_restore():
 def _get_parameters_restore_optional():
     return parameters_restore_optional
 
+def _get_parameters_throttle():
+    return parameters_throttle
+
 def _get_parameters_blob_operation():
     return merge_dict(parameters, parameters_blob_operation)
 
@@ -144,16 +156,20 @@ def build_parser(type):
     else:
         raise Exception('Use either \'backup\' or \'restore\' as type.')
 
+    for name, description in _get_parameters_throttle().items():
+        parser.add_argument('--{}'.format(name), help=description)
+
     for key, credentials in _get_parameters_credentials().items():
         for name, description in credentials.items():
             parser.add_argument('--{}'.format(name), help=description)
 
     return parser
 
-def parse_options(type):
+def parse_options(type, arguments=None):
     """Parse the required command line options for the given operation type.
 
     :param type: a string containing either `backup` or `restore`
+    :param arguments: (optional) list of command line arguments to parse instead of sys.argv, e.g. of a daemon job
     :returns: a dictionary containing the key-value pairs of the provided parameters
 
     :Example:
@@ -167,7 +183,7 @@ def parse_options(type):
 
     parser = build_parser(type)    
     
-    configuration = vars(parser.parse_args())
+    configuration = vars(parser.parse_args(arguments))
     assert configuration['type'] == 'online' or configuration['type'] == 'offline', \
         '--type must be \'online\' or \'offline\''
     return configuration
@@ -202,7 +218,11 @@ def initialize(operation_name):
             open(path_green, 'w+').close()
         # +-> Create symlink to blue file and clear old log entries
         if operation == operation_name:
-            os.system('ln -sf {} {}'.format(path_blue, path_link))
+            replace_symlink(path_blue, path_link)
             open(path_log, 'w+').close()
 
     init_logger(os.path.join(directory_logfile, operation_name + '.log'))
+
+    # +-> Profile the whole operation if requested (SF_BACKUP_RESTORE_PROFILE=cpu,sample,memory or all), the results
+    # are written next to the log file when the process exits
+    start_profiling(directory_logfile, operation_name)
@@ -0,0 +1,389 @@
+import collections
+import hmac
+import http.client
+import ipaddress
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from .config import parse_options
+from .clients.index import create_iaas_client
+from .utils.warm_clients import warm_clients
+
+# Unix socket path, or host:port for HTTP on a (local) TCP port, the daemon listens on
+DAEMON_ADDRESS = os.getenv('SF_BACKUP_RESTORE_DAEMON_ADDRESS', '/var/vcap/sys/run/service-fabrik-backup-restore.sock')
+# Shared secret the requests have to send as 'Authorization: Bearer <token>', or a file containing it; required when
+# the daemon listens on host:port, optional on the Unix socket (which only its owner can connect to)
+DAEMON_TOKEN = os.getenv('SF_BACKUP_RESTORE_DAEMON_TOKEN')
+DAEMON_TOKEN_FILE = os.getenv('SF_BACKUP_RESTORE_DAEMON_TOKEN_FILE')
+# Number of finished jobs whose state is kept for GET /jobs/<id>
+DAEMON_JOB_HISTORY = int(os.getenv('SF_BACKUP_RESTORE_DAEMON_JOB_HISTORY', 100))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+ABORTED = 'aborted'
+FINISHED_STATES = (SUCCEEDED, FAILED, ABORTED)
+
+Operation = collections.namedtuple('Operation', [
+    'function', 'directory_persistent', 'directory_work_list', 'poll_delay_time', 'poll_maximum_time'])
+
+
+class Job(object):
+    """One run of a registered operation with its command line arguments."""
+
+    def __init__(self, operation, arguments):
+        self.id = str(uuid.uuid4())
+        self.operation = operation
+        self.arguments = arguments
+        self.state = QUEUED
+        self.error = None
+        self.iaas_client = None
+        self.abort_requested = False
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'operation': self.operation,
+            'state': self.state,
+            'error': self.error,
+            'createdAt': _timestamp(self.created_at),
+            'startedAt': _timestamp(self.started_at),
+            'finishedAt': _timestamp(self.finished_at)
+        }
+
+
+def _timestamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds)) if seconds else None
+
+
+def _is_tcp_address(address):
+    return ':' in address and not address.startswith('/')
+
+
+def daemon_token():
+    """The configured token of the daemon API (SF_BACKUP_RESTORE_DAEMON_TOKEN or _TOKEN_FILE), or None."""
+    if DAEMON_TOKEN:
+        return DAEMON_TOKEN
+    if DAEMON_TOKEN_FILE:
+        with open(DAEMON_TOKEN_FILE) as token_file:
+            return token_file.read().strip() or None
+    return None
+
+
+def _is_loopback(host):
+    try:
+        return all(ipaddress.ip_address(info[4][0]).is_loopback for info in socket.getaddrinfo(host, None))
+    except (socket.gaierror, ValueError):
+        return False
+
+
+class Daemon(object):
+    """Long running backup agent which runs backups and restores as jobs, requested through a small HTTP API.
+
+    The process keeps the imported SDKs, the authenticated SDK clients with their connection pools and the shared
+    rate limiters between the jobs, so only the first job pays for them. Jobs run one after another in the main
+    thread (the IaaS clients install signal handlers and exit through sys.exit) and write the same last operation,
+    log and output files as the command line scripts. The API listens on a Unix socket or on host:port:
+
+    - ``POST /jobs`` with ``{"operation": "backup", "arguments": ["--iaas=aws", ...]}`` queues a job (202)
+    - ``GET /jobs`` and ``GET /jobs/<id>`` return the state of the jobs
+    - ``POST /jobs/<id>/abort`` aborts a queued job or schedules the safe abortion of the running one
+    - ``GET /health`` returns the number of queued jobs and warm clients
+
+    Jobs run with the privileges of the daemon, so host:port must be a loopback address and every request has to send
+    the token as ``Authorization: Bearer <token>``; on the Unix socket, which only its owner can connect to, the token
+    is checked if one is set.
+
+    SIGINT/SIGTERM abort the running job as for the scripts, and stop the daemon once no job is running.
+
+    :Example:
+        ::
+
+            daemon = Daemon('/var/vcap/sys/run/backup-agent.sock')
+            daemon.register('backup', backup, '/var/vcap/store', ['/tmp/service-fabrik-backup/snapshot'])
+            daemon.serve_forever()
+    """
+
+    def __init__(self, address=DAEMON_ADDRESS, history=DAEMON_JOB_HISTORY, token=None):
+        self.address = address
+        self.history = history
+        self.token = token or daemon_token()
+        self.jobs = collections.OrderedDict()
+        self.current_job = None
+        self.__operations = {}
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__server = None
+        warm_clients.enabled = True
+
+    def register(self, operation, function, directory_persistent, directory_work_list, poll_delay_time=None,
+                 poll_maximum_time=None):
+        """Register the function running an operation (backup, restore or blob_operation).
+
+        :param function: called as function(iaas_client, configuration) with the client created for the job
+        """
+        self.__operations[operation] = Operation(function, directory_persistent, directory_work_list,
+                                                 poll_delay_time, poll_maximum_time)
+
+    def submit(self, operation, arguments):
+        if operation not in self.__operations:
+            raise ValueError('Operation {} is not registered'.format(operation))
+        if not isinstance(arguments, list) or not all(isinstance(argument, str) for argument in arguments):
+            raise ValueError('Arguments must be a list of strings')
+        job = Job(operation, arguments)
+        with self.__lock:
+            self.jobs[job.id] = job
+            self.__forget_finished_jobs()
+        self.__queue.put(job)
+        return job
+
+    def abort(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        with self.__lock:
+            if job.state == QUEUED:
+                job.state = ABORTED
+                job.finished_at = time.time()
+            elif job.state == RUNNING:
+                job.abort_requested = True
+                if job.iaas_client is not None:
+                    job.iaas_client.request_abortion('Abortion of job {} requested'.format(job.id))
+        return job
+
+    def start(self):
+        """Start listening; the API is served by a background thread."""
+        if _is_tcp_address(self.address):
+            host, port = self.address.rsplit(':', 1)
+            if not _is_loopback(host):
+                raise ValueError('The daemon only listens on loopback addresses, not on {}'.format(host))
+            if not self.token:
+                raise ValueError('Listening on {} requires SF_BACKUP_RESTORE_DAEMON_TOKEN(_FILE)'.format(self.address))
+            self.__server = _ThreadingHTTPServer((host, int(port)), _RequestHandler)
+        else:
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            # the socket is created by bind, only its owner may connect from the start
+            umask = os.umask(0o077)
+            try:
+                self.__server = _ThreadingUnixHTTPServer(self.address, _RequestHandler)
+            finally:
+                os.umask(umask)
+        self.__server.backup_daemon = self
+        thread = threading.Thread(target=self.__server.serve_forever, name='daemon-api')
+        thread.daemon = True
+        thread.start()
+        print('[DAEMON] Listening on {}'.format(self.address), file=sys.stderr)
+
+    def serve_forever(self):
+        """Start listening and run the submitted jobs until SIGINT/SIGTERM or stop()."""
+        if self.__server is None:
+            self.start()
+        self.__install_signal_handlers()
+        try:
+            while not self.__stopped.is_set():
+                try:
+                    job = self.__queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if job.state == QUEUED:
+                    self.run(job)
+        finally:
+            self.close()
+
+    def stop(self, *args):
+        self.__stopped.set()
+
+    def close(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            if isinstance(self.__server, _ThreadingUnixHTTPServer) and os.path.exists(self.address):
+                os.unlink(self.address)
+            self.__server = None
+
+    def run(self, job):
+        operation = self.__operations[job.operation]
+        with self.__lock:
+            job.state = RUNNING
+            job.started_at = time.time()
+            self.current_job = job
+        try:
+            configuration = parse_options(job.operation, job.arguments)
+            job.iaas_client = create_iaas_client(job.operation, configuration, operation.directory_persistent,
+                                                 operation.directory_work_list, operation.poll_delay_time,
+                                                 operation.poll_maximum_time)
+            if job.abort_requested:
+                job.iaas_client.request_abortion('Abortion of job {} requested'.format(job.id))
+            operation.function(job.iaas_client, configuration)
+        except SystemExit as error:
+            # the clients exit after a failure (exit) or an abortion, the parser on invalid arguments
+            if error.code not in (None, 0):
+                job.error = 'Exited with status {}'.format(error.code)
+        except Exception as error:
+            job.error = str(error) or type(error).__name__
+            if job.iaas_client is not None and job.iaas_client.last_operation_state not in FINISHED_STATES:
+                job.iaas_client.last_operation(job.error, FAILED)
+        finally:
+            self.__finish(job)
+        return job
+
+    def __finish(self, job):
+        client_state = getattr(job.iaas_client, 'last_operation_state', None)
+        if client_state in FINISHED_STATES:
+            job.state = client_state
+        else:
+            job.state = FAILED if job.error else SUCCEEDED
+        if job.iaas_client is not None:
+            job.iaas_client.close()
+            job.iaas_client = None
+        if job.state == FAILED:
+            # do not keep clients which may be broken (e.g. by rotated credentials) for the next job
+            warm_clients.clear()
+        job.finished_at = time.time()
+        self.current_job = None
+        # the clients replace the signal handlers of the process
+        self.__install_signal_handlers()
+        print('[DAEMON] Job {} ({}) {}'.format(job.id, job.operation, job.state), file=sys.stderr)
+
+    def __install_signal_handlers(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+
+    def __forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'queued': sum(1 for job in list(self.jobs.values()) if job.state == QUEUED),
+            'running': self.current_job.id if self.current_job else None,
+            'warmClients': len(warm_clients)
+        }
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server_version = 'ServiceFabrikBackupRestore'
+
+    def do_GET(self):
+        daemon = self.server.backup_daemon
+        if not self.__authorized(daemon):
+            return self.__respond(401, {'error': 'Unauthorized'})
+        parts = self.path.strip('/').split('/')
+        if parts == ['health']:
+            return self.__respond(200, daemon.health())
+        if parts == ['jobs']:
+            return self.__respond(200, [job.as_dict() for job in list(daemon.jobs.values())])
+        if len(parts) == 2 and parts[0] == 'jobs' and parts[1] in daemon.jobs:
+            return self.__respond(200, daemon.jobs[parts[1]].as_dict())
+        self.__respond(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        daemon = self.server.backup_daemon
+        try:
+            content = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        except ValueError as error:
+            return self.__respond(400, {'error': str(error)})
+        # the body is read first, a client still sending it would not get the response
+        if not self.__authorized(daemon):
+            return self.__respond(401, {'error': 'Unauthorized'})
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            try:
+                body = json.loads(content.decode('utf-8') or '{}')
+                job = daemon.submit(body.get('operation'), body.get('arguments', []))
+            except (ValueError, AttributeError) as error:
+                return self.__respond(400, {'error': str(error)})
+            return self.__respond(202, job.as_dict())
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'abort':
+            job = daemon.abort(parts[1])
+            if job is not None:
+                return self.__respond(202, job.as_dict())
+        self.__respond(404, {'error': 'Not found'})
+
+    def __authorized(self, daemon):
+        if not daemon.token:
+            return True
+        scheme, _, token = (self.headers.get('Authorization') or '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(token.strip().encode('utf-8'),
+                                                                  daemon.token.encode('utf-8'))
+
+    def __respond(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address or 'unix')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=30):
+        super(_UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def request(address, method, path, content=None, timeout=30, token=None):
+    """Send a request to the daemon listening on address (Unix socket path or host:port), returns (status, content).
+
+    The token defaults to the one configured for the daemon (SF_BACKUP_RESTORE_DAEMON_TOKEN or _TOKEN_FILE).
+
+    :Example:
+        ::
+
+            status, job = request('/var/vcap/sys/run/backup-agent.sock', 'POST', '/jobs',
+                                  {'operation': 'backup', 'arguments': sys.argv[1:]})
+    """
+    if _is_tcp_address(address):
+        host, port = address.rsplit(':', 1)
+        connection = http.client.HTTPConnection(host, int(port), timeout=timeout)
+    else:
+        connection = _UnixHTTPConnection(address, timeout)
+    try:
+        body = json.dumps(content) if content is not None else None
+        headers = {'Content-Type': 'application/json'}
+        token = token or daemon_token()
+        if token:
+            headers['Authorization'] = 'Bearer {}'.format(token)
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
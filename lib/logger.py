@@ -1,13 +1,229 @@
+import atexit
 import json
+import os
+import queue
 import sys
+import threading
 import logging, logging.handlers
 
+# Queue based logging: the calling thread only enqueues the records, a background listener owns the handlers and
+# escapes, formats and writes the records in batches (see LogListener)
+LOG_ASYNC = os.getenv('SF_BACKUP_RESTORE_LOG_ASYNC', '').lower() in ('1', 'true', 'yes')
+# Maximum number of records written with one write per handler
+LOG_BATCH_SIZE = int(os.getenv('SF_BACKUP_RESTORE_LOG_BATCH_SIZE', 256))
+# Seconds after which a suppressed repeated message (e.g. of a polling loop) is written again
+LOG_REPEAT_INTERVAL = float(os.getenv('SF_BACKUP_RESTORE_LOG_REPEAT_INTERVAL', 60))
+# Seconds flush_logger waits for the listener
+LOG_FLUSH_TIMEOUT = 10
+
+_listener = None
+
+
+def escape_message(message):
+    try:
+        return json.dumps(message)
+    except:
+        return str(message)
+
+
+class LazyJson(object):
+    """A log message which is escaped as JSON when the record is formatted (once, for all handlers)."""
+    __slots__ = ('message', 'escaped')
+
+    def __init__(self, message):
+        self.message = message
+        self.escaped = None
+
+    def __str__(self):
+        if self.escaped is None:
+            self.escaped = escape_message(self.message)
+        return self.escaped
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # the record stays within the process, the listener formats it
+        return record
+
+
+class LogListener(object):
+    """Writes the records of queue to handlers on a background thread.
+
+    The records queued meanwhile are written together (up to batch_size per write and handler); a record repeating the
+    level and message of the previous one is counted instead of written, unless repeat_interval seconds passed since
+    it was written last. flush blocks until everything queued before was written.
+    """
+
+    def __init__(self, handlers, batch_size=LOG_BATCH_SIZE, repeat_interval=LOG_REPEAT_INTERVAL):
+        self.handlers = handlers
+        self.queue = queue.Queue()
+        self.batch_size = batch_size
+        self.repeat_interval = repeat_interval
+        # held while writing, the handlers may only be replaced with it (see init_logger)
+        self.lock = threading.Lock()
+        self.__thread = None
+        self.__last = None
+        self.__last_written = None
+        self.__repeated = []
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__run, name='log-listener', daemon=True)
+        self.__thread.start()
+
+    def flush(self, timeout=LOG_FLUSH_TIMEOUT):
+        if self.__thread is None or not self.__thread.is_alive():
+            return False
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        return flushed.wait(timeout)
+
+    def stop(self, timeout=LOG_FLUSH_TIMEOUT):
+        if self.__thread is not None and self.__thread.is_alive():
+            self.queue.put(None)
+            self.__thread.join(timeout)
+
+    def __run(self):
+        while True:
+            item = self.queue.get()
+            records = []
+            while isinstance(item, logging.LogRecord):
+                records.append(item)
+                if len(records) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    item = False
+            if records:
+                self.__write(self.__suppress_repeats(records))
+            if isinstance(item, threading.Event) or item is None:
+                self.__write(self.__repeat_summary())
+                for handler in self.handlers:
+                    try:
+                        handler.flush()
+                    except (OSError, ValueError):
+                        # e.g. the stream was closed at the exit of the interpreter
+                        pass
+                if item is None:
+                    return
+                item.set()
+
+    def __suppress_repeats(self, records):
+        written = []
+        for record in records:
+            key = (record.levelno, record.getMessage())
+            if key == self.__last and record.created - self.__last_written < self.repeat_interval:
+                self.__repeated.append(record)
+                continue
+            written.extend(self.__repeat_summary())
+            self.__last = key
+            self.__last_written = record.created
+            written.append(record)
+        return written
+
+    def __repeat_summary(self):
+        if not self.__repeated:
+            return []
+        last = self.__repeated[-1]
+        summary = logging.makeLogRecord(dict(last.__dict__, args=None, msg=LazyJson(
+            '[LOG] The previous message was repeated {} times'.format(len(self.__repeated)))))
+        self.__repeated = []
+        return [summary]
+
+    def __write(self, records):
+        if not records:
+            return
+        with self.lock:
+            for handler in self.handlers:
+                handler.acquire()
+                try:
+                    self.__write_to(handler, records)
+                finally:
+                    handler.release()
+
+    def __write_to(self, handler, records):
+        lines = []
+        size = 0
+        for record in records:
+            if record.levelno < handler.level:
+                continue
+            try:
+                line = handler.format(record) + handler.terminator
+                if isinstance(handler, logging.handlers.RotatingFileHandler) and handler.maxBytes > 0:
+                    if handler.stream is None:
+                        handler.stream = handler._open()
+                    if handler.stream.tell() + size + len(line) >= handler.maxBytes:
+                        self.__write_lines(handler, lines)
+                        lines, size = [], 0
+                        handler.doRollover()
+                lines.append(line)
+                size += len(line)
+            except Exception:
+                handler.handleError(record)
+        try:
+            self.__write_lines(handler, lines)
+        except Exception:
+            handler.handleError(records[-1])
+
+    @staticmethod
+    def __write_lines(handler, lines):
+        if not lines:
+            return
+        if isinstance(handler, logging.FileHandler) and handler.stream is None:
+            handler.stream = handler._open()
+        handler.stream.write(''.join(lines))
+        handler.flush()
+
+
+def flush_logger():
+    """Wait until the records logged so far were written (queue based logging only)."""
+    if _listener is not None:
+        _listener.flush()
+
+
+def stop_logger():
+    """Write the queued records and hand the handlers back to the logger, which writes on the calling thread again."""
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    logger = logging.getLogger('agent')
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for handler in listener.handlers:
+        logger.addHandler(handler)
+
+
+def _follow_logfile(handlers, logfile_path, max_bytes, backup_count):
+    followed = []
+    for handler in handlers:
+        if isinstance(handler, logging.FileHandler) and handler.baseFilename != os.path.abspath(logfile_path):
+            handler.close()
+            fileHandler = logging.handlers.RotatingFileHandler(logfile_path, maxBytes=max_bytes,
+                                                               backupCount=backup_count)
+            fileHandler.setFormatter(handler.formatter)
+            handler = fileHandler
+        followed.append(handler)
+    return followed
+
 
 def init_logger(logfile_path, max_bytes=5000000, backup_count=2):
+    global _listener
     logger = logging.getLogger('agent')
 
-    # +-> Prevent adding handlers more than once
+    # +-> Prevent adding handlers more than once, but follow the operation of a long running process (daemon jobs)
     if len(logger.handlers) > 0:
+        if _listener is not None:
+            _listener.flush()
+            with _listener.lock:
+                _listener.handlers = _follow_logfile(_listener.handlers, logfile_path, max_bytes, backup_count)
+        else:
+            handlers = list(logger.handlers)
+            for handler, followed in zip(handlers, _follow_logfile(handlers, logfile_path, max_bytes, backup_count)):
+                if followed is not handler:
+                    logger.removeHandler(handler)
+                    logger.addHandler(followed)
         return
 
     # +-> Logging options / add handlers
@@ -17,10 +233,17 @@ def init_logger(logfile_path, max_bytes=5000000, backup_count=2):
                                   '%Y-%m-%dT%H:%M:%SZ')
     consoleHandler = logging.StreamHandler(sys.stdout)
     consoleHandler.setFormatter(formatter)
-    logger.addHandler(consoleHandler)
     fileHandler = logging.handlers.RotatingFileHandler(logfile_path, maxBytes=max_bytes, backupCount=backup_count)
     fileHandler.setFormatter(formatter)
-    logger.addHandler(fileHandler)
+    if LOG_ASYNC:
+        _listener = LogListener([consoleHandler, fileHandler])
+        _listener.start()
+        logger.addHandler(LogQueueHandler(_listener.queue))
+        # the records queued until the interpreter exits are written (e.g. after sys.exit)
+        atexit.register(stop_logger)
+    else:
+        logger.addHandler(consoleHandler)
+        logger.addHandler(fileHandler)
 
 
 def create_logger(iaas_client):
@@ -47,10 +270,8 @@ class Logger:
         self.iaas_client = iaas_client
 
     def escape_message(self, message):
-        try:
-            return json.dumps(message)
-        except:
-            return str(message)
+        # escaped when the record is formatted, i.e. by the listener thread with queue based logging
+        return LazyJson(message)
 
     def debug(self, message):
         """Logs a message with level 'debug'.
@@ -0,0 +1,21 @@
+MANIFEST_VERSION = 1
+
+
+class ArchiveManifest:
+    def __init__(self, directories, shards, version=MANIFEST_VERSION):
+        # {'name': <suffix of the blob>, 'entries': <count>} of the archive of the directories, restored last
+        self.directories = directories
+        # [{'name': <suffix of the blob>, 'files': <count>, 'size': <bytes>}, ...] of the archives of the files
+        self.shards = shards
+        self.version = version
+
+    def as_dict(self):
+        return {
+            'version': self.version,
+            'directories': self.directories,
+            'shards': self.shards
+        }
+
+    def __repr__(self):
+        return 'ArchiveManifest(version={}, directories={}, shards={})'.format(
+            self.version, self.directories['entries'], len(self.shards))
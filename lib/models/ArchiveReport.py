@@ -0,0 +1,41 @@
+class ArchiveReport:
+    def __init__(self, path, files_compressed=0, files_stored=0, bytes_compressed=0, bytes_stored=0, archive_size=0,
+                 sampling_time=0, compression_time=0, compression_time_saved=0, duration=0, errors=None):
+        self.path = path
+        # regular files (and their bytes) deflated, and stored in the gzip stream because their sample hardly shrank
+        self.files_compressed = files_compressed
+        self.files_stored = files_stored
+        self.bytes_compressed = bytes_compressed
+        self.bytes_stored = bytes_stored
+        # bytes of the gzip stream
+        self.archive_size = archive_size
+        self.sampling_time = sampling_time
+        self.compression_time = compression_time
+        # estimated time compressing the stored bytes would have taken
+        self.compression_time_saved = compression_time_saved
+        self.duration = duration
+        self.errors = errors if errors is not None else []
+
+    def __bool__(self):
+        return len(self.errors) == 0
+
+    def as_dict(self):
+        return {
+            'path': self.path,
+            'filesCompressed': self.files_compressed,
+            'filesStored': self.files_stored,
+            'bytesCompressed': self.bytes_compressed,
+            'bytesStored': self.bytes_stored,
+            'archiveSize': self.archive_size,
+            'samplingTime': round(self.sampling_time, 3),
+            'compressionTime': round(self.compression_time, 3),
+            'compressionTimeSaved': round(self.compression_time_saved, 3),
+            'duration': round(self.duration, 3),
+            'errors': self.errors
+        }
+
+    def __repr__(self):
+        return 'ArchiveReport(path={}, files_compressed={}, files_stored={}, bytes_compressed={}, bytes_stored={}, ' \
+               'archive_size={}, compression_time_saved={:.3f}, errors={})'.format(
+                   self.path, self.files_compressed, self.files_stored, self.bytes_compressed, self.bytes_stored,
+                   self.archive_size, self.compression_time_saved, self.errors)
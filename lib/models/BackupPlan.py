@@ -0,0 +1,29 @@
+class BackupPlan:
+    def __init__(self, codec, sparse, archive_size, part_size, concurrency, poll_maximum_time, survey=None):
+        # gzip (default level) or gzip-fast (level 1, for data which hardly compresses)
+        self.codec = codec
+        # archive sparse files with holes (tar --sparse)
+        self.sparse = sparse
+        self.archive_size = archive_size
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.poll_maximum_time = poll_maximum_time
+        self.survey = survey
+
+    def as_dict(self):
+        content = {
+            'codec': self.codec,
+            'sparse': self.sparse,
+            'archiveSize': self.archive_size,
+            'partSize': self.part_size,
+            'concurrency': self.concurrency,
+            'pollMaximumTime': self.poll_maximum_time
+        }
+        if self.survey is not None:
+            content['survey'] = self.survey.as_dict()
+        return content
+
+    def __repr__(self):
+        return 'BackupPlan(codec={}, sparse={}, archive_size={}, part_size={}, concurrency={}, ' \
+               'poll_maximum_time={})'.format(self.codec, self.sparse, self.archive_size, self.part_size,
+                                              self.concurrency, self.poll_maximum_time)
@@ -0,0 +1,48 @@
+# Upper bounds of the buckets of the file size distribution, the last bucket holds the larger files
+SIZE_BUCKETS = [4 << 10, 64 << 10, 1 << 20, 16 << 20, 256 << 20, 4 << 30]
+SIZE_BUCKET_NAMES = ['<4KiB', '<64KiB', '<1MiB', '<16MiB', '<256MiB', '<4GiB', '>=4GiB']
+
+
+class DirectorySurvey:
+    def __init__(self, path, files=0, directories=0, symlinks=0, size=0, allocated=0, sparse_files=0,
+                 sparse_bytes=0, histogram=None, compression_ratio=None, sampled_bytes=0, duration=0, errors=None):
+        self.path = path
+        self.files = files
+        self.directories = directories
+        self.symlinks = symlinks
+        # apparent size (st_size) and the size allocated on the disk (st_blocks)
+        self.size = size
+        self.allocated = allocated
+        self.sparse_files = sparse_files
+        self.sparse_bytes = sparse_bytes
+        self.histogram = histogram if histogram is not None else [0] * len(SIZE_BUCKET_NAMES)
+        # compressed / original size of the sampled data, None if nothing was sampled
+        self.compression_ratio = compression_ratio
+        self.sampled_bytes = sampled_bytes
+        self.duration = duration
+        self.errors = errors if errors is not None else []
+
+    def __bool__(self):
+        return len(self.errors) == 0
+
+    def as_dict(self):
+        return {
+            'files': self.files,
+            'directories': self.directories,
+            'symlinks': self.symlinks,
+            'size': self.size,
+            'allocated': self.allocated,
+            'sparseFiles': self.sparse_files,
+            'sparseBytes': self.sparse_bytes,
+            'sizeDistribution': dict(zip(SIZE_BUCKET_NAMES, self.histogram)),
+            'compressionRatio': self.compression_ratio,
+            'sampledBytes': self.sampled_bytes,
+            'duration': round(self.duration, 3),
+            'errors': len(self.errors)
+        }
+
+    def __repr__(self):
+        return 'DirectorySurvey(path={}, files={}, directories={}, size={}, allocated={}, sparse_files={}, ' \
+               'compression_ratio={}, duration={}, errors={})'.format(
+                   self.path, self.files, self.directories, self.size, self.allocated, self.sparse_files,
+                   self.compression_ratio, self.duration, self.errors)
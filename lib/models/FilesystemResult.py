@@ -0,0 +1,16 @@
+class FilesystemResult:
+    def __init__(self, operation, path, files=0, directories=0, size=0, duration=0, errors=None):
+        self.operation = operation
+        self.path = path
+        self.files = files
+        self.directories = directories
+        self.size = size
+        self.duration = duration
+        self.errors = errors if errors is not None else []
+
+    def __bool__(self):
+        return len(self.errors) == 0
+
+    def __repr__(self):
+        return 'FilesystemResult(operation={}, path={}, files={}, directories={}, size={}, duration={}, errors={})'.format(
+            self.operation, self.path, self.files, self.directories, self.size, self.duration, self.errors)
@@ -0,0 +1,230 @@
+import grp
+import os
+import pwd
+import stat
+import tarfile
+import time
+import zlib
+from ..models.ArchiveReport import ArchiveReport
+from .backup_plan import INCOMPRESSIBLE_RATIO
+from .reader import READ_BUFFER_SIZE, SequentialReader
+
+TAR = 'tar'
+ADAPTIVE = 'adaptive'
+# How the backups create their tarballs: tar (GNU tar and gzip through the shell) or adaptive (write_archive
+# in-process, files which hardly compress are stored in the gzip stream instead of being deflated)
+ARCHIVER = os.getenv('SF_BACKUP_RESTORE_ARCHIVER', TAR)
+COMPRESSION_LEVEL = int(os.getenv('SF_BACKUP_RESTORE_COMPRESSION_LEVEL', 6))
+# Files are sampled from the middle of their first buffer; smaller files are always compressed
+SAMPLE_BYTES = 64 * 1024
+MINIMUM_SAMPLED_SIZE = 4096
+# Bytes of the end of an archive, which is padded to records of 20 blocks like GNU tar does
+END_OF_ARCHIVE = tarfile.NUL * tarfile.BLOCKSIZE * 2
+RECORD_SIZE = tarfile.RECORDSIZE
+
+
+class _GzipMembers:
+    """A gzip stream written as a new gzip member whenever the files switch between deflated and stored.
+
+    gzip -d (and so tar -xz) reads the concatenated members as one stream; stored members are deflate blocks of
+    level 0, which cost a CRC only.
+    """
+
+    def __init__(self, output, level):
+        self.output = output
+        self.level = level
+        self.compressing = None
+        self.size = 0
+        self.archive_size = 0
+        self.compression_time = 0.0
+        self.__compressor = None
+
+    def select(self, compress):
+        if compress != self.compressing:
+            self.__finish_member()
+            self.compressing = compress
+            self.__compressor = zlib.compressobj(self.level if compress else 0, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def write(self, data):
+        start = time.perf_counter()
+        compressed = self.__compressor.compress(data)
+        if self.compressing:
+            self.compression_time += time.perf_counter() - start
+        self.size += len(data)
+        self.__output(compressed)
+
+    def close(self):
+        self.__finish_member()
+
+    def __finish_member(self):
+        if self.__compressor is not None:
+            self.__output(self.__compressor.flush())
+            self.__compressor = None
+
+    def __output(self, data):
+        if data:
+            self.output.write(data)
+            self.archive_size += len(data)
+
+
+class _Archive:
+    def __init__(self, directory, output, level, reader):
+        self.directory = directory
+        self.reader = reader
+        self.stream = _GzipMembers(output, level)
+        self.report = ArchiveReport(directory)
+        # (st_dev, st_ino) -> name of the first archived hard link
+        self.links = {}
+        self.__names = {}
+
+    def name_of(self, function, key):
+        # the user and group names are looked up once per id, like tar does
+        if (function, key) not in self.__names:
+            try:
+                self.__names[function, key] = function(key)[0]
+            except KeyError:
+                self.__names[function, key] = ''
+        return self.__names[function, key]
+
+    def tarinfo(self, path, name, entry_stat):
+        member = tarfile.TarInfo(name)
+        member.mode = stat.S_IMODE(entry_stat.st_mode)
+        member.uid = entry_stat.st_uid
+        member.gid = entry_stat.st_gid
+        member.uname = self.name_of(pwd.getpwuid, entry_stat.st_uid)
+        member.gname = self.name_of(grp.getgrgid, entry_stat.st_gid)
+        member.mtime = int(entry_stat.st_mtime)
+        mode = entry_stat.st_mode
+        if stat.S_ISREG(mode):
+            key = (entry_stat.st_dev, entry_stat.st_ino)
+            if entry_stat.st_nlink > 1 and key in self.links:
+                member.type = tarfile.LNKTYPE
+                member.linkname = self.links[key]
+            else:
+                if entry_stat.st_nlink > 1:
+                    self.links[key] = name
+                member.size = entry_stat.st_size
+        elif stat.S_ISDIR(mode):
+            member.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(mode):
+            member.type = tarfile.SYMTYPE
+            member.linkname = os.readlink(path)
+        elif stat.S_ISFIFO(mode):
+            member.type = tarfile.FIFOTYPE
+        elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+            member.type = tarfile.CHRTYPE if stat.S_ISCHR(mode) else tarfile.BLKTYPE
+            member.devmajor = os.major(entry_stat.st_rdev)
+            member.devminor = os.minor(entry_stat.st_rdev)
+        else:
+            # sockets are skipped by tar as well
+            return None
+        return member
+
+    def header(self, member):
+        self.stream.write(member.tobuf(tarfile.GNU_FORMAT, 'utf-8', 'surrogateescape'))
+
+    def sample(self, data):
+        """Whether data (the first buffer of a file) shrinks enough to deflate the file."""
+        if len(data) < MINIMUM_SAMPLED_SIZE:
+            return True
+        start = time.perf_counter()
+        middle = max(0, len(data) // 2 - SAMPLE_BYTES // 2)
+        sample = data[middle:middle + SAMPLE_BYTES]
+        compressible = len(zlib.compress(sample, 1)) <= len(sample) * INCOMPRESSIBLE_RATIO
+        self.report.sampling_time += time.perf_counter() - start
+        return compressible
+
+    def add_file(self, source, path, member):
+        try:
+            data = source.read(min(member.size, READ_BUFFER_SIZE))
+        except OSError as error:
+            self.report.errors.append('{}: {}'.format(path, error))
+            return
+        compress = self.sample(data)
+        self.stream.select(compress)
+        self.header(member)
+        remaining = member.size
+        while data and remaining:
+            data = data[:remaining]
+            self.stream.write(data)
+            remaining -= len(data)
+            try:
+                data = source.read(min(remaining, READ_BUFFER_SIZE))
+            except OSError as error:
+                self.report.errors.append('{}: {}'.format(path, error))
+                data = b''
+        if remaining:
+            # the header is written, the member is padded to its size like GNU tar does with files that shrank
+            self.report.errors.append('{}: {} bytes could not be read'.format(path, remaining))
+            while remaining:
+                padding = tarfile.NUL * min(remaining, READ_BUFFER_SIZE)
+                self.stream.write(padding)
+                remaining -= len(padding)
+        if member.size % tarfile.BLOCKSIZE:
+            self.stream.write(tarfile.NUL * (tarfile.BLOCKSIZE - member.size % tarfile.BLOCKSIZE))
+        if compress:
+            self.report.files_compressed += 1
+            self.report.bytes_compressed += member.size
+        else:
+            self.report.files_stored += 1
+            self.report.bytes_stored += member.size
+
+    def add(self, name, recursive):
+        # errors reading the entry skip it, errors writing the output (e.g. gpg failed) end the archive
+        path = os.path.join(self.directory, name)
+        try:
+            entry_stat = os.lstat(path)
+            member = self.tarinfo(path, name, entry_stat)
+            if member is None:
+                return []
+            source = self.reader(path) if member.isreg() else None
+            contents = sorted('{}/{}'.format(name, entry) for entry in os.listdir(path)) \
+                if recursive and member.isdir() else []
+        except OSError as error:
+            self.report.errors.append('{}: {}'.format(path, error))
+            return []
+        if source is not None:
+            with source:
+                self.add_file(source, path, member)
+        else:
+            if self.stream.compressing is None:
+                self.stream.select(True)
+            self.header(member)
+        return contents
+
+    def finish(self):
+        if self.stream.compressing is None:
+            self.stream.select(True)
+        self.stream.write(END_OF_ARCHIVE)
+        if self.stream.size % RECORD_SIZE:
+            self.stream.write(tarfile.NUL * (RECORD_SIZE - self.stream.size % RECORD_SIZE))
+        self.stream.close()
+
+
+def write_archive(directory, output, names=None, level=COMPRESSION_LEVEL, reader=SequentialReader):
+    """Write a tar.gz of directory to output (e.g. the stdin of gpg) like 'tar -cpz -C <directory> .'.
+
+    The first buffer of each regular file is sampled: a file whose sample does not shrink below INCOMPRESSIBLE_RATIO
+    with the fastest level is stored in the gzip stream instead of being deflated. The stream is still read by any
+    gunzip and tar -xz; the time deflating the stored bytes would have taken is estimated from the time deflating
+    the other bytes took.
+
+    :param names: the names of the entries relative to directory ('./a/b'), archived without their contents like
+        with 'tar --no-recursion -T'; by default the whole directory is archived
+    :param reader: opens the files, by default a ``SequentialReader`` with the configured read-ahead and O_DIRECT
+    :returns: an ``ArchiveReport``, files which could not be read are skipped and reported as errors
+    """
+    start = time.time()
+    archive = _Archive(directory, output, level, reader)
+    pending = list(reversed(names)) if names is not None else ['.']
+    while pending:
+        # depth first in sorted order, every directory before its contents
+        pending.extend(reversed(archive.add(pending.pop(), names is None)))
+    archive.finish()
+    report = archive.report
+    report.archive_size = archive.stream.archive_size
+    report.compression_time = archive.stream.compression_time
+    if report.bytes_compressed:
+        report.compression_time_saved = report.compression_time * report.bytes_stored / report.bytes_compressed
+    report.duration = time.time() - start
+    return report
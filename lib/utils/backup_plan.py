@@ -0,0 +1,40 @@
+import math
+import os
+from ..models.BackupPlan import BackupPlan
+
+MIB = 1024 * 1024
+# Compression ratio (compressed / original size) above which the fastest gzip level is used
+INCOMPRESSIBLE_RATIO = 0.9
+# Parts of a multipart upload: S3 allows 10000 parts of 5 MiB to 5 GiB, GCS chunks are multiples of 256 KiB
+MINIMUM_PART_SIZE = int(os.getenv('SF_BACKUP_RESTORE_PLAN_MINIMUM_PART_SIZE', 8 * MIB))
+MAXIMUM_PART_SIZE = 5 * 1024 * MIB
+MAXIMUM_PARTS = 10000
+# Upper limit of the parts transferred at the same time
+MAXIMUM_CONCURRENCY = int(os.getenv('SF_BACKUP_RESTORE_PLAN_MAXIMUM_CONCURRENCY', 10))
+# Bytes per second assumed for snapshots and volumes of the data, to choose poll_maximum_time
+SNAPSHOT_THROUGHPUT = float(os.getenv('SF_BACKUP_RESTORE_PLAN_SNAPSHOT_THROUGHPUT', 32 * MIB))
+MINIMUM_POLL_TIME = 300
+# tar writes a 512 byte header per entry and pads the content of every file to 512 bytes
+TAR_BLOCK = 512
+
+
+def plan_backup(survey, poll_maximum_time=None):
+    """Choose the codec, part size, transfer concurrency and maximum polling time of a backup from a survey.
+
+    :param survey: a ``DirectorySurvey`` of the directory to be backed up (see filesystem.survey_tree)
+    :param poll_maximum_time: the configured maximum polling time, it is never lowered
+    :returns: a ``BackupPlan``
+    """
+    ratio = survey.compression_ratio if survey.compression_ratio is not None else 1.0
+    codec = 'gzip-fast' if ratio > INCOMPRESSIBLE_RATIO else 'gzip'
+    tar_size = survey.size + (survey.files + survey.directories + survey.symlinks) * TAR_BLOCK * 2
+    archive_size = int(tar_size * min(1.0, ratio))
+
+    part_size = max(MINIMUM_PART_SIZE, int(math.ceil(archive_size / MAXIMUM_PARTS / MIB)) * MIB)
+    part_size = min(MAXIMUM_PART_SIZE, part_size)
+    parts = max(1, int(math.ceil(archive_size / part_size)))
+    concurrency = max(1, min(MAXIMUM_CONCURRENCY, parts))
+
+    estimated_poll_time = int(MINIMUM_POLL_TIME + survey.allocated / SNAPSHOT_THROUGHPUT)
+    return BackupPlan(codec, survey.sparse_files > 0, archive_size, part_size, concurrency,
+                      max(poll_maximum_time or 0, estimated_poll_time), survey)
@@ -0,0 +1,34 @@
+import threading
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+class CancellationToken(object):
+    """A thread-safe flag which is set when the running operation should be aborted.
+
+    Long running loops check it at safe points (check) and waits sleep on it (wait), so that a cancellation
+    interrupts them immediately instead of after the current sleep or transfer.
+    """
+
+    def __init__(self):
+        self.__event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.__event.is_set()
+
+    def cancel(self):
+        self.__event.set()
+
+    def reset(self):
+        self.__event.clear()
+
+    def check(self):
+        if self.__event.is_set():
+            raise OperationCancelled('Operation was cancelled')
+
+    def wait(self, timeout):
+        """Sleep for timeout seconds unless cancelled before. Returns True if cancelled."""
+        return self.__event.wait(timeout)
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+from .filesystem import is_private, make_private_directory
+
+PROBE = 'probe'
+HEAD = 'head'
+CACHED = 'cached'
+LAZY = 'lazy'
+STRATEGIES = (PROBE, HEAD, CACHED, LAZY)
+
+# How the access to the container is checked when a client is created:
+#   probe:  write and delete a test blob (every time)
+#   head:   only check that the container exists and can be read, nothing is written
+#   cached: probe once, then trust the result for CONTAINER_ACCESS_TTL seconds (shared by the following processes)
+#   lazy:   nothing is checked up front, the first upload fails with the same error if the container is not writable
+CONTAINER_ACCESS_CHECK = os.getenv('SF_BACKUP_RESTORE_CONTAINER_ACCESS_CHECK', CACHED)
+CONTAINER_ACCESS_TTL = float(os.getenv('SF_BACKUP_RESTORE_CONTAINER_ACCESS_TTL', 3600))
+# Directory of the markers of probed containers, private to the user; if empty, the results are only cached within
+# the process
+CONTAINER_ACCESS_CACHE_DIRECTORY = os.getenv('SF_BACKUP_RESTORE_CONTAINER_ACCESS_CACHE', os.path.join(
+    tempfile.gettempdir(), 'sf-backup-restore-containers-{}'.format(os.geteuid())))
+ACCESS_TEST_BLOB = 'AccessTestByServiceFabrikPythonLibrary'
+ACCESS_ERROR = 'Could not find or access the given container.'
+
+
+def access_key(provider, container, identity):
+    """Key of a container accessed with identity (e.g. the credentials); they are hashed, the key is a file name."""
+    content = json.dumps([provider, container, identity], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class ContainerAccessCache(object):
+    """Containers a probe succeeded for, kept in memory and as empty marker files in directory (if given).
+
+    A marker is valid for ttl seconds after the probe; forget removes it, e.g. once an upload was denied. The directory
+    and the markers are only used if they are owned by the effective user and not writable by others, otherwise the
+    results are kept in memory only.
+    """
+
+    def __init__(self, directory=CONTAINER_ACCESS_CACHE_DIRECTORY, ttl=CONTAINER_ACCESS_TTL, clock=time.time):
+        self.directory = directory
+        self.ttl = ttl
+        self.clock = clock
+        self.__verified = {}
+        self.__lock = threading.Lock()
+
+    def is_verified(self, key):
+        with self.__lock:
+            verified_at = self.__verified.get(key)
+            path = os.path.join(self.directory, key) if self.directory else None
+            if verified_at is None and path and is_private(self.directory) and is_private(path, stat.S_ISREG):
+                try:
+                    verified_at = os.lstat(path).st_mtime
+                except OSError:
+                    pass
+            return verified_at is not None and self.clock() - verified_at < self.ttl
+
+    def verified(self, key):
+        now = self.clock()
+        with self.__lock:
+            self.__verified[key] = now
+            if self.directory and make_private_directory(self.directory):
+                try:
+                    descriptor = os.open(os.path.join(self.directory, key),
+                                         os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+                    try:
+                        os.utime(descriptor, (now, now))
+                    finally:
+                        os.close(descriptor)
+                except OSError:
+                    # the next process probes the container again
+                    pass
+
+    def forget(self, key):
+        with self.__lock:
+            self.__verified.pop(key, None)
+            if self.directory:
+                try:
+                    os.remove(os.path.join(self.directory, key))
+                except OSError:
+                    pass
+
+
+container_access_cache = ContainerAccessCache()
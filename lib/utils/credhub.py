@@ -0,0 +1,206 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+
+# Directory of the encrypted cache files shared by the following processes; without it tokens and credentials are
+# only cached within the process (e.g. by the daemon)
+CREDHUB_CACHE_DIRECTORY = os.getenv('SF_BACKUP_RESTORE_CREDHUB_CACHE')
+# Seconds fetched IaaS credentials are used before they are fetched again (rotated credentials)
+CREDENTIALS_TTL = float(os.getenv('SF_BACKUP_RESTORE_CREDHUB_CREDENTIALS_TTL', 900))
+# Fraction of the token lifetime (expires_in) left at which a new token is requested, while the old one still works
+REFRESH_AHEAD = float(os.getenv('SF_BACKUP_RESTORE_CREDHUB_REFRESH_AHEAD', 0.2))
+# Seconds before the expiry at which a token is not used any more (clock skew, duration of the request)
+EXPIRY_MARGIN = 30
+KEY_DERIVATION_ITERATIONS = 20000
+
+
+def _secret(configuration):
+    # only a caller knowing the OAuth client and user secrets can read the cache files
+    return '\0'.join(str(configuration.get(name)) for name in (
+        'credhub_client_id', 'credhub_client_secret', 'credhub_username', 'credhub_user_password'))
+
+
+def _fernet():
+    """The Fernet and InvalidToken classes, or None if the cryptography package is not installed."""
+    try:
+        from cryptography.fernet import Fernet, InvalidToken
+    except ImportError:
+        return None
+    return Fernet, InvalidToken
+
+
+def _cache_name(kind, configuration):
+    return '{}\0{}\0{}\0{}'.format(kind, configuration.get('credhub_uaa_url'), configuration.get('credhub_url'),
+                                   configuration.get('credhub_key'))
+
+
+class CredentialsCache(object):
+    """Tokens and credentials with their expiry, kept in memory and as encrypted files in directory (if given).
+
+    The files are encrypted with Fernet (AES-CBC with HMAC) using a key derived from the OAuth secrets of the
+    configuration; they are ignored if the cryptography package is not installed, cannot be decrypted (e.g. the
+    secrets changed) or are expired. The entries in memory keep a digest of the secret they were stored with, and are
+    only returned to callers with the same secret.
+    """
+
+    def __init__(self, directory=CREDHUB_CACHE_DIRECTORY, clock=time.time):
+        # cryptography is only imported if the files are used
+        self.__fernet_classes = _fernet() if directory else None
+        if directory and self.__fernet_classes is None:
+            print('[CREDHUB] WARNING: the cryptography package is not installed, the cache in {} is not used and every '
+                  'process fetches the token and the credentials again'.format(directory), file=sys.stderr)
+        self.directory = directory if self.__fernet_classes is not None else None
+        self.clock = clock
+        # name -> (entry, digest of the secret)
+        self.__entries = {}
+        self.__keys = {}
+        self.__salt = os.urandom(16)
+        self.__lock = threading.Lock()
+
+    def get(self, name, secret):
+        """The (value, fetched at, expires at) of name, or None if there is no unexpired entry."""
+        digest = self.__digest(secret)
+        with self.__lock:
+            entry, entry_digest = self.__entries.get(name, (None, None))
+            if entry is not None and not hmac.compare_digest(entry_digest, digest):
+                return None
+            if entry is None and self.directory:
+                entry = self.__read(name, secret)
+                if entry is not None:
+                    self.__entries[name] = entry, digest
+            if entry is None or entry[2] <= self.clock():
+                return None
+            return entry
+
+    def put(self, name, secret, value, expires_at):
+        entry = (value, self.clock(), expires_at)
+        with self.__lock:
+            self.__entries[name] = entry, self.__digest(secret)
+            if self.directory:
+                self.__write(name, secret, entry)
+
+    def invalidate(self, name):
+        with self.__lock:
+            self.__entries.pop(name, None)
+            if self.directory:
+                try:
+                    os.remove(self.__path(name))
+                except OSError:
+                    pass
+
+    def __digest(self, secret):
+        return hmac.new(self.__salt, secret.encode('utf-8'), hashlib.sha256).digest()
+
+    def __path(self, name):
+        return os.path.join(self.directory, hashlib.sha256(name.encode('utf-8')).hexdigest())
+
+    def __fernet(self, name, secret):
+        if (name, secret) not in self.__keys:
+            key = hashlib.pbkdf2_hmac('sha256', secret.encode('utf-8'), name.encode('utf-8'),
+                                      KEY_DERIVATION_ITERATIONS)
+            self.__keys[(name, secret)] = self.__fernet_classes[0](base64.urlsafe_b64encode(key))
+        return self.__keys[(name, secret)]
+
+    def __read(self, name, secret):
+        try:
+            with open(self.__path(name), 'rb') as cache_file:
+                value, fetched_at, expires_at = json.loads(
+                    self.__fernet(name, secret).decrypt(cache_file.read()).decode('utf-8'))
+            return value, fetched_at, expires_at
+        except (OSError, ValueError, self.__fernet_classes[1]):
+            return None
+
+    def __write(self, name, secret, entry):
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            path = self.__path(name)
+            temporary = '{}.{}.tmp'.format(path, os.getpid())
+            descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(descriptor, 'wb') as cache_file:
+                cache_file.write(self.__fernet(name, secret).encrypt(json.dumps(entry).encode('utf-8')))
+            os.replace(temporary, path)
+        except OSError:
+            # the cache is an optimization, the credentials are fetched again by the next process
+            pass
+
+
+class Credhub(object):
+    """Fetches IaaS credentials from CredHub with a UAA password grant token.
+
+    Tokens are reused until shortly before they expire and renewed ahead of time, credentials are reused for
+    CREDENTIALS_TTL seconds; both requests share one pooled HTTP session.
+    """
+
+    def __init__(self, cache=None, session=None, clock=time.time):
+        self.cache = cache if cache is not None else CredentialsCache(clock=clock)
+        self.clock = clock
+        self.__session = session
+
+    @property
+    def session(self):
+        if self.__session is None:
+            import requests
+            self.__session = requests.Session()
+        return self.__session
+
+    def get_access_token(self, configuration):
+        name = _cache_name('token', configuration)
+        secret = _secret(configuration)
+        cached = self.cache.get(name, secret)
+        if cached is not None:
+            token, fetched_at, expires_at = cached
+            refresh_at = expires_at - (expires_at - fetched_at) * REFRESH_AHEAD
+            if self.clock() < refresh_at:
+                return token
+            try:
+                return self.__request_access_token(configuration, name, secret)
+            except Exception:
+                # the cached token is still valid, the next call tries to renew it again
+                return token
+        return self.__request_access_token(configuration, name, secret)
+
+    def __request_access_token(self, configuration, name, secret):
+        payload = {
+            'grant_type': 'password',
+            'client_id': configuration['credhub_client_id'],
+            'client_secret': configuration['credhub_client_secret'],
+            'response_type': 'token',
+            'username': configuration['credhub_username'],
+            'password': configuration['credhub_user_password']
+        }
+        response = self.session.post(url=configuration['credhub_uaa_url'] + '/oauth/token', data=payload, verify=False)
+        auth_token = response.json()
+        expires_in = auth_token.get('expires_in')
+        if expires_in:
+            self.cache.put(name, secret, auth_token['access_token'],
+                           self.clock() + max(0, float(expires_in) - EXPIRY_MARGIN))
+        return auth_token['access_token']
+
+    def get_credentials(self, configuration):
+        name = _cache_name('credentials', configuration)
+        secret = _secret(configuration)
+        cached = self.cache.get(name, secret)
+        if cached is not None:
+            return cached[0]
+        params = {'name': configuration['credhub_key'],
+                  'current': 'true'}
+        headers = {'content-type': 'application/json',
+                   'authorization': 'bearer ' + self.get_access_token(configuration)}
+        response = self.session.get(url=configuration['credhub_url'].rstrip('/') + '/v1/data', headers=headers,
+                                    params=params, verify=False)
+        credentials = response.json()['data'][0]['value']
+        self.cache.put(name, secret, credentials, self.clock() + CREDENTIALS_TTL)
+        return credentials
+
+    def invalidate(self, configuration):
+        """Forget the token and credentials of the configuration, e.g. once the credentials were rejected."""
+        self.cache.invalidate(_cache_name('token', configuration))
+        self.cache.invalidate(_cache_name('credentials', configuration))
+
+
+credhub = Credhub()
@@ -0,0 +1,179 @@
+import ctypes
+import ctypes.util
+import glob
+import os
+import re
+import select
+import time
+
+FILE_MOUNTS = '/proc/mounts'
+DIRECTORY_SYS_BLOCK = '/sys/class/block'
+DIRECTORY_DEV = '/dev'
+DIRECTORY_DISK_BY_ID = '/dev/disk/by-id'
+
+# inotify(7) event masks
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+POLL_INTERVAL = 0.1
+MOUNTS_ESCAPE = re.compile(r'\\([0-7]{3})')
+
+
+def _unescape(field):
+    # /proc/mounts escapes space, tab, newline and backslash as octal sequences
+    return MOUNTS_ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), field)
+
+
+def read_mounts(mounts_file=FILE_MOUNTS):
+    """Parse a mounts table into (device, mountpoint, fstype, options) tuples."""
+    mounts = []
+    with open(mounts_file, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            mounts.append((_unescape(fields[0]), _unescape(fields[1]), fields[2], fields[3]))
+    return mounts
+
+
+def get_mounted_device(directory, mounts_file=FILE_MOUNTS):
+    """Return the device mounted at directory, or None.
+
+    An exact mountpoint match wins; otherwise the first entry whose line
+    mentions the directory is used, as 'grep directory /proc/mounts' did.
+    """
+    mounts = read_mounts(mounts_file)
+    for device, mountpoint, _, _ in mounts:
+        if mountpoint.rstrip('/') == directory.rstrip('/'):
+            return device
+    for device, mountpoint, _, _ in mounts:
+        if directory in device or directory in mountpoint:
+            return device
+    return None
+
+
+def resolve_device(path):
+    """Resolve a device symlink, returning None unless every component exists (readlink -e)."""
+    if not os.path.exists(path):
+        return None
+    return os.path.realpath(path)
+
+
+def _parent_block_device(name, sys_block=DIRECTORY_SYS_BLOCK):
+    # Partitions live below their disk in sysfs: .../block/nvme1n1/nvme1n1p1
+    if os.path.exists(os.path.join(sys_block, name, 'partition')):
+        return os.path.basename(os.path.dirname(os.path.realpath(os.path.join(sys_block, name))))
+    return name
+
+
+def list_partitions(sys_block=DIRECTORY_SYS_BLOCK, dev_directory=DIRECTORY_DEV):
+    """List partition device paths known to the kernel, sorted by name."""
+    try:
+        names = sorted(os.listdir(sys_block))
+    except OSError:
+        return []
+    return [os.path.join(dev_directory, name) for name in names
+            if os.path.exists(os.path.join(sys_block, name, 'partition'))]
+
+
+def get_nvme_volume_id(device, sys_block=DIRECTORY_SYS_BLOCK):
+    """Return the EBS volume id (vol-xxx) encoded in an NVMe device serial, or None.
+
+    EBS exposes the volume id without its dash as the controller serial number,
+    which is what 'nvme id-ctrl -v <device> | egrep vol' used to extract.
+    """
+    name = os.path.basename(os.path.realpath(device))
+    if not name.startswith('nvme'):
+        return None
+    serial_file = os.path.join(sys_block, _parent_block_device(name, sys_block), 'device', 'serial')
+    try:
+        with open(serial_file, 'r') as f:
+            serial = f.read().strip()
+    except (IOError, OSError):
+        return None
+    if not serial.startswith('vol'):
+        return None
+    return 'vol-' + serial[3:].lstrip('-')
+
+
+def find_by_id_links(pattern, directory=DIRECTORY_DISK_BY_ID):
+    """Return the sorted names in directory matching the regular expression pattern."""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    expression = re.compile(pattern)
+    return sorted(name for name in names if expression.search(name))
+
+
+def trigger_block_uevents(sys_block=DIRECTORY_SYS_BLOCK):
+    """Ask udev to re-process block devices, like 'udevadm trigger' limited to block devices."""
+    for uevent in glob.glob(os.path.join(sys_block, '*', 'uevent')):
+        try:
+            with open(uevent, 'w') as f:
+                f.write('change')
+        except (IOError, OSError):
+            pass
+
+
+class DirectoryWatcher(object):
+    """Blocks until entries are created in a directory.
+
+    Uses inotify when the C library provides it and falls back to a short
+    polling interval otherwise, so callers never need a fixed sleep.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                return
+            if libc.inotify_add_watch(fd, directory.encode(), IN_CREATE | IN_MOVED_TO | IN_ATTRIB) < 0:
+                os.close(fd)
+                return
+            self.fd = fd
+        except (OSError, AttributeError):
+            self.fd = None
+
+    def wait(self, timeout):
+        if timeout <= 0:
+            return
+        if self.fd is None:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except (BlockingIOError, OSError):
+                pass
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def wait_for(condition, directory, timeout):
+    """Evaluate condition whenever directory changes until it returns a truthy value or timeout expires."""
+    deadline = time.time() + timeout
+    with DirectoryWatcher(directory) as watcher:
+        while True:
+            result = condition()
+            remaining = deadline - time.time()
+            if result or remaining <= 0:
+                return result
+            watcher.wait(remaining)
@@ -0,0 +1,77 @@
+import json
+import os
+import stat
+import tempfile
+import time
+from .filesystem import is_private, make_private_directory
+
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest'
+# Directory the discovery documents of the Google APIs are kept in between the processes, private to the user
+DISCOVERY_CACHE_DIRECTORY = os.getenv('SF_BACKUP_RESTORE_GCP_DISCOVERY_CACHE', os.path.join(
+    tempfile.gettempdir(), 'sf-backup-restore-discovery-{}'.format(os.geteuid())))
+# Seconds after which a cached document is fetched again (new methods or fields of the API)
+DISCOVERY_CACHE_MAX_AGE = float(os.getenv('SF_BACKUP_RESTORE_GCP_DISCOVERY_MAX_AGE', 7 * 24 * 3600))
+
+
+def _library_version():
+    try:
+        import googleapiclient
+        return googleapiclient.__version__
+    except (ImportError, AttributeError):
+        return 'unknown'
+
+
+def _fetch(api, version):
+    import requests
+    response = requests.get(DISCOVERY_URL.format(api=api, version=version), timeout=60)
+    response.raise_for_status()
+    return response.text
+
+
+def cache_path(api, version, directory=DISCOVERY_CACHE_DIRECTORY):
+    # The version of the client library is part of the name: a new library may need a newer document format
+    return os.path.join(directory, '{}.{}.{}.json'.format(api, version, _library_version()))
+
+
+def discovery_document(api, version, directory=DISCOVERY_CACHE_DIRECTORY, max_age=DISCOVERY_CACHE_MAX_AGE,
+                       fetch=_fetch, clock=time.time):
+    """The parsed discovery document of a Google API, from the cache unless it is older than max_age.
+
+    A stale or broken cache file is replaced by a fetched document; if fetching fails, a stale one is used instead.
+    The documents define the requests of the API client: the cache is not used when the directory or a file is not
+    owned by the effective user or writable by others.
+    """
+    path = cache_path(api, version, directory)
+    private = make_private_directory(directory)
+    stale = None
+    try:
+        if private and is_private(path, stat.S_ISREG):
+            with open(path) as cache_file:
+                document = json.load(cache_file)
+            if clock() - os.path.getmtime(path) < max_age:
+                return document
+            stale = document
+    except (OSError, ValueError):
+        pass
+    try:
+        content = fetch(api, version)
+        document = json.loads(content)
+    except Exception:
+        if stale is not None:
+            return stale
+        raise
+    if private:
+        _write(path, content)
+    return document
+
+
+def _write(path, content):
+    try:
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+        with open(descriptor, 'w') as cache_file:
+            cache_file.write(content)
+        os.replace(temporary, path)
+    except OSError:
+        # the next process fetches the document again
+        pass
@@ -0,0 +1,299 @@
+import collections
+import grp
+import gzip
+import io
+import os
+import pwd
+import shutil
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ..models.FilesystemResult import FilesystemResult
+from .filesystem import FILESYSTEM_WORKERS
+
+TAR = 'tar'
+PARALLEL = 'parallel'
+# How the restores extract their tarballs: tar (GNU tar through the shell) or parallel (extract_stream in-process)
+EXTRACTOR = os.getenv('SF_BACKUP_RESTORE_EXTRACTOR', TAR)
+# fsync the extracted files (in batches, by the worker filling a batch) and directories
+EXTRACT_FSYNC = os.getenv('SF_BACKUP_RESTORE_EXTRACT_FSYNC', '').lower() in ('1', 'true', 'yes')
+FSYNC_BATCH = 64
+# Files up to this size are read into memory and written by the worker pool, larger ones by the reading thread
+SMALL_FILE_SIZE = 4 * 1024 * 1024
+# Bytes of small files read from the stream which are not written yet
+MAXIMUM_PENDING_BYTES = 64 * 1024 * 1024
+# Regular files whose writes are tracked for hard links to them; the oldest one is waited for once there are more
+WRITE_WINDOW = 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class _Extraction:
+    def __init__(self, directory, fsync):
+        self.directory = os.path.abspath(directory)
+        self.real_directory = os.path.realpath(directory)
+        self.fsync = fsync
+        self.owner = os.geteuid() == 0
+        self.files = 0
+        self.size = 0
+        self.errors = []
+        # (path, attributes) of the directories, applied once their contents are written
+        self.directories = []
+        self.known_directories = set()
+        # (path, linkname, attributes) of the symbolic links created last
+        self.symlinks = []
+        # path -> future of the last WRITE_WINDOW regular files, hard links wait for their target
+        self.written = collections.OrderedDict()
+        self.__ids = {}
+        self.__lock = threading.Lock()
+        self.__pending = 0
+        self.__pending_changed = threading.Condition(self.__lock)
+        self.__unsynced = []
+
+    def target(self, name):
+        path = os.path.normpath(os.path.join(self.directory, name.lstrip('/')))
+        if path != self.directory and not path.startswith(self.directory + os.sep):
+            raise ValueError('the path leads outside of {}'.format(self.directory))
+        return path
+
+    def check_inside(self, path):
+        # the check of target is lexical, symbolic links extracted before (./link -> /etc, ./link/passwd) are not
+        real_path = os.path.realpath(path)
+        if real_path != self.real_directory and not real_path.startswith(self.real_directory + os.sep):
+            raise ValueError('the path leads outside of {} through a symbolic link'.format(self.directory))
+
+    def attributes(self, member):
+        """(uid, gid, mode, mtime) of a member; the owner is only changed by root, by name like tar."""
+        uid = gid = None
+        if self.owner:
+            key = (member.uname, member.gname, member.uid, member.gid)
+            if key not in self.__ids:
+                try:
+                    uid = pwd.getpwnam(member.uname).pw_uid
+                except KeyError:
+                    uid = member.uid
+                try:
+                    gid = grp.getgrnam(member.gname).gr_gid
+                except KeyError:
+                    gid = member.gid
+                self.__ids[key] = uid, gid
+            uid, gid = self.__ids[key]
+        return uid, gid, member.mode, member.mtime
+
+    def error(self, name, error):
+        with self.__lock:
+            self.errors.append('{}: {}'.format(name, error))
+
+    def make_directory(self, path):
+        if path not in self.known_directories:
+            self.check_inside(path)
+            os.makedirs(path, exist_ok=True)
+            self.known_directories.add(path)
+
+    def remove_existing(self, path):
+        if os.path.lexists(path) and not os.path.isdir(path):
+            os.unlink(path)
+
+    def track(self, path, future):
+        # archives of millions of files must not keep a future per file, the files beyond the window are written
+        self.written.pop(path, None)
+        self.written[path] = future
+        while len(self.written) > WRITE_WINDOW:
+            self.written.popitem(last=False)[1].result()
+
+    def reserve(self, size):
+        # limits the memory of the small files read ahead of the workers
+        with self.__pending_changed:
+            while self.__pending and self.__pending + size > MAXIMUM_PENDING_BYTES:
+                self.__pending_changed.wait()
+            self.__pending += size
+
+    def release(self, size):
+        with self.__pending_changed:
+            self.__pending -= size
+            self.__pending_changed.notify_all()
+
+    def write_small_file(self, path, name, data, attributes):
+        try:
+            descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC | os.O_NOFOLLOW, 0o600)
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(descriptor, view):]
+                self.set_attributes(descriptor, attributes)
+            except BaseException:
+                os.close(descriptor)
+                raise
+            self.close(descriptor)
+        except OSError as error:
+            self.error(name, error)
+        finally:
+            self.release(len(data))
+
+    def write_large_file(self, path, fileobj):
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC | os.O_NOFOLLOW, 0o600)
+        with open(descriptor, 'wb') as target_file:
+            shutil.copyfileobj(fileobj, target_file, COPY_BUFFER_SIZE)
+
+    def set_file_attributes(self, path, name, attributes):
+        try:
+            descriptor = os.open(path, os.O_RDONLY | os.O_CLOEXEC | os.O_NOFOLLOW)
+            try:
+                self.set_attributes(descriptor, attributes)
+            except BaseException:
+                os.close(descriptor)
+                raise
+            self.close(descriptor)
+        except OSError as error:
+            self.error(name, error)
+
+    def set_attributes(self, descriptor, attributes):
+        uid, gid, mode, mtime = attributes
+        if uid is not None:
+            os.fchown(descriptor, uid, gid)
+        os.fchmod(descriptor, mode)
+        os.utime(descriptor, (mtime, mtime))
+
+    def close(self, descriptor):
+        if not self.fsync:
+            os.close(descriptor)
+            return
+        with self.__lock:
+            self.__unsynced.append(descriptor)
+            if len(self.__unsynced) < FSYNC_BATCH:
+                return
+            batch, self.__unsynced = self.__unsynced, []
+        self.sync(batch)
+
+    def sync(self, batch=None):
+        if batch is None:
+            with self.__lock:
+                batch, self.__unsynced = self.__unsynced, []
+        for descriptor in batch:
+            try:
+                os.fsync(descriptor)
+            except OSError as error:
+                self.error(descriptor, error)
+            finally:
+                os.close(descriptor)
+
+    def make_symlink(self, path, linkname, attributes):
+        self.remove_existing(path)
+        os.symlink(linkname, path)
+        uid, gid, _, _ = attributes
+        if uid is not None:
+            os.lchown(path, uid, gid)
+
+    def finish_symlinks(self):
+        for path, linkname, attributes in self.symlinks:
+            try:
+                self.make_symlink(path, linkname, attributes)
+            except OSError as error:
+                self.error(path, error)
+
+    def finish_directories(self):
+        # deepest first: setting the mode or mtime of a parent must not be undone by its children
+        for path, attributes in sorted(self.directories, key=lambda directory: directory[0].count(os.sep),
+                                       reverse=True):
+            uid, gid, mode, mtime = attributes
+            try:
+                if uid is not None:
+                    os.chown(path, uid, gid)
+                os.chmod(path, mode)
+                os.utime(path, (mtime, mtime))
+                if self.fsync:
+                    descriptor = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+                    try:
+                        os.fsync(descriptor)
+                    finally:
+                        os.close(descriptor)
+            except OSError as error:
+                self.error(path, error)
+
+
+def _extract_member(tar, member, extraction, executor):
+    path = extraction.target(member.name)
+    if member.isdir():
+        extraction.make_directory(path)
+        extraction.directories.append((path, extraction.attributes(member)))
+        return
+    extraction.make_directory(os.path.dirname(path))
+    if member.isreg():
+        # an existing file is replaced like tar does, an existing symbolic link is not followed
+        extraction.remove_existing(path)
+        attributes = extraction.attributes(member)
+        extraction.files += 1
+        extraction.size += member.size
+        if member.size <= SMALL_FILE_SIZE:
+            data = tar.extractfile(member).read()
+            extraction.reserve(len(data))
+            extraction.track(path, executor.submit(extraction.write_small_file, path, member.name, data, attributes))
+        else:
+            extraction.write_large_file(path, tar.extractfile(member))
+            extraction.track(path, executor.submit(extraction.set_file_attributes, path, member.name, attributes))
+    elif member.islnk():
+        source = extraction.target(member.linkname)
+        extraction.check_inside(os.path.dirname(source))
+        if source in extraction.written:
+            extraction.written[source].result()
+        extraction.remove_existing(path)
+        os.link(source, path, follow_symlinks=False)
+    elif member.issym():
+        if os.path.isabs(member.linkname) or '..' in member.linkname.split('/'):
+            # like GNU tar, links which may lead outside are created last, no member is extracted through them
+            extraction.symlinks.append((path, member.linkname, extraction.attributes(member)))
+        else:
+            extraction.make_symlink(path, member.linkname, extraction.attributes(member))
+    else:
+        # fifos and devices are rare, tarfile creates them
+        tar.extract(member, extraction.directory)
+
+
+def _open(fileobj):
+    # tarfile's stream mode reads the first member of a gzip stream only, GzipFile reads all of them like gunzip
+    if not hasattr(fileobj, 'peek'):
+        fileobj = io.BufferedReader(fileobj, COPY_BUFFER_SIZE)
+    if fileobj.peek(2)[:2] == b'\x1f\x8b':
+        return tarfile.open(fileobj=gzip.GzipFile(fileobj=fileobj, mode='rb'), mode='r|')
+    return tarfile.open(fileobj=fileobj, mode='r|*')
+
+
+def extract_stream(fileobj, directory, workers=FILESYSTEM_WORKERS, fsync=EXTRACT_FSYNC):
+    """Extract a (compressed) tar stream into directory, like 'tar -xf - -C <directory>' run by root.
+
+    The stream is read by the calling thread, which creates the directories in the order of the archive; the files
+    are written and get their owner, mode and mtime from a thread pool. The attributes of the directories are set
+    once all files are written. Members leading outside of directory, also through symbolic links extracted before, are
+    skipped and reported; symbolic links with an absolute target or '..' are created last.
+
+    :returns: a ``FilesystemResult`` with the extracted files and directories
+    """
+    start = time.time()
+    extraction = _Extraction(directory, fsync)
+    try:
+        with _open(fileobj) as tar, \
+                ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for member in tar:
+                try:
+                    _extract_member(tar, member, extraction, executor)
+                except (OSError, ValueError, tarfile.TarError) as error:
+                    extraction.error(member.name, error)
+            # tarfile stops silently at a truncated header, the end of an archive is a block of zeros
+            if getattr(tar.fileobj, 'pos', tar.offset + tarfile.BLOCKSIZE) < tar.offset + tarfile.BLOCKSIZE:
+                extraction.error(directory, 'unexpected end of the archive')
+    except (OSError, EOFError, tarfile.TarError) as error:
+        extraction.error(directory, error)
+    extraction.finish_symlinks()
+    extraction.sync()
+    extraction.finish_directories()
+    return FilesystemResult('extract', directory, files=extraction.files, directories=len(extraction.directories),
+                            size=extraction.size, duration=time.time() - start, errors=extraction.errors)
+
+
+def extract_file(tarball, directory, workers=FILESYSTEM_WORKERS, fsync=EXTRACT_FSYNC):
+    """Extract a (compressed) tarball into directory, see extract_stream."""
+    try:
+        with open(tarball, 'rb') as tarball_file:
+            return extract_stream(tarball_file, directory, workers, fsync)
+    except OSError as error:
+        return FilesystemResult('extract', directory, errors=['{}: {}'.format(tarball, error)])
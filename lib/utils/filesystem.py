@@ -0,0 +1,345 @@
+import bisect
+import errno
+import fcntl
+import heapq
+import os
+import queue
+import shutil
+import stat
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from ..models.FilesystemResult import FilesystemResult
+from ..models.DirectorySurvey import DirectorySurvey, SIZE_BUCKETS
+
+FILESYSTEM_WORKERS = int(os.getenv('SF_BACKUP_RESTORE_FILESYSTEM_WORKERS', min(16, (os.cpu_count() or 1) * 2)))
+
+# ioctl(2) request to share the extents of a file on copy-on-write filesystems (btrfs, xfs with reflink=1)
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+# Number of the largest files read for the compressibility sample of survey_tree and the bytes read from each
+SURVEY_SAMPLE_FILES = int(os.getenv('SF_BACKUP_RESTORE_SURVEY_SAMPLE_FILES', 32))
+SURVEY_SAMPLE_BYTES = 256 * 1024
+# A file is sparse if this many bytes of its apparent size are not allocated
+SPARSE_MINIMUM_HOLE = 1024 * 1024
+
+
+def _scan(path):
+    """Walk a tree with scandir without following symlinks.
+
+    :returns: (directories top-down, files and symlinks as (path, size) tuples)
+    """
+    directories = [path]
+    files = []
+    index = 0
+    while index < len(directories):
+        for entry in os.scandir(directories[index]):
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+            else:
+                files.append((entry.path, entry.stat(follow_symlinks=False).st_size))
+        index += 1
+    return directories, files
+
+
+def _run_parallel(function, items, workers):
+    """Apply function to all items with a thread pool and collect the error messages."""
+    errors = []
+
+    def run(item):
+        try:
+            function(item)
+        except OSError as error:
+            return '{}: {}'.format(item, error)
+        return None
+
+    if workers <= 1 or len(items) <= 1:
+        results = map(run, items)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run, items))
+    errors.extend(error for error in results if error)
+    return errors
+
+
+def make_directory(path):
+    """Create a directory and its parents, like 'mkdir -p'."""
+    start = time.time()
+    errors = []
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError as error:
+        errors.append('{}: {}'.format(path, error))
+    return FilesystemResult('mkdir', path, directories=1, duration=time.time() - start, errors=errors)
+
+
+def is_private(path, is_type=stat.S_ISDIR):
+    """Whether path is of the type (not following a symlink), owned by the effective user and not writable by others.
+
+    Caches shared between the processes only trust such directories and files: no other user can have planted them.
+    """
+    try:
+        status = os.lstat(path)
+    except OSError:
+        return False
+    return (is_type(status.st_mode) and status.st_uid == os.geteuid() and
+            not status.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def make_private_directory(path):
+    """Create a directory with mode 0700 unless it exists, returns whether it is private (see is_private)."""
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+    except OSError:
+        return False
+    return is_private(path)
+
+
+def remove_tree(path, workers=FILESYSTEM_WORKERS):
+    """Remove a file or a directory tree, like 'rm -rf'. Missing paths are not an error.
+
+    Files are unlinked by a thread pool, directories are removed bottom-up afterwards.
+    """
+    start = time.time()
+    if not os.path.lexists(path):
+        return FilesystemResult('rm', path, duration=time.time() - start)
+    if not os.path.isdir(path) or os.path.islink(path):
+        return _remove_entries('rm', path, [], [(path, 0)], workers, start)
+    try:
+        directories, files = _scan(path)
+    except OSError as error:
+        return FilesystemResult('rm', path, duration=time.time() - start, errors=['{}: {}'.format(path, error)])
+    return _remove_entries('rm', path, directories, files, workers, start)
+
+
+def clear_directory(path, workers=FILESYSTEM_WORKERS):
+    """Remove the contents of a directory, like 'rm -rf <path>/*' (hidden entries are kept as the glob skips them)."""
+    start = time.time()
+    directories = []
+    files = []
+    try:
+        entries = [entry for entry in os.scandir(path) if not entry.name.startswith('.')]
+    except FileNotFoundError:
+        return FilesystemResult('clear', path, duration=time.time() - start)
+    except OSError as error:
+        return FilesystemResult('clear', path, duration=time.time() - start, errors=['{}: {}'.format(path, error)])
+    try:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories, subfiles = _scan(entry.path)
+                directories.extend(subdirectories)
+                files.extend(subfiles)
+            else:
+                files.append((entry.path, entry.stat(follow_symlinks=False).st_size))
+    except OSError as error:
+        return FilesystemResult('clear', path, duration=time.time() - start, errors=['{}: {}'.format(path, error)])
+    return _remove_entries('clear', path, directories, files, workers, start)
+
+
+def _remove_entries(operation, path, directories, files, workers, start):
+    errors = _run_parallel(os.unlink, [file_path for file_path, _ in files], workers)
+    # Deepest directories first, they are empty once their files are gone
+    for directory in sorted(directories, key=lambda directory: directory.count(os.sep), reverse=True):
+        try:
+            os.rmdir(directory)
+        except OSError as error:
+            errors.append('{}: {}'.format(directory, error))
+    return FilesystemResult(operation, path, files=len(files), directories=len(directories),
+                            size=sum(size for _, size in files), duration=time.time() - start, errors=errors)
+
+
+def _copy_file_data(source_fd, destination_fd, size):
+    # 1. reflink: no data is copied at all on copy-on-write filesystems
+    try:
+        fcntl.ioctl(destination_fd, FICLONE, source_fd)
+        return
+    except OSError:
+        pass
+    # 2. copy_file_range (Python 3.8+) / sendfile: the kernel copies without user space buffers
+    copied = 0
+    kernel_copy = getattr(os, 'copy_file_range', None)
+    try:
+        while copied < size:
+            if kernel_copy:
+                sent = kernel_copy(source_fd, destination_fd, min(COPY_CHUNK_SIZE, size - copied))
+            else:
+                sent = os.sendfile(destination_fd, source_fd, copied, min(COPY_CHUNK_SIZE, size - copied))
+            if sent == 0:
+                break
+            copied += sent
+        if copied >= size:
+            return
+    except OSError as error:
+        if error.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP):
+            raise
+    # 3. plain read/write for the remainder (e.g. files growing while being copied or unsupported filesystems)
+    os.lseek(source_fd, copied, os.SEEK_SET)
+    os.lseek(destination_fd, copied, os.SEEK_SET)
+    while True:
+        chunk = os.read(source_fd, COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        os.write(destination_fd, chunk)
+
+
+def copy_file(source, destination):
+    """Copy a file (or recreate a symlink) including its permission bits, like 'cp'."""
+    source_stat = os.lstat(source)
+    if stat.S_ISLNK(source_stat.st_mode):
+        os.symlink(os.readlink(source), destination)
+        return
+    if not stat.S_ISREG(source_stat.st_mode):
+        # devices, sockets and fifos are rare in backups, fall back to the standard library
+        shutil.copy(source, destination)
+        return
+    source_fd = os.open(source, os.O_RDONLY)
+    try:
+        destination_fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, stat.S_IMODE(source_stat.st_mode))
+        try:
+            _copy_file_data(source_fd, destination_fd, source_stat.st_size)
+        finally:
+            os.close(destination_fd)
+    finally:
+        os.close(source_fd)
+
+
+def copy_tree(source, destination, workers=FILESYSTEM_WORKERS):
+    """Copy a file or a directory tree, like 'cp -r'.
+
+    If destination is an existing directory the source is copied into it. Directories are created first, then
+    the files are copied by a thread pool.
+    """
+    start = time.time()
+    if os.path.isdir(destination) and not os.path.islink(destination):
+        destination = os.path.join(destination, os.path.basename(source.rstrip(os.sep)))
+    try:
+        if not os.path.isdir(source) or os.path.islink(source):
+            size = os.lstat(source).st_size
+            copy_file(source, destination)
+            return FilesystemResult('cp', source, files=1, size=size, duration=time.time() - start)
+        directories, files = _scan(source)
+        for directory in directories:
+            target = os.path.join(destination, os.path.relpath(directory, source))
+            os.makedirs(target, exist_ok=True)
+            shutil.copymode(directory, target)
+    except OSError as error:
+        return FilesystemResult('cp', source, duration=time.time() - start, errors=['{}: {}'.format(source, error)])
+
+    def copy(file_path):
+        copy_file(file_path, os.path.join(destination, os.path.relpath(file_path, source)))
+
+    errors = _run_parallel(copy, [file_path for file_path, _ in files], workers)
+    return FilesystemResult('cp', source, files=len(files), directories=len(directories),
+                            size=sum(size for _, size in files), duration=time.time() - start, errors=errors)
+
+
+class _SurveyPart:
+    # counts of the entries of one directory, merged into the DirectorySurvey by survey_tree
+    def __init__(self):
+        self.directories = 0
+        self.files = 0
+        self.symlinks = 0
+        self.size = 0
+        self.allocated = 0
+        self.sparse_files = 0
+        self.sparse_bytes = 0
+        self.histogram = [0] * (len(SIZE_BUCKETS) + 1)
+        self.largest = []
+        self.errors = []
+
+
+def _survey_directory(directory, sample_files):
+    subdirectories = []
+    part = _SurveyPart()
+    try:
+        entries = os.scandir(directory)
+    except OSError as error:
+        part.errors.append('{}: {}'.format(directory, error))
+        return subdirectories, part
+    part.directories = 1
+    files = []
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+                continue
+            entry_stat = entry.stat(follow_symlinks=False)
+        except OSError as error:
+            part.errors.append('{}: {}'.format(entry.path, error))
+            continue
+        if stat.S_ISLNK(entry_stat.st_mode):
+            part.symlinks += 1
+            continue
+        size = entry_stat.st_size
+        allocated = entry_stat.st_blocks * 512
+        part.files += 1
+        part.size += size
+        part.allocated += allocated
+        part.histogram[bisect.bisect_right(SIZE_BUCKETS, size)] += 1
+        if size - allocated >= SPARSE_MINIMUM_HOLE:
+            part.sparse_files += 1
+            part.sparse_bytes += size - allocated
+        if stat.S_ISREG(entry_stat.st_mode):
+            files.append((size, entry.path))
+    part.largest = heapq.nlargest(sample_files, files)
+    return subdirectories, part
+
+
+def _compressed_size(path, size):
+    # level 1 is the fastest codec; data it cannot shrink is not worth compressing at all
+    with open(path, 'rb') as sampled_file:
+        sampled_file.seek(max(0, size // 2 - SURVEY_SAMPLE_BYTES // 2))
+        data = sampled_file.read(SURVEY_SAMPLE_BYTES)
+    return len(data), len(zlib.compress(data, 1))
+
+
+def survey_tree(path, workers=FILESYSTEM_WORKERS, sample_files=SURVEY_SAMPLE_FILES):
+    """Count the files of a tree and their sizes without reading them, e.g. to plan a backup.
+
+    The directories are scanned by a thread pool (one task per directory). The compression ratio is estimated from
+    a block in the middle of each of the sample_files largest files, weighted by their size.
+
+    :returns: a ``DirectorySurvey``, symlinks are counted but not followed
+    """
+    start = time.time()
+    survey = DirectorySurvey(path)
+    largest = []
+    # the finished directories are collected through a queue, waiting for a set of futures costs O(pending) each time
+    finished = queue.Queue()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+
+        def submit(directory):
+            executor.submit(_survey_directory, directory, sample_files).add_done_callback(finished.put)
+
+        submit(path)
+        pending = 1
+        while pending:
+            subdirectories, part = finished.get().result()
+            pending -= 1
+            for attribute in ('directories', 'files', 'symlinks', 'size', 'allocated', 'sparse_files', 'sparse_bytes'):
+                setattr(survey, attribute, getattr(survey, attribute) + getattr(part, attribute))
+            survey.histogram = [total + count for total, count in zip(survey.histogram, part.histogram)]
+            survey.errors.extend(part.errors)
+            largest = heapq.nlargest(sample_files, largest + part.largest)
+            for subdirectory in subdirectories:
+                submit(subdirectory)
+            pending += len(subdirectories)
+
+        samples = [(size, executor.submit(_compressed_size, sample_path, size))
+                   for size, sample_path in largest if size > 0]
+        weighted_ratio = 0.0
+        sampled_size = 0
+        for size, future in samples:
+            try:
+                read, compressed = future.result()
+            except OSError as error:
+                survey.errors.append(str(error))
+                continue
+            if read:
+                weighted_ratio += size * compressed / read
+                sampled_size += size
+                survey.sampled_bytes += read
+    if sampled_size:
+        survey.compression_ratio = round(weighted_ratio / sampled_size, 3)
+    survey.duration = time.time() - start
+    return survey
@@ -0,0 +1,80 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+# Updates which do not change the state are coalesced within this window (in seconds); the latest one wins
+LAST_OPERATION_INTERVAL = float(os.getenv('SF_BACKUP_RESTORE_LAST_OPERATION_INTERVAL', 1))
+
+
+def replace_symlink(target, link):
+    """Atomically point link to target, like 'ln -sf target link' without the fork."""
+    temporary_link = '{}.{}.tmp'.format(link, os.getpid())
+    if os.path.lexists(temporary_link):
+        os.remove(temporary_link)
+    os.symlink(target, temporary_link)
+    os.replace(temporary_link, link)
+
+
+class LastOperationWriter(object):
+    """Writes the last operation state of an operation into its blue/green files.
+
+    The symlink <operation>.lastoperation.json always points to a complete file: the new content goes to the file
+    not referenced by the link, which is then swapped atomically. Updates which keep the state are coalesced
+    within `interval` seconds, state changes are written immediately and pending updates are flushed at exit.
+    """
+
+    def __init__(self, directory, operation, interval=LAST_OPERATION_INTERVAL):
+        self.symlink = os.path.join(directory, operation + '.lastoperation.json')
+        self.blue = os.path.join(directory, operation + '.lastoperation.blue.json')
+        self.green = os.path.join(directory, operation + '.lastoperation.green.json')
+        self.interval = interval
+        self.__lock = threading.Lock()
+        self.__pending = None
+        self.__timer = None
+        self.__last_state = None
+        self.__last_write = 0
+        atexit.register(self.close)
+
+    def write(self, content):
+        """Write the content (a dict with at least a 'state' key), or schedule it if an update was just written."""
+        with self.__lock:
+            elapsed = time.time() - self.__last_write
+            if content.get('state') != self.__last_state or elapsed >= self.interval:
+                self.__pending = None
+                self.__write(content)
+                return
+            self.__pending = content
+            if self.__timer is None:
+                self.__timer = threading.Timer(self.interval - elapsed, self.flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def flush(self):
+        with self.__lock:
+            self.__timer = None
+            if self.__pending is not None:
+                content, self.__pending = self.__pending, None
+                self.__write(content)
+
+    def close(self):
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+        self.flush()
+        atexit.unregister(self.close)
+
+    def __write(self, content):
+        filename = self.green if self.__read_link() == self.blue else self.blue
+        with open(filename, 'w') as last_operation_file:
+            last_operation_file.write(json.dumps(content))
+        replace_symlink(filename, self.symlink)
+        self.__last_state = content.get('state')
+        self.__last_write = time.time()
+
+    def __read_link(self):
+        try:
+            return os.readlink(self.symlink)
+        except OSError:
+            return None
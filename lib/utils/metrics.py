@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+COUNTERS = ('bytesIn', 'bytesOut', 'apiCalls', 'attempts', 'retries', 'retryWait', 'rateLimitWait', 'polls', 'waitTime',
+            'errors')
+# Counters of some stages only (the archiving and throttled ones), they are added to a stage when first used
+OPTIONAL_COUNTERS = ('filesCompressed', 'filesStored', 'bytesCompressed', 'bytesStored', 'compressionTime',
+                     'compressionTimeSaved', 'throttleWait')
+
+# Prometheus metric name and help text per exported value
+PROMETHEUS_METRICS = OrderedDict([
+    ('wallTime', ('sf_backup_restore_stage_duration_seconds', 'Wall time spent in the stage')),
+    ('bytesIn', ('sf_backup_restore_stage_bytes_in', 'Bytes read or downloaded by the stage')),
+    ('bytesOut', ('sf_backup_restore_stage_bytes_out', 'Bytes written or uploaded by the stage')),
+    ('apiCalls', ('sf_backup_restore_stage_api_calls', 'IaaS and blobstore API calls issued by the stage')),
+    ('attempts', ('sf_backup_restore_stage_attempts', 'Attempts of the retried stage operation')),
+    ('retries', ('sf_backup_restore_stage_retries', 'Retries of the stage operation')),
+    ('retryWait', ('sf_backup_restore_stage_retry_wait_seconds', 'Time spent waiting between retries')),
+    ('rateLimitWait', ('sf_backup_restore_stage_rate_limit_wait_seconds', 'Time API calls queued in the rate limiter')),
+    ('polls', ('sf_backup_restore_stage_polls', 'Status polls while waiting for the IaaS')),
+    ('waitTime', ('sf_backup_restore_stage_wait_seconds', 'Time spent sleeping between status polls')),
+    ('errors', ('sf_backup_restore_stage_errors', 'Failed executions of the stage')),
+    ('filesCompressed', ('sf_backup_restore_stage_files_compressed', 'Files deflated by the archiver')),
+    ('filesStored', ('sf_backup_restore_stage_files_stored', 'Incompressible files stored by the archiver')),
+    ('bytesCompressed', ('sf_backup_restore_stage_bytes_compressed', 'Bytes of the files deflated by the archiver')),
+    ('bytesStored', ('sf_backup_restore_stage_bytes_stored', 'Bytes of the files stored by the archiver')),
+    ('compressionTime', ('sf_backup_restore_stage_compression_seconds', 'Time spent deflating files')),
+    ('compressionTimeSaved', ('sf_backup_restore_stage_compression_saved_seconds',
+                              'Estimated time deflating the stored files would have taken')),
+    ('throttleWait', ('sf_backup_restore_stage_throttle_wait_seconds',
+                      'Time uploads and disk reads waited for the bandwidth limits'))
+])
+
+
+def _format_labels(labels):
+    return ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for key, value in sorted(labels.items()))
+
+
+class Metrics(object):
+    """Per-stage timings and counters of an operation.
+
+    Stages nest per thread; counters are attributed to the innermost running stage of the calling thread, wall time to
+    every stage. Threads without a running stage (e.g. the transfer threads of an SDK) add their counters to the
+    innermost stage of the thread which entered the oldest running stage, usually the main thread.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.started_at = clock()
+        self.stages = OrderedDict()
+        self.__local = threading.local()
+        # stacks of the threads with running stages, in the order they were entered
+        self.__running = []
+        self.__lock = threading.Lock()
+
+    def __stack(self):
+        if not hasattr(self.__local, 'stack'):
+            self.__local.stack = []
+        return self.__local.stack
+
+    def __get_stage(self, name):
+        if name not in self.stages:
+            stage = OrderedDict([('count', 0), ('wallTime', 0.0)])
+            for counter in COUNTERS:
+                stage[counter] = 0
+            self.stages[name] = stage
+        return self.stages[name]
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def _enter(self, name):
+        # Re-entering the running stage (e.g. an overriding method calling super()) is not counted twice
+        stack = self.__stack()
+        with self.__lock:
+            if stack and stack[-1] == name:
+                stack.append(None)
+                return False
+            if not stack:
+                self.__running.append(stack)
+            self.__get_stage(name)['count'] += 1
+            stack.append(name)
+            return True
+
+    def _exit(self, name, duration, failed):
+        stack = self.__stack()
+        with self.__lock:
+            stack.pop()
+            if not stack:
+                self.__running = [running for running in self.__running if running is not stack]
+            if name is None:
+                return
+            stage = self.__get_stage(name)
+            stage['wallTime'] += duration
+            if failed:
+                stage['errors'] += 1
+
+    def add(self, counter, value=1, stage=None):
+        """Add value to a counter of the given stage, by default of the innermost running stage."""
+        stack = self.__stack()
+        with self.__lock:
+            if stage is None:
+                if not stack and self.__running:
+                    stack = self.__running[0]
+                running = [name for name in stack if name is not None]
+                stage = running[-1] if running else 'other'
+            values = self.__get_stage(stage)
+            if counter not in values and counter in OPTIONAL_COUNTERS:
+                values[counter] = 0
+            values[counter] += value
+
+    def as_dict(self):
+        with self.__lock:
+            stages = OrderedDict()
+            for name, values in self.stages.items():
+                stage = OrderedDict((key, round(value, 3) if isinstance(value, float) else value)
+                                    for key, value in values.items())
+                transferred = max(values['bytesIn'], values['bytesOut'])
+                stage['throughput'] = round(transferred / values['wallTime'], 3) \
+                    if transferred and values['wallTime'] > 0 else None
+                stages[name] = stage
+            return OrderedDict([('wallTime', round(self.clock() - self.started_at, 3)), ('stages', stages)])
+
+    def write_prometheus(self, path, labels):
+        """Write the metrics in the Prometheus text format for the node exporter's textfile collector.
+
+        The file is written next to its target and renamed, so the collector never reads a partial file.
+        """
+        metrics = self.as_dict()
+        lines = []
+        for key, (metric, description) in PROMETHEUS_METRICS.items():
+            lines.append('# HELP {} {}'.format(metric, description))
+            lines.append('# TYPE {} gauge'.format(metric))
+            for name, stage in metrics['stages'].items():
+                if key not in stage:
+                    continue
+                stage_labels = dict(labels, stage=name)
+                lines.append('{}{{{}}} {}'.format(metric, _format_labels(stage_labels), stage[key]))
+        lines.append('# HELP sf_backup_restore_duration_seconds Wall time of the whole operation')
+        lines.append('# TYPE sf_backup_restore_duration_seconds gauge')
+        lines.append('sf_backup_restore_duration_seconds{{{}}} {}'.format(_format_labels(labels), metrics['wallTime']))
+        lines.append('# HELP sf_backup_restore_last_run_timestamp_seconds Time the metrics were written')
+        lines.append('# TYPE sf_backup_restore_last_run_timestamp_seconds gauge')
+        lines.append('sf_backup_restore_last_run_timestamp_seconds{{{}}} {}'.format(
+            _format_labels(labels), round(self.clock(), 3)))
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temporary_path, path)
+
+
+class _Stage(object):
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.metrics.clock()
+        # False if the stage was already running, its values are then recorded by the outer one only
+        self.active = self.metrics._enter(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # SystemExit is the regular way out of an abortion, not a failure of the stage
+        failed = exc_type is not None and not issubclass(exc_type, SystemExit)
+        self.metrics._exit(self.name if self.active else None, self.metrics.clock() - self.start, failed)
+        return False
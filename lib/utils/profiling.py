@@ -0,0 +1,151 @@
+import atexit
+import cProfile
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILE_MODES = ('cpu', 'sample', 'memory')
+
+# Seconds between two stack samples / two memory snapshots and the number of allocation sites per snapshot
+SAMPLE_INTERVAL = float(os.getenv('SF_BACKUP_RESTORE_PROFILE_SAMPLE_INTERVAL', 0.01))
+MEMORY_INTERVAL = float(os.getenv('SF_BACKUP_RESTORE_PROFILE_MEMORY_INTERVAL', 60))
+MEMORY_TOP = int(os.getenv('SF_BACKUP_RESTORE_PROFILE_MEMORY_TOP', 25))
+
+_active_profiler = None
+
+
+def parse_modes(value):
+    """Parse SF_BACKUP_RESTORE_PROFILE: a comma separated list of cpu/sample/memory, 'all' (or 'true'/'1') for all."""
+    if not value or value.strip().lower() in ('0', 'false', 'off', 'no'):
+        return ()
+    modes = [mode.strip().lower() for mode in value.split(',') if mode.strip()]
+    if any(mode in ('all', 'true', '1', 'on', 'yes') for mode in modes):
+        return PROFILE_MODES
+    unknown = [mode for mode in modes if mode not in PROFILE_MODES]
+    if unknown:
+        raise Exception('Invalid profiling mode(s) {}, possible values: {}'.format(
+            ', '.join(unknown), '/'.join(PROFILE_MODES + ('all',))))
+    return tuple(mode for mode in PROFILE_MODES if mode in modes)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class Profiler(object):
+    """Profiles the running operation and writes the results next to the logs.
+
+    - cpu: deterministic profile (cProfile) of the main thread, written as <operation>.pstats
+    - sample: stacks of all threads sampled every sample_interval seconds, written in the collapsed format of
+      flamegraph.pl / speedscope as <operation>.collapsed
+    - memory: tracemalloc top-N allocation sites every memory_interval seconds, appended to <operation>.memory.txt
+    """
+
+    def __init__(self, directory, operation, modes, sample_interval=SAMPLE_INTERVAL,
+                 memory_interval=MEMORY_INTERVAL, memory_top=MEMORY_TOP):
+        self.modes = modes
+        self.sample_interval = sample_interval
+        self.memory_interval = memory_interval
+        self.memory_top = memory_top
+        self.path_pstats = os.path.join(directory, operation + '.pstats')
+        self.path_collapsed = os.path.join(directory, operation + '.collapsed')
+        self.path_memory = os.path.join(directory, operation + '.memory.txt')
+        self.samples = collections.Counter()
+        self.__profile = None
+        self.__threads = []
+        self.__stopped = threading.Event()
+        self.__lock = threading.Lock()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        if 'memory' in self.modes:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            open(self.path_memory, 'w').close()
+            self.__start_thread('memory-snapshots', self.__take_memory_snapshots)
+        if 'sample' in self.modes:
+            self.__start_thread('stack-sampler', self.__sample_stacks)
+        if 'cpu' in self.modes:
+            self.__profile = cProfile.Profile()
+            self.__profile.enable()
+        return self
+
+    def stop(self):
+        with self.__lock:
+            if not self.running:
+                return
+            self.running = False
+        if self.__profile:
+            self.__profile.disable()
+            self.__profile.dump_stats(self.path_pstats)
+        self.__stopped.set()
+        for thread in self.__threads:
+            thread.join()
+        if 'sample' in self.modes:
+            with open(self.path_collapsed, 'w') as f:
+                for stack, count in sorted(self.samples.items()):
+                    f.write('{} {}\n'.format(stack, count))
+        if 'memory' in self.modes:
+            self.write_memory_snapshot()
+            tracemalloc.stop()
+
+    def __start_thread(self, name, target):
+        thread = threading.Thread(target=target, name='profiler-{}'.format(name))
+        thread.daemon = True
+        thread.start()
+        self.__threads.append(thread)
+
+    def __sample_stacks(self):
+        own_ids = set(thread.ident for thread in self.__threads)
+        while not self.__stopped.wait(self.sample_interval):
+            names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in own_ids:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def __take_memory_snapshots(self):
+        while not self.__stopped.wait(self.memory_interval):
+            self.write_memory_snapshot()
+
+    def write_memory_snapshot(self):
+        """Append the current top-N allocation sites (by size) to the memory file."""
+        current, peak = tracemalloc.get_traced_memory()
+        statistics = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__)
+        ]).statistics('lineno')
+        lines = ['[{}] current={:.1f} MiB peak={:.1f} MiB'.format(
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), current / 2.0 ** 20, peak / 2.0 ** 20)]
+        for statistic in statistics[:self.memory_top]:
+            frame = statistic.traceback[0]
+            lines.append('  {:>10.1f} KiB {:>8} blocks  {}:{}'.format(
+                statistic.size / 1024.0, statistic.count, frame.filename, frame.lineno))
+        with self.__lock:
+            with open(self.path_memory, 'a') as f:
+                f.write('\n'.join(lines) + '\n\n')
+
+
+def start_profiling(directory, operation):
+    """Start profiling if enabled by SF_BACKUP_RESTORE_PROFILE, the results are written on exit.
+
+    :returns: the running ``Profiler`` or None if profiling is disabled
+    """
+    global _active_profiler
+    modes = parse_modes(os.getenv('SF_BACKUP_RESTORE_PROFILE'))
+    if not modes:
+        return None
+    if _active_profiler and _active_profiler.running:
+        return _active_profiler
+    _active_profiler = Profiler(directory, operation, modes).start()
+    atexit.register(_active_profiler.stop)
+    return _active_profiler
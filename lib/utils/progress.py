@@ -0,0 +1,76 @@
+import time
+
+GIB = 1024 ** 3
+
+
+def parse_percent(value):
+    """Convert provider progress values such as '45%', '45' or 45.0 to a float, or None."""
+    if value is None:
+        return None
+    try:
+        return float(str(value).strip().rstrip('%'))
+    except ValueError:
+        return None
+
+
+class ProgressTracker(object):
+    """Collects progress samples of a long running operation.
+
+    Samples are (time, percent, bytes) triples; throughput and ETA are averaged
+    from the start of the operation to the latest sample so that a single slow
+    poll does not distort them.
+    """
+
+    def __init__(self, name, total_bytes=None, clock=time.time):
+        self.name = name
+        self.total_bytes = total_bytes
+        self.clock = clock
+        self.started_at = clock()
+        self.samples = []
+
+    def update(self, percent=None, bytes_done=None, total_bytes=None):
+        if total_bytes is not None:
+            self.total_bytes = total_bytes
+        percent = parse_percent(percent)
+        if bytes_done is None and percent is not None and self.total_bytes:
+            bytes_done = int(self.total_bytes * percent / 100)
+        if percent is None and bytes_done is not None and self.total_bytes:
+            percent = 100.0 * bytes_done / self.total_bytes
+        if percent is None and bytes_done is None:
+            return
+        # Providers may report percent and bytes through different calls, keep the last known value of each
+        if self.samples:
+            _, last_percent, last_bytes = self.samples[-1]
+            percent = last_percent if percent is None else percent
+            bytes_done = last_bytes if bytes_done is None else bytes_done
+        self.samples.append((self.clock(), percent, bytes_done))
+
+    def finish(self):
+        self.update(percent=100, bytes_done=self.total_bytes)
+
+    def as_dict(self):
+        now = self.clock()
+        result = {
+            'name': self.name,
+            'percent': None,
+            'bytes': None,
+            'totalBytes': self.total_bytes,
+            'throughput': None,
+            'eta': None,
+            'elapsed': round(now - self.started_at, 3)
+        }
+        if not self.samples:
+            return result
+        last_time, last_percent, last_bytes = self.samples[-1]
+        result['percent'] = last_percent
+        result['bytes'] = last_bytes
+        duration = last_time - self.started_at
+        if duration > 0:
+            if last_bytes is not None:
+                result['throughput'] = round(last_bytes / duration, 3)
+            if last_percent is not None and 0 < last_percent < 100:
+                rate = last_percent / duration
+                result['eta'] = round((100 - last_percent) / rate, 3)
+            elif last_percent is not None and last_percent >= 100:
+                result['eta'] = 0
+        return result
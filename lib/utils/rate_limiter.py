@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+
+DESCRIBE = 'describe'
+MUTATE = 'mutate'
+STORAGE = 'storage'
+API_FAMILIES = (DESCRIBE, MUTATE, STORAGE)
+
+# Calls whose (last) name starts with one of these only read the state of resources
+DESCRIBE_PREFIXES = ('describe', 'get', 'list', 'head', 'aggregatedlist', 'find', 'show', 'exists')
+
+# (requests per second, burst) per provider and API family, close to the documented or observed limits of a single
+# account / subscription / project. They can be overwritten by SF_BACKUP_RESTORE_RATE_LIMIT_<FAMILY> or
+# SF_BACKUP_RESTORE_RATE_LIMIT_<PROVIDER>_<FAMILY>, e.g. SF_BACKUP_RESTORE_RATE_LIMIT_AWS_MUTATE=2/5 ('off' disables).
+DEFAULT_RATE_LIMITS = {
+    'aws': {DESCRIBE: (20, 50), MUTATE: (5, 10), STORAGE: (100, 200)},
+    'azure': {DESCRIBE: (10, 30), MUTATE: (2, 10), STORAGE: (100, 200)},
+    'gcp': {DESCRIBE: (20, 50), MUTATE: (5, 20), STORAGE: (100, 200)},
+    'ali': {DESCRIBE: (10, 20), MUTATE: (5, 10), STORAGE: (100, 200)},
+    'openstack': {DESCRIBE: (10, 20), MUTATE: (2, 5), STORAGE: (50, 100)}
+}
+FALLBACK_RATE_LIMITS = {DESCRIBE: (20, 50), MUTATE: (5, 10), STORAGE: (100, 200)}
+
+# On throttling the rate is halved (down to this fraction of the configured rate), each success adds this fraction
+MINIMUM_RATE_FRACTION = 0.05
+RECOVERY_FRACTION = 0.05
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def api_family(name):
+    """The API family (describe or mutate) of a call like 'ec2.DescribeSnapshots' or 'compute.snapshots.insert'."""
+    return DESCRIBE if name.rsplit('.', 1)[-1].lower().startswith(DESCRIBE_PREFIXES) else MUTATE
+
+
+def parse_rate_limit(value):
+    """Parse 'rate[/burst]' (burst defaults to the rate), 'off' or an empty value disable the limit."""
+    if value is None or value.strip().lower() in ('', 'off', '0', 'none'):
+        return None
+    rate, _, burst = value.partition('/')
+    rate = float(rate)
+    return rate, float(burst) if burst else max(1.0, rate)
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket which makes callers wait (queue) instead of failing once the burst is used up.
+
+    Callers reserve their token immediately, so the bucket may go into debt: every caller waits until the refill covers
+    its own reservation, which serves concurrent callers in the order they arrived. The rate adapts to throttling
+    responses of the provider: it is halved on throttling (AIMD) and recovers additively with every success.
+    """
+
+    def __init__(self, rate, burst, clock=time.time, sleep=time.sleep):
+        self.configured_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.clock = clock
+        self.sleep = sleep
+        self.__updated_at = clock()
+        self.__lock = threading.Lock()
+
+    def __refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.__updated_at) * self.rate)
+        self.__updated_at = now
+
+    def acquire(self, tokens=1):
+        """Take tokens, waiting until they are available. Returns the seconds waited."""
+        with self.__lock:
+            self.__refill(self.clock())
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    def configure(self, rate, burst):
+        """Change the configured rate and burst, e.g. while callers are queued; debts are kept."""
+        with self.__lock:
+            self.__refill(self.clock())
+            self.configured_rate = self.rate = float(rate)
+            self.burst = float(burst)
+            self.tokens = min(self.tokens, self.burst)
+
+    def throttled(self):
+        with self.__lock:
+            self.__refill(self.clock())
+            self.rate = max(self.configured_rate * MINIMUM_RATE_FRACTION, self.rate / 2)
+            # the provider is already over its limit, the remaining burst must not be spent at once
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        if self.rate >= self.configured_rate:
+            return
+        with self.__lock:
+            self.__refill(self.clock())
+            self.rate = min(self.configured_rate, self.rate + self.configured_rate * RECOVERY_FRACTION)
+
+
+class RateLimiter(object):
+    """Token buckets per API family of one provider, shared by all clients and threads of the process."""
+
+    def __init__(self, provider, limits=None, clock=time.time, sleep=time.sleep):
+        self.provider = provider
+        if limits is None:
+            limits = _configured_limits(provider)
+        self.buckets = dict((family, TokenBucket(limit[0], limit[1], clock, sleep))
+                            for family, limit in limits.items() if limit)
+
+    def acquire(self, family):
+        bucket = self.buckets.get(family)
+        return bucket.acquire() if bucket else 0
+
+    def record(self, family, throttled=False):
+        bucket = self.buckets.get(family)
+        if bucket is None:
+            return
+        if throttled:
+            bucket.throttled()
+        else:
+            bucket.succeeded()
+
+
+def _configured_limits(provider):
+    limits = dict(DEFAULT_RATE_LIMITS.get(provider, FALLBACK_RATE_LIMITS))
+    for family in API_FAMILIES:
+        for name in ('SF_BACKUP_RESTORE_RATE_LIMIT_{}'.format(family.upper()),
+                     'SF_BACKUP_RESTORE_RATE_LIMIT_{}_{}'.format(provider.upper(), family.upper())):
+            if name in os.environ:
+                limits[family] = parse_rate_limit(os.environ[name])
+    return limits
+
+
+def get_rate_limiter(provider):
+    """The rate limiter of the provider, created on first use."""
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            _rate_limiters[provider] = RateLimiter(provider)
+        return _rate_limiters[provider]
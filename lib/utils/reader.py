@@ -0,0 +1,123 @@
+import errno
+import mmap
+import os
+from .throttle import DISK_READ
+
+MIB = 1024 * 1024
+DIRECT_ALIGNMENT = 4096
+# Bytes read from a file at once by the archiver, a multiple of DIRECT_ALIGNMENT
+READ_BUFFER_SIZE = -(-int(os.getenv('SF_BACKUP_RESTORE_READ_BUFFER_SIZE', MIB)) // DIRECT_ALIGNMENT) * DIRECT_ALIGNMENT
+# Bytes the kernel is asked to read ahead of the reader (posix_fadvise WILLNEED), 0 leaves it to the kernel's readahead
+READ_AHEAD = int(os.getenv('SF_BACKUP_RESTORE_READ_AHEAD', 8 * MIB))
+ALWAYS = 'always'
+ONLINE = 'online'
+NEVER = 'never'
+# Drop the pages read by a backup from the page cache (posix_fadvise DONTNEED), so that they do not push the working
+# set of the service out of it: always, for online backups only (the service is running) or never
+READ_DROP_CACHE = os.getenv('SF_BACKUP_RESTORE_READ_DROP_CACHE', ONLINE)
+# Read with O_DIRECT into aligned buffers, bypassing the page cache; filesystems without it are read as usual
+READ_DIRECT = os.getenv('SF_BACKUP_RESTORE_READ_DIRECT', '').lower() in ('1', 'true', 'yes')
+
+
+def drop_cache(backup_type, setting=READ_DROP_CACHE):
+    """Whether a backup of the given type (online or offline) drops the pages it read from the page cache."""
+    return setting == ALWAYS or (setting == ONLINE and backup_type == 'online')
+
+
+class SequentialReader(object):
+    """A file read once from the front to the back, e.g. by the archiver; a file object with read and close.
+
+    The kernel is told that the file is read sequentially and asked to keep read_ahead bytes ahead of the reader.
+    With drop_cache the pages are dropped from the page cache once they were read. With direct the file is read with
+    O_DIRECT into a page aligned buffer (read sizes are rounded up to DIRECT_ALIGNMENT); the read-ahead is then the
+    buffer only, and all reads but the last must be multiples of DIRECT_ALIGNMENT. With a throttle the bytes read are
+    taken from its disk read limit.
+    """
+
+    def __init__(self, path, buffer_size=READ_BUFFER_SIZE, read_ahead=READ_AHEAD, drop_cache=False,
+                 direct=READ_DIRECT, throttle=None):
+        self.path = path
+        self.throttle = throttle
+        self.read_ahead = read_ahead
+        self.drop_cache = drop_cache
+        self.direct = False
+        self.offset = 0
+        self.__advised = 0
+        self.__buffer = None
+        self.__fd = None
+        if direct and hasattr(os, 'O_DIRECT'):
+            try:
+                self.__fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC | os.O_DIRECT)
+                self.direct = True
+                size = -(-buffer_size // DIRECT_ALIGNMENT) * DIRECT_ALIGNMENT
+                # anonymous maps are page aligned
+                self.__buffer = mmap.mmap(-1, size)
+            except OSError as error:
+                # tmpfs and some network filesystems do not support O_DIRECT
+                if error.errno != errno.EINVAL:
+                    raise
+        if self.__fd is None:
+            self.__open()
+
+    def __open(self):
+        self.__fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+        self.__advise(0, 0, 'POSIX_FADV_SEQUENTIAL')
+
+    def __advise(self, offset, length, advice):
+        # posix_fadvise is a hint, it is missing on some platforms and may be refused by the filesystem
+        if hasattr(os, advice):
+            try:
+                os.posix_fadvise(self.__fd, offset, length, getattr(os, advice))
+            except OSError:
+                pass
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.__buffer) if self.direct else READ_BUFFER_SIZE
+        if self.direct:
+            if size > len(self.__buffer):
+                raise ValueError('reads with O_DIRECT are limited to {} bytes'.format(len(self.__buffer)))
+            try:
+                with memoryview(self.__buffer) as view, view[:-(-size // DIRECT_ALIGNMENT) * DIRECT_ALIGNMENT] as part:
+                    length = os.readv(self.__fd, [part])
+            except OSError as error:
+                # some filesystems accept O_DIRECT when the file is opened, but not when it is read
+                if error.errno != errno.EINVAL or self.offset:
+                    raise
+                self.close()
+                self.direct = False
+                self.__open()
+                return self.read(size)
+            self.offset += length
+            self.__throttle(length)
+            return self.__buffer[:min(length, size)]
+        if self.read_ahead and self.__advised - self.offset < self.read_ahead // 2:
+            start = max(self.__advised, self.offset)
+            self.__advised = self.offset + self.read_ahead
+            self.__advise(start, self.__advised - start, 'POSIX_FADV_WILLNEED')
+        data = os.read(self.__fd, size)
+        if self.drop_cache and data:
+            self.__advise(self.offset, len(data), 'POSIX_FADV_DONTNEED')
+        self.offset += len(data)
+        self.__throttle(len(data))
+        return data
+
+    def __throttle(self, length):
+        if self.throttle is not None:
+            self.throttle.acquire(DISK_READ, length)
+
+    def close(self):
+        if self.__fd is not None:
+            if self.drop_cache and not self.direct:
+                self.__advise(0, 0, 'POSIX_FADV_DONTNEED')
+            os.close(self.__fd)
+            self.__fd = None
+        if self.__buffer is not None:
+            self.__buffer.close()
+            self.__buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
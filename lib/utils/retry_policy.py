@@ -0,0 +1,270 @@
+import errno
+import os
+import random
+import socket
+import time
+from .cancellation import OperationCancelled
+
+THROTTLING = 'throttling'
+TRANSIENT = 'transient'
+NOT_FOUND = 'not_found'
+AUTH = 'auth'
+PERMANENT = 'permanent'
+
+# Retries the SDKs (botocore, the Alibaba Cloud SDK) make of a call on their own, below the RetryPolicy which retries
+# the whole operation: one quick retry covers a dropped connection, more would multiply with the attempts of the policy
+SDK_MAX_RETRIES = int(os.getenv('SF_BACKUP_RESTORE_SDK_MAX_RETRIES', 1))
+# Seconds one retried operation (all of its attempts and waits) may take at most
+RETRY_BUDGET = float(os.getenv('SF_BACKUP_RESTORE_RETRY_BUDGET', 600))
+# Operations in a row which have to fail with a transient or throttling error to open the circuit
+BREAKER_THRESHOLD = int(os.getenv('SF_BACKUP_RESTORE_RETRY_BREAKER_THRESHOLD', 3))
+# Seconds the circuit stays open before retries are allowed again
+BREAKER_RESET_TIMEOUT = float(os.getenv('SF_BACKUP_RESTORE_RETRY_BREAKER_RESET_TIMEOUT', 300))
+
+THROTTLING_CODES = frozenset([
+    'throttling', 'throttlingexception', 'throttled', 'requestlimitexceeded', 'requestthrottled',
+    'requestthrottledexception', 'toomanyrequests', 'toomanyrequestsexception', 'slowdown',
+    'provisionedthroughputexceededexception', 'bandwidthlimitexceeded', 'ratelimitexceeded',
+    'userratelimitexceeded', 'throttling.user', 'throttling.api', 'serviceunavailable', 'operationconflict'
+])
+AUTH_CODES = frozenset([
+    'authfailure', 'unauthorizedoperation', 'accessdenied', 'accessdeniedexception', 'invalidclienttokenid',
+    'signaturedoesnotmatch', 'expiredtoken', 'expiredtokenexception', 'invalidaccesskeyid', 'forbidden',
+    'authenticationfailed', 'invalidauthenticationtokentenant', 'expiredauthenticationtoken', 'incompletesignature',
+    'invalidaccesskeyid.notfound', 'forbidden.ram'
+])
+TRANSIENT_ERRNOS = frozenset([
+    errno.ECONNRESET, errno.ECONNREFUSED, errno.ECONNABORTED, errno.ETIMEDOUT, errno.EHOSTUNREACH,
+    errno.ENETUNREACH, errno.ENETDOWN, errno.EPIPE, errno.EAGAIN
+])
+# Names of SDK exception classes (of any provider, without importing the SDKs) signalling network problems
+TRANSIENT_EXCEPTION_NAMES = frozenset([
+    'ConnectionError', 'ConnectTimeout', 'ReadTimeout', 'Timeout', 'EndpointConnectionError', 'ConnectionClosedError',
+    'ReadTimeoutError', 'ConnectTimeoutError', 'ProtocolError', 'IncompleteRead', 'RemoteDisconnected',
+    'ServerNotFoundError', 'TransportError', 'RequestError', 'ServiceRequestError', 'ConnectFailure',
+    'ServiceUnavailable', 'InternalServerError', 'BadGateway', 'GatewayTimeout', 'TooManyRequests'
+])
+# Programming and configuration errors never succeed when retried
+PERMANENT_EXCEPTION_TYPES = (ImportError, AssertionError, NotImplementedError, TypeError, AttributeError,
+                             OperationCancelled)
+
+THROTTLING_MESSAGES = ('throttl', 'rate exceeded', 'too many requests', 'request limit exceeded', 'slow down',
+                       'ratelimitexceeded')
+NOT_FOUND_MESSAGES = ('not found', 'notfound', 'does not exist', 'no such', 'resourcenotfound')
+AUTH_MESSAGES = ('unauthorized', 'forbidden', 'access denied', 'authfailure', 'authentication failed',
+                 'invalid credentials', 'token expired', 'expired token')
+
+
+class Backoff(object):
+    """Exponential backoff with full jitter: the n-th retry waits a random time in [0, min(cap, base * 2 ** (n-1))]."""
+
+    def __init__(self, max_attempts, base, cap):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt, random_function=random.random):
+        if self.base <= 0:
+            return 0
+        return random_function() * min(self.cap, self.base * 2 ** (attempt - 1))
+
+
+DEFAULT_BACKOFFS = {
+    # throttled requests are answered immediately, short waits spread the retries of concurrent callers
+    THROTTLING: Backoff(max_attempts=8, base=0.5, cap=10),
+    TRANSIENT: Backoff(max_attempts=5, base=2, cap=30),
+    # newly created resources may not be visible immediately (eventual consistency)
+    NOT_FOUND: Backoff(max_attempts=3, base=2, cap=10),
+    # a second attempt covers credentials which were rotated or refreshed meanwhile
+    AUTH: Backoff(max_attempts=2, base=1, cap=1),
+    PERMANENT: Backoff(max_attempts=1, base=0, cap=0)
+}
+
+
+def _status_code(error):
+    """Extract the HTTP status code from the exceptions of the supported SDKs."""
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        # botocore ClientError
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        if status:
+            return status
+    for owner, attr in ((error, 'status_code'), (error, 'http_status'), (error, 'status'), (error, 'code'),
+                        (getattr(error, 'resp', None), 'status'), (response, 'status_code'), (response, 'status')):
+        value = getattr(owner, attr, None) if owner is not None else None
+        if value is None or isinstance(value, bool) or callable(value):
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            continue
+        if 100 <= value < 600:
+            return value
+    # Ali ServerException
+    get_http_status = getattr(error, 'get_http_status', None)
+    if callable(get_http_status):
+        return get_http_status()
+    return None
+
+
+def _error_code(error):
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+    get_error_code = getattr(error, 'get_error_code', None)
+    if callable(get_error_code):
+        return get_error_code()
+    code = getattr(error, 'error_code', None)
+    return code if isinstance(code, str) else None
+
+
+def _classify_single(error):
+    if isinstance(error, PERMANENT_EXCEPTION_TYPES):
+        return PERMANENT
+    code = _error_code(error)
+    if code:
+        code = code.lower()
+        if code in THROTTLING_CODES:
+            return THROTTLING
+        if code in AUTH_CODES:
+            return AUTH
+        if code.endswith('notfound') or code.endswith('.notfound') or code.startswith('notfound'):
+            return NOT_FOUND
+    status = _status_code(error)
+    if status is not None:
+        if status in (429, 503):
+            return THROTTLING
+        if status in (401, 403):
+            return AUTH
+        if status == 404:
+            return NOT_FOUND
+        if status in (408, 409) or status >= 500:
+            return TRANSIENT
+        if 400 <= status < 500:
+            return PERMANENT
+    if isinstance(error, (socket.timeout, TimeoutError, ConnectionError)):
+        return TRANSIENT
+    if isinstance(error, OSError) and error.errno in TRANSIENT_ERRNOS:
+        return TRANSIENT
+    if any(cls.__name__ in TRANSIENT_EXCEPTION_NAMES for cls in type(error).__mro__):
+        return TRANSIENT
+    message = str(error).lower()
+    if any(text in message for text in THROTTLING_MESSAGES):
+        return THROTTLING
+    if any(text in message for text in AUTH_MESSAGES):
+        return AUTH
+    if any(text in message for text in NOT_FOUND_MESSAGES):
+        return NOT_FOUND
+    return None
+
+
+def classify_error(error):
+    """Classify an error as throttling, transient, not_found, auth or permanent.
+
+    The clients often re-raise SDK errors as plain exceptions, so the chain of causes is inspected as well. Errors
+    which cannot be classified are treated as transient, as all errors were retried before.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        error_class = _classify_single(error)
+        if error_class:
+            return error_class
+        error = error.__cause__ or error.__context__
+    return TRANSIENT
+
+
+class RetryBudgetExceeded(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    """Counts operations which failed with a transient or throttling error after all their retries.
+
+    Once threshold operations failed in a row the circuit opens: for reset_timeout seconds operations get a single
+    attempt instead of their retries, so that an unavailable IaaS does not multiply the waits of every following call
+    (e.g. of the clean-up). Calls are never skipped, as created resources have to be cleaned up anyway.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT, clock=time.time):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def open(self):
+        if self.opened_at is not None and self.clock() - self.opened_at >= self.reset_timeout:
+            # half-open: the next operation may retry again, one more failure opens the circuit again
+            self.opened_at = None
+            self.failures = self.threshold - 1
+        return self.opened_at is not None
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self, error_class):
+        if error_class not in (THROTTLING, TRANSIENT):
+            return
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = self.clock()
+
+
+class RetryPolicy(object):
+    """Runs an operation with retries depending on the class of the errors it raises.
+
+    :param backoffs: dict error class -> ``Backoff``, defaults to DEFAULT_BACKOFFS
+    :param budget: seconds all attempts and waits of one operation may take; no retry is started which would end
+        after the budget
+    :param max_attempts: optional upper limit of attempts for all error classes
+    :param sleep: function used to wait between attempts (e.g. an interruptible wait)
+    :param on_retry: optional callback (error, error class, attempt, delay) called before waiting for a retry
+    """
+
+    def __init__(self, backoffs=None, budget=RETRY_BUDGET, max_attempts=None, breaker=None, sleep=time.sleep,
+                 clock=time.time, on_retry=None, classify=classify_error):
+        self.backoffs = dict(DEFAULT_BACKOFFS, **(backoffs or {}))
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.breaker = breaker
+        self.sleep = sleep
+        self.clock = clock
+        self.on_retry = on_retry
+        self.classify = classify
+
+    def run(self, attempt_function):
+        """Call attempt_function(attempt) until it returns, the error is not worth a retry or the budget is spent."""
+        deadline = self.clock() + self.budget
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = attempt_function(attempt)
+            except Exception as error:
+                error_class = self.classify(error)
+                backoff = self.backoffs[error_class]
+                max_attempts = backoff.max_attempts
+                if self.max_attempts is not None:
+                    max_attempts = min(max_attempts, self.max_attempts)
+                if self.breaker is not None and self.breaker.open:
+                    max_attempts = 1
+                if attempt >= max_attempts:
+                    if self.breaker is not None:
+                        self.breaker.record_failure(error_class)
+                    raise
+                delay = backoff.delay(attempt)
+                if self.clock() + delay > deadline:
+                    if self.breaker is not None:
+                        self.breaker.record_failure(error_class)
+                    raise RetryBudgetExceeded('Retry budget of {}s exceeded after {} attempt(s): {}'.format(
+                        self.budget, attempt, error)) from error
+                if self.on_retry:
+                    self.on_retry(error, error_class, attempt, delay)
+                self.sleep(delay)
+            else:
+                if self.breaker is not None:
+                    self.breaker.record_success()
+                return result
@@ -0,0 +1,92 @@
+import heapq
+import json
+import os
+import stat
+from ..models.ArchiveManifest import ArchiveManifest
+
+# Number of the archives created (and restored) concurrently by the sharded backups, each one is a tar | gzip | gpg
+# pipeline and a blob
+ARCHIVE_SHARDS = int(os.getenv('SF_BACKUP_RESTORE_ARCHIVE_SHARDS', min(8, os.cpu_count() or 1)))
+MANIFEST_SUFFIX = '.manifest.json'
+DIRECTORIES_SUFFIX = '.directories'
+LIST_SUFFIX = '.list'
+# Bytes of a tar header and the padding of the data, so that many small files weigh more than their size
+MEMBER_OVERHEAD = 1024
+
+
+def shard_suffix(index):
+    return '.shard-{:04d}'.format(index)
+
+
+def _walk(path):
+    """The entries of a tree below path, relative to it like in a tarball ('./a/b').
+
+    :returns: (directories top-down, (weight, inode key, name) of the other entries)
+    """
+    directories = ['.']
+    entries = []
+    index = 0
+    while index < len(directories):
+        for entry in os.scandir(os.path.join(path, directories[index])):
+            name = '{}/{}'.format(directories[index], entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(name)
+                continue
+            entry_stat = entry.stat(follow_symlinks=False)
+            # hard links must be archived together, else each shard stores the data and the restore a copy
+            key = (entry_stat.st_dev, entry_stat.st_ino) if entry_stat.st_nlink > 1 else None
+            size = entry_stat.st_size if stat.S_ISREG(entry_stat.st_mode) else 0
+            entries.append((size + MEMBER_OVERHEAD, key, name))
+        index += 1
+    return directories, entries
+
+
+def partition_tree(path, shards=ARCHIVE_SHARDS):
+    """Split the files of a tree into at most shards size balanced lists.
+
+    Hard links to the same file are kept in one list; the largest files are distributed first, each to the list with
+    the smallest total. The directories are returned separately: they are archived on their own and restored last,
+    so that their mode and mtime are not changed by the files extracted into them.
+
+    :returns: (directories, [(weight, names), ...]) with the names relative to path in the order of a walk
+    """
+    directories, entries = _walk(path)
+    groups = {}
+    for position, (weight, key, name) in enumerate(entries):
+        group = groups.setdefault(key if key is not None else position, [0, []])
+        # tar stores the data of hard linked files once
+        group[0] += MEMBER_OVERHEAD if group[1] else weight
+        group[1].append((position, name))
+    heap = [(0, index, []) for index in range(max(1, min(shards, len(groups))))]
+    for weight, members in sorted(groups.values(), key=lambda group: group[0], reverse=True):
+        total, index, names = heapq.heappop(heap)
+        names.extend(members)
+        heapq.heappush(heap, (total + weight, index, names))
+    return directories, [(total, [name for _, name in sorted(names)]) for total, _, names in sorted(
+        heap, key=lambda shard: shard[1]) if names]
+
+
+def create_manifest(directories, partition):
+    """The manifest of the archives of the directories and of the shards returned by partition_tree."""
+    return ArchiveManifest(
+        {'name': DIRECTORIES_SUFFIX, 'entries': len(directories)},
+        [{'name': shard_suffix(index), 'files': len(names), 'size': weight - len(names) * MEMBER_OVERHEAD}
+         for index, (weight, names) in enumerate(partition)])
+
+
+def write_list(path, names):
+    """Write a list of names for 'tar --null -T <path>'; NUL separated, any character is allowed in file names."""
+    with open(path, 'wb') as list_file:
+        for name in names:
+            list_file.write(os.fsencode(name) + b'\0')
+
+
+def write_manifest(path, manifest):
+    with open(path, 'w') as manifest_file:
+        json.dump(manifest.as_dict(), manifest_file, indent=2)
+
+
+def read_manifest(path):
+    with open(path) as manifest_file:
+        content = json.load(manifest_file)
+    return ArchiveManifest(content['directories'], content['shards'], content.get('version'))
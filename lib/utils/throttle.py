@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+import time
+from .rate_limiter import TokenBucket
+
+UPLOAD = 'upload'
+DISK_READ = 'diskRead'
+KINDS = (UPLOAD, DISK_READ)
+UNITS = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+# Bytes per second uploaded to the blobstore by all threads of an operation and read from the disk by the archiver, as
+# 'rate[/burst]' with an optional K, M or G suffix (the burst defaults to one second of the rate), e.g. 20M or 20M/40M.
+# The --upload_rate_limit and --disk_read_rate_limit options of an operation take precedence.
+UPLOAD_RATE_LIMIT = os.getenv('SF_BACKUP_RESTORE_UPLOAD_RATE_LIMIT')
+DISK_READ_RATE_LIMIT = os.getenv('SF_BACKUP_RESTORE_DISK_READ_RATE_LIMIT')
+# JSON file changing the limits of a running operation, e.g. {"upload": "5M", "diskRead": "off"}; by default
+# <operation>.throttle.json in the last operation directory. It is read once it changed (checked every
+# CONTROL_FILE_INTERVAL seconds by the transfers) and on SIGUSR1.
+THROTTLE_CONTROL_FILE = os.getenv('SF_BACKUP_RESTORE_THROTTLE_CONTROL_FILE')
+CONTROL_FILE_INTERVAL = float(os.getenv('SF_BACKUP_RESTORE_THROTTLE_CONTROL_FILE_INTERVAL', 5))
+
+
+def _bytes(value):
+    value = value.strip()
+    unit = UNITS.get(value[-1:].lower())
+    return float(value[:-1]) * unit if unit else float(value)
+
+
+def parse_byte_rate(value):
+    """Parse 'rate[/burst]' in bytes per second with an optional K, M or G suffix ('20M', '20M/40M', 1048576).
+
+    'off' or an empty value disable the limit.
+    """
+    if value is None or str(value).strip().lower() in ('', 'off', '0', 'none'):
+        return None
+    rate, _, burst = str(value).partition('/')
+    rate = _bytes(rate)
+    return rate, _bytes(burst) if burst else rate
+
+
+def format_limits(limits):
+    """'upload=20.0 MiB/s (burst 40.0 MiB), diskRead=off' of a dict of limits like Throttle.limits()."""
+    return ', '.join('{}={}'.format(kind, '{:.1f} MiB/s (burst {:.1f} MiB)'.format(
+        limits[kind][0] / UNITS['m'], limits[kind][1] / UNITS['m']) if limits.get(kind) else 'off') for kind in KINDS)
+
+
+def increments(callback):
+    """Turn callback(bytes) into a progress callback (bytes transferred so far, total) passing it the increments."""
+    lock = threading.Lock()
+    transferred = [0]
+
+    def progress(current, total=None):
+        with lock:
+            increment = current - transferred[0]
+            transferred[0] = current
+        callback(increment)
+    return progress
+
+
+class Throttle(object):
+    """Byte rate limits (token buckets) of the uploads and of the disk reads of an operation, shared by its threads.
+
+    Callers take the bytes they transferred and wait while the limit is exceeded, in pieces of at most the burst so that
+    changed limits apply within about a second. The limits can be changed while transfers run: with configure, or
+    through the control file, which is read once it changed after watch was called and whenever reload was called
+    (e.g. by a signal handler).
+
+    :param limits: (rate, burst) or None (no limit) per kind (UPLOAD, DISK_READ)
+    :param on_change: optional function (limits, error) called after the control file was read
+    :param on_wait: optional function (kind, seconds) called after a caller waited
+    """
+
+    def __init__(self, limits=None, on_change=None, on_wait=None, clock=time.time, sleep=time.sleep):
+        self.buckets = {}
+        self.control_file = None
+        self.on_change = on_change
+        self.on_wait = on_wait
+        self.clock = clock
+        self.sleep = sleep
+        self.__lock = threading.Lock()
+        self.__control_lock = threading.Lock()
+        self.__control_mtime = None
+        self.__next_check = 0
+        self.__reload = False
+        self.configure(limits or {})
+
+    def configure(self, limits):
+        """Set the limits of the given kinds, (rate, burst) or None; the other kinds keep theirs."""
+        with self.__lock:
+            for kind, limit in limits.items():
+                if not limit:
+                    self.buckets.pop(kind, None)
+                elif kind in self.buckets:
+                    self.buckets[kind].configure(*limit)
+                else:
+                    self.buckets[kind] = TokenBucket(limit[0], limit[1], self.clock, self.sleep)
+
+    def limits(self):
+        with self.__lock:
+            return dict((kind, (self.buckets[kind].configured_rate, self.buckets[kind].burst)
+                         if kind in self.buckets else None) for kind in KINDS)
+
+    def limited(self, kind):
+        return kind in self.buckets
+
+    def watch(self, control_file):
+        """Read the limits from control_file once it changed (its current content is ignored) or reload was called."""
+        with self.__control_lock:
+            self.control_file = control_file
+            self.__control_mtime = self.__mtime()
+            self.__next_check = self.clock() + CONTROL_FILE_INTERVAL
+
+    def reload(self):
+        # only sets a flag, safe in a signal handler interrupting a transfer holding the locks
+        self.__reload = True
+
+    def acquire(self, kind, size):
+        """Take size bytes of the limit of kind, waiting while it is exceeded. Returns the seconds waited."""
+        waited = 0
+        while size > 0:
+            self.__check_control_file()
+            bucket = self.buckets.get(kind)
+            if bucket is None:
+                break
+            part = min(size, bucket.burst)
+            waited += bucket.acquire(part)
+            size -= part
+        if waited and self.on_wait:
+            self.on_wait(kind, waited)
+        return waited
+
+    def __mtime(self):
+        try:
+            return os.stat(self.control_file).st_mtime
+        except (OSError, TypeError):
+            return None
+
+    def __check_control_file(self):
+        if self.control_file is None or not (self.__reload or self.clock() >= self.__next_check):
+            return
+        with self.__control_lock:
+            if not (self.__reload or self.clock() >= self.__next_check):
+                return
+            reload, self.__reload = self.__reload, False
+            self.__next_check = self.clock() + CONTROL_FILE_INTERVAL
+            mtime = self.__mtime()
+            if mtime is None or (mtime == self.__control_mtime and not reload):
+                return
+            self.__control_mtime = mtime
+            try:
+                with open(self.control_file) as control_file:
+                    settings = json.load(control_file)
+                limits = dict((kind, parse_byte_rate(settings[kind])) for kind in KINDS if kind in settings)
+            except (OSError, ValueError, TypeError, AttributeError) as error:
+                if self.on_change:
+                    self.on_change(None, error)
+                return
+            self.configure(limits)
+        if self.on_change:
+            self.on_change(self.limits(), None)
+
+
+class ThrottledFile(object):
+    """File object whose reads take the bytes read from a throttle (e.g. the upload limit), optionally of length bytes.
+
+    Seeks are passed to the file, so that SDKs can rewind it for a retry.
+    """
+
+    def __init__(self, fileobj, throttle, kind=UPLOAD, length=None):
+        self.fileobj = fileobj
+        self.throttle = throttle
+        self.kind = kind
+        self.end = fileobj.tell() + length if length is not None else None
+
+    def read(self, size=-1):
+        if self.end is not None:
+            remaining = max(0, self.end - self.fileobj.tell())
+            size = remaining if size is None or size < 0 else min(size, remaining)
+        data = self.fileobj.read(size)
+        self.throttle.acquire(self.kind, len(data))
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.fileobj.seek(offset, whence)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def close(self):
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,281 @@
+import binascii
+import collections
+import inspect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from .rate_limiter import api_family
+from .retry_policy import classify_error, THROTTLING
+
+TRACE_BUFFER_SIZE = int(os.getenv('SF_BACKUP_RESTORE_TRACE_BUFFER', 10000))
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, float('inf'))
+
+# OTLP span kinds and status codes
+SPAN_KINDS = {'internal': 1, 'client': 3}
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def _random_id(length):
+    return binascii.hexlify(os.urandom(length)).decode()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in sorted(attributes.items())
+            if value is not None]
+
+
+def _percentile(durations, percent):
+    # nearest-rank percentile of sorted durations
+    index = max(0, int(round(percent / 100.0 * len(durations) + 0.5)) - 1)
+    return durations[min(index, len(durations) - 1)]
+
+
+class Span(object):
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'attempt', 'attributes', 'start', 'end',
+                 'error')
+
+    def __init__(self, trace_id, parent_id, name, kind, attempt, attributes, start):
+        self.trace_id = trace_id
+        self.span_id = _random_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attempt = attempt
+        self.attributes = attributes
+        self.start = start
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        return self.end - self.start if self.end is not None else None
+
+    @property
+    def outcome(self):
+        return 'error' if self.error else 'ok'
+
+    def as_otlp(self, provider):
+        attributes = dict(self.attributes, provider=provider, attempt=self.attempt, outcome=self.outcome)
+        return OrderedDict([
+            ('traceId', self.trace_id),
+            ('spanId', self.span_id),
+            ('parentSpanId', self.parent_id or ''),
+            ('name', self.name),
+            ('kind', SPAN_KINDS[self.kind]),
+            ('startTimeUnixNano', str(int(self.start * 1e9))),
+            ('endTimeUnixNano', str(int(self.end * 1e9))),
+            ('attributes', _otlp_attributes(attributes)),
+            ('status', {'code': STATUS_ERROR, 'message': self.error} if self.error else {'code': STATUS_OK})
+        ])
+
+
+class Tracer(object):
+    """Records spans of the stages and of the IaaS and blobstore calls of an operation.
+
+    Finished spans are kept in a ring buffer (the oldest ones are dropped once it is full) and can be exported as
+    OTLP/JSON or summarized as latency histograms per span name. Spans started with span() nest per thread; spans
+    started with start_span() (e.g. from SDK hooks) get the span running in the calling thread as parent.
+    """
+
+    def __init__(self, provider, capacity=TRACE_BUFFER_SIZE, clock=time.time, on_finish=None):
+        self.provider = provider
+        self.trace_id = _random_id(16)
+        self.clock = clock
+        self.on_finish = on_finish
+        self.spans = collections.deque(maxlen=capacity)
+        self.dropped = 0
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+
+    def __stack(self):
+        if not hasattr(self.__local, 'stack'):
+            self.__local.stack = []
+        return self.__local.stack
+
+    def start_span(self, name, kind='internal', attempt=1, **attributes):
+        stack = self.__stack()
+        parent_id = stack[-1].span_id if stack else None
+        return Span(self.trace_id, parent_id, name, kind, attempt, attributes, self.clock())
+
+    def finish_span(self, span, error=None):
+        span.end = self.clock()
+        if isinstance(error, BaseException):
+            span.error = str(error) or type(error).__name__
+        else:
+            span.error = str(error) if error else None
+        with self.__lock:
+            if len(self.spans) == self.spans.maxlen:
+                self.dropped += 1
+            self.spans.append(span)
+        if self.on_finish:
+            self.on_finish(span)
+        return span
+
+    def span(self, name, kind='internal', attempt=1, **attributes):
+        return _ActiveSpan(self, self.start_span(name, kind, attempt, **attributes))
+
+    def _push(self, span):
+        self.__stack().append(span)
+
+    def _pop(self):
+        self.__stack().pop()
+
+    def histogram(self):
+        """Summarize the latencies of the buffered spans per name.
+
+        :returns: dict name -> count, errors, sum, min, max, p50, p95, p99 and cumulative bucket counts (seconds)
+        """
+        with self.__lock:
+            spans = list(self.spans)
+        durations = OrderedDict()
+        errors = collections.Counter()
+        for span in sorted(spans, key=lambda span: span.start):
+            durations.setdefault(span.name, []).append(span.duration)
+            if span.error:
+                errors[span.name] += 1
+        summary = OrderedDict()
+        for name, values in durations.items():
+            values.sort()
+            buckets = OrderedDict()
+            for bound in LATENCY_BUCKETS:
+                buckets['+Inf' if bound == float('inf') else str(bound)] = sum(1 for value in values if value <= bound)
+            summary[name] = OrderedDict([
+                ('count', len(values)),
+                ('errors', errors[name]),
+                ('sum', round(sum(values), 3)),
+                ('min', round(values[0], 3)),
+                ('max', round(values[-1], 3)),
+                ('p50', round(_percentile(values, 50), 3)),
+                ('p95', round(_percentile(values, 95), 3)),
+                ('p99', round(_percentile(values, 99), 3)),
+                ('buckets', buckets)
+            ])
+        return summary
+
+    def format_histogram(self):
+        """Render the latency summary as table lines for the log."""
+        lines = ['{:<48} {:>6} {:>6} {:>9} {:>9} {:>9} {:>9}'.format(
+            'span', 'count', 'errors', 'p50', 'p95', 'max', 'total')]
+        for name, summary in self.histogram().items():
+            lines.append('{:<48} {:>6} {:>6} {:>8.3f}s {:>8.3f}s {:>8.3f}s {:>8.3f}s'.format(
+                name[:48], summary['count'], summary['errors'], summary['p50'], summary['p95'], summary['max'],
+                summary['sum']))
+        return lines
+
+    def export(self, path, resource_attributes=None):
+        """Write the buffered spans as OTLP/JSON (ExportTraceServiceRequest) into path.
+
+        The file is written next to its target and renamed, so readers never see a partial file.
+        """
+        with self.__lock:
+            spans = list(self.spans)
+        attributes = dict(resource_attributes or {}, **{'service.name': 'service-fabrik-backup-restore',
+                                                         'cloud.provider': self.provider})
+        document = {'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes(attributes), 'droppedAttributesCount': 0},
+            'scopeSpans': [{
+                'scope': {'name': __name__},
+                'spans': [span.as_otlp(self.provider) for span in spans]
+            }]
+        }]}
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary_path, 'w') as f:
+            json.dump(document, f)
+        os.replace(temporary_path, path)
+
+
+class _ActiveSpan(object):
+    def __init__(self, tracer, span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self):
+        self.tracer._push(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer._pop()
+        failed = exc_type is not None and not issubclass(exc_type, SystemExit)
+        self.tracer.finish_span(self.span, (exc_value or exc_type()) if failed else None)
+        return False
+
+
+class TracedProxy(object):
+    """Proxy of an SDK client which traces every method call as a client span.
+
+    Attributes which are neither methods nor plain values (e.g. the operation groups of the Azure and OpenStack
+    clients like compute_client.snapshots) are proxied as well, up to the given depth.
+
+    :param describe: optional function (attribute name, call arguments) -> span name
+    :param limiter: optional ``RateLimiter`` every call has to pass (waiting for a token), throttling errors reduce
+        its rate
+    :param family: API family of all calls (e.g. storage), by default derived from the span name
+    """
+
+    def __init__(self, target, tracer, prefix, depth=1, describe=None, limiter=None, family=None):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_tracer', tracer)
+        object.__setattr__(self, '_prefix', prefix)
+        object.__setattr__(self, '_depth', depth)
+        object.__setattr__(self, '_describe', describe)
+        object.__setattr__(self, '_limiter', limiter)
+        object.__setattr__(self, '_family', family)
+
+    @property
+    def __class__(self):
+        # keeps isinstance() checks against the SDK classes working
+        return self._target.__class__
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name.startswith('_') or isinstance(value, (str, bytes, int, float, bool, dict, list, tuple, type(None))):
+            return value
+        if inspect.isroutine(value):
+            return self.__trace(name, value)
+        if self._depth > 0:
+            return TracedProxy(value, self._tracer, '{}.{}'.format(self._prefix, name), self._depth - 1,
+                               self._describe, self._limiter, self._family)
+        return value
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def __trace(self, name, method):
+        tracer = self._tracer
+        prefix = self._prefix
+        describe = self._describe
+        limiter = self._limiter
+        family = self._family
+
+        def traced(*args, **kwargs):
+            span_name = '{}.{}'.format(prefix, describe(name, args) if describe else name)
+            call_family = family or api_family(span_name)
+            queued = limiter.acquire(call_family) if limiter else 0
+            span = tracer.start_span(span_name, 'client', queued=round(queued, 3) if queued else None)
+            try:
+                result = method(*args, **kwargs)
+            except BaseException as error:
+                tracer.finish_span(span, error)
+                if limiter and isinstance(error, Exception):
+                    limiter.record(call_family, classify_error(error) == THROTTLING)
+                raise
+            tracer.finish_span(span)
+            if limiter:
+                limiter.record(call_family)
+            return result
+        return traced
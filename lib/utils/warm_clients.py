@@ -0,0 +1,70 @@
+import hashlib
+import json
+import threading
+
+
+class Binding(object):
+    """Reference to the IaaS client currently using a warm SDK client.
+
+    Hooks registered on an SDK client when it is created (event handlers, request classes) must not keep the IaaS
+    client which created it, as a warm SDK client outlives it: they call through the binding instead, which points to
+    the IaaS client of the running operation.
+    """
+
+    def __init__(self, client=None):
+        self.client = client
+
+    def method(self, name):
+        def call(*args, **kwargs):
+            return getattr(self.client, name)(*args, **kwargs)
+        return call
+
+
+class WarmClients(object):
+    """Authenticated SDK clients (and their connection pools) kept for the following operations of the process.
+
+    Disabled by default, as every CLI run creates its clients once anyway; the backup agent daemon enables it, so that
+    only its first job pays for the authentication, the loading of the service models and the TLS handshakes.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self.__clients = {}
+        self.__lock = threading.Lock()
+
+    def get(self, key, factory, owner):
+        """The SDK client of key, created by factory(binding) unless a warm one exists, bound to owner."""
+        if not self.enabled:
+            return factory(Binding(owner))
+        with self.__lock:
+            entry = self.__clients.get(key)
+            if entry is None:
+                self.misses += 1
+                binding = Binding(owner)
+                entry = self.__clients[key] = (binding, factory(binding))
+            else:
+                self.hits += 1
+                entry[0].client = owner
+            return entry[1]
+
+    def discard(self, key):
+        with self.__lock:
+            self.__clients.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__clients.clear()
+
+    def __len__(self):
+        return len(self.__clients)
+
+
+def cache_key(provider, kind, credentials):
+    """Key of an SDK client; the credentials are hashed, so that they never show up in keys (e.g. in logs)."""
+    digest = hashlib.sha256(json.dumps(credentials, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return provider, kind, digest
+
+
+warm_clients = WarmClients()
@@ -5,6 +5,7 @@ from aliyunsdkcore.acs_exception.exceptions import ServerException
 from lib.clients.BaseClient import BaseClient
 from lib.models.Snapshot import Snapshot
 from lib.models.Volume import Volume
+from lib.utils.retry_policy import SDK_MAX_RETRIES
 import unittest.mock
 from unittest.mock import patch
 from unittest.mock import Mock
@@ -150,6 +151,8 @@ class CR:
         self.version = version
     def set_action_name(self, action):
         self.action = action
+    def get_action_name(self):
+        return self.action
     def add_query_param(self, key, value):
         self.params[key] = value
 
@@ -285,7 +288,7 @@ class Bucket:
         self.name = name
     def read(self):
         return
-    def put_object_from_file(self, blob_target, blob_upload_path, headers):
+    def put_object_from_file(self, blob_target, blob_upload_path, headers, progress_callback=None):
         assert blob_upload_path in (valid_blob_path, invalid_blob_path)
         assert blob_target == 'blob'
         if (blob_upload_path == invalid_blob_path):
@@ -298,7 +301,7 @@ class Bucket:
         return self
     # added this method because of issue in travice
     # in travis python interpretor was replacing get_object() with get_object_to_file
-    def get_object_to_file(self, blob_target, blob_target_path):
+    def get_object_to_file(self, blob_target, blob_target_path, progress_callback=None):
         assert blob_target_path in (valid_blob_path, invalid_blob_path)
         assert blob_target == 'blob'
         if (blob_target_path == invalid_blob_path):
@@ -317,8 +320,11 @@ class RequestHeader:
         return
 
 def mock_shell(command, log_command=True):
-    if command == ('cat /proc/mounts | grep ' + directory_persistent):
-        return persistent_disk_mount_device_id + '1 ' + directory_persistent + ' ext4 rw,relatime,data=ordered 0 0'
+    return None
+
+def mock_get_mounted_device(directory, mounts_file=None):
+    if directory == directory_persistent:
+        return persistent_disk_mount_device_id + '1'
 
 def get_device_of_volume(volume_id):
     if volume_id == persistent_disk_id:
@@ -337,19 +343,21 @@ class TestAliClient:
         # self.patchers.append(create_start_patcher(patch_function='last_operation', patch_object=BaseClient)['patcher'])
         # self.patchers.append(create_start_patcher(patch_function='shell', patch_object=BaseClient, side_effect=mock_shell)['patcher'])
         self.patchers.append(create_start_patcher(
-            patch_function='lib.clients.AliClient.AcsClient', return_value=ComputeClient()))
+            patch_function='aliyunsdkcore.client.AcsClient', return_value=ComputeClient()))
         self.patchers.append(create_start_patcher(
-            patch_function='lib.clients.AliClient.oss2.Auth', return_value=StorageClient()))
+            patch_function='oss2.Auth', return_value=StorageClient()))
         self.patchers.append(create_start_patcher(
-            patch_function='lib.clients.AliClient.oss2.Bucket', return_value=Bucket(valid_container)))
+            patch_function='oss2.Bucket', return_value=Bucket(valid_container)))
         self.patchers.append(create_start_patcher(
-            patch_function='lib.clients.AliClient.CommonRequest', return_value=CR()))
+            patch_function='aliyunsdkcore.request.CommonRequest', return_value=CR()))
         self.patchers.append(create_start_patcher(
             patch_function='shell', patch_object=BaseClient, side_effect=mock_shell))
         self.patchers.append(create_start_patcher(
             patch_function='_get_device_of_volume', patch_object=BaseClient, side_effect=get_device_of_volume))
         self.patchers.append(create_start_patcher(
-            patch_function='lib.clients.AliClient.RequestHeader', return_value=RequestHeader()))
+            patch_function='oss2.headers.RequestHeader', return_value=RequestHeader()))
+        self.patchers.append(create_start_patcher(
+            patch_function='lib.utils.devices.get_mounted_device', side_effect=mock_get_mounted_device))
         os.environ['SF_BACKUP_RESTORE_LOG_DIRECTORY'] = log_dir
         os.environ['SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY'] = log_dir
         self.aliClient = AliClient(operation_name, configuration, directory_persistent, directory_work_list,
@@ -369,7 +377,7 @@ class TestAliClient:
     #     self.aliClient.compute_client.create_duplicate_disk_call_count = 0
     #     self.patchers[3]['patcher_start'].stop()
     #     self.patchers[3] = create_start_patcher(
-    #         patch_function='lib.clients.AliClient.CommonRequest', return_value=CR())
+    #         patch_function='aliyunsdkcore.request.CommonRequest', return_value=CR())
 
 
 
@@ -381,7 +389,7 @@ class TestAliClient:
         assert self.aliClient.availability_zone == availability_zone
         self.patchers[0]['patcher_start'].call_count == 1
         self.patchers[0]['patcher_start'].assert_called_with(access_key, secret_access_key, secret, auto_retry=True,
-            max_retry_time=10, timeout=30)
+            max_retry_time=SDK_MAX_RETRIES, timeout=30)
         self.patchers[1]['patcher_start'].call_count == 1
         self.patchers[1]['patcher_start'].assert_called_with(access_key, secret_access_key)
         self.patchers[2]['patcher_start'].call_count == 1
@@ -417,6 +425,13 @@ class TestAliClient:
         assert snapshot.status == 'accomplished'
         assert snapshot.start_time == snapshot_creation_time
         assert snapshot.size == 20
+
+    def test_ali_traces_compute_calls(self):
+        spans_before = len(self.aliClient.tracer.spans)
+        self.aliClient._create_snapshot(valid_disk_name, 'test-backup')
+        names = [span.name for span in list(self.aliClient.tracer.spans)[spans_before:]]
+        assert 'ecs.CreateSnapshot' in names
+        assert all(span.kind == 'client' for span in self.aliClient.tracer.spans if span.name.startswith('ecs.'))
     
     def test_ali_create_snapshot_fails_with_status_failed(self):
         try:
@@ -8,9 +8,17 @@ from botocore.config import Config
 import botocore
 from lib.clients.AwsClient import AwsClient
 from lib.clients.BaseClient import BaseClient
+from lib.utils import container_access
+from lib.utils import shards
+from lib.utils.cancellation import OperationCancelled
+from lib.utils.container_access import ContainerAccessCache
+from lib.utils.metrics import Metrics
+from lib.utils.retry_policy import SDK_MAX_RETRIES
+from concurrent.futures import ThreadPoolExecutor
 from lib.models.Snapshot import Snapshot
 from lib.models.Volume import Volume
 from pprint import pprint
+from types import SimpleNamespace
 import json
 
 #Test data
@@ -102,16 +110,42 @@ class Ec2Dummy:
         def load(self):
             pass
 
+    def create_volume(self, **kwargs):
+        self.create_volume_kwargs = kwargs
+        volume = Ec2Dummy.Volume(valid_volume)
+        volume.state = 'available'
+        volume.reload = lambda: None
+        return volume
+
+    def create_tags(self, Resources, Tags):
+        pass
+
 class EC2ClientDummy:
     def __init__(self):
-        pass
+        self.describe_volumes_calls = 0
+
+    def get_paginator(self, operation_name):
+        assert operation_name == 'describe_volumes'
+        return self
+
+    def paginate(self, Filters):
+        self.describe_volumes_calls += 1
+        instance_id = Filters[0]['Values'][0]
+        volumes = json.load(open('tests/data/aws/volumes.describe.json'))
+        return [{
+            'Volumes': [volume for volume in volumes
+                        if instance_id in [details['InstanceId'] for details in volume['Attachments']]]
+        }]
 
 class S3Dummy:
     class Bucket:
+        puts = 0
+
         def __init__(self, name):
             self.name = name
 
         def put_object(self,Key):
+            S3Dummy.Bucket.puts += 1
             if self.name == valid_container:
                 return
             else:
@@ -125,9 +159,14 @@ class S3Dummy:
 
 
 class S3ClientDummy:
+    heads = 0
+
     def __init__(self):
         pass
 
+    def head_bucket(self, Bucket):
+        S3ClientDummy.heads += 1
+
 class AwsSessionDummy:
     def __init__(self):
         pass
@@ -144,7 +183,7 @@ class AwsSessionDummy:
         elif type == 's3':
             return S3ClientDummy()
 
-def get_dummy_aws_session():
+def get_dummy_aws_session(binding=None):
     return AwsSessionDummy()
 
 # EC2 instance objects have 'collection' of volumes. Collcetion is boto specific data structure
@@ -183,6 +222,9 @@ class TestAwsClient:
         assert isinstance(self.testAwsClient.ec2.client, EC2ClientDummy)
         assert isinstance(self.testAwsClient.s3.client, S3ClientDummy)
         assert self.testAwsClient.availability_zone == availability_zone
+        # the operations are retried by the RetryPolicy, botocore only retries a call once
+        assert self.testAwsClient.max_retries == SDK_MAX_RETRIES == 1
+        assert self.testAwsClient.s3_config.retries == {'max_attempts': SDK_MAX_RETRIES}
 
     def test_create_aws_client_blob_ops(self):
         assert isinstance(self.testAwsClientBlobOps.s3, S3Dummy)
@@ -190,7 +232,161 @@ class TestAwsClient:
         assert not hasattr(self.testAwsClientBlobOps, 'ec2')
         assert not hasattr(self.testAwsClientBlobOps, 'availability_zone')
 
+    def test_get_attached_volumes_for_instance(self):
+        calls = self.testAwsClient.ec2.client.describe_volumes_calls
+        volume_list = self.testAwsClient.get_attached_volumes_for_instance('vm-id')
+        assert self.testAwsClient.ec2.client.describe_volumes_calls == calls + 1
+        assert len(volume_list) == 2
+        assert volume_list[0].id == 'valid-volume-1'
+        assert volume_list[0].size == 60
+        assert volume_list[0].device == '/dev/sda'
+        assert volume_list[1].id == 'valid-volume-2'
+        assert volume_list[1].size == 40
+        assert volume_list[1].device == '/dev/sdf'
+
+    def test_get_attached_volumes_for_instance_returns_empty(self):
+        assert self.testAwsClient.get_attached_volumes_for_instance('other-vm-id') == []
+
+    def test_copy_snapshot_skipped_for_volume_encryption(self):
+        self.testAwsClient.encryption_strategy = 'volume'
+        try:
+            snapshot = self.testAwsClient._copy_snapshot(valid_snapshot)
+        finally:
+            self.testAwsClient.encryption_strategy = 'copy'
+        assert snapshot.id == valid_snapshot
+        assert snapshot.size == valid_snapshot_size
+        assert self.testAwsClient.output_json['snapshotId'] == valid_snapshot
+        assert self.testAwsClient.output_json['snapshotEncryption'] == 'volume'
+
+    def test_create_volume_encrypted_for_volume_encryption(self):
+        self.testAwsClient.encryption_strategy = 'volume'
+        self.testAwsClient.kms_key_id = 'kms-key-id'
+        try:
+            volume = self.testAwsClient._create_volume(valid_volume_size, valid_snapshot)
+        finally:
+            self.testAwsClient.encryption_strategy = 'copy'
+            self.testAwsClient.kms_key_id = None
+        assert volume.id == valid_volume
+        kwargs = self.testAwsClient.ec2.create_volume_kwargs
+        assert kwargs['SnapshotId'] == valid_snapshot
+        assert kwargs['Encrypted'] == True
+        assert kwargs['KmsKeyId'] == 'kms-key-id'
+
+    def test_create_volume_encrypted_for_unencrypted_snapshots(self):
+        # the snapshot of a backup with the 'volume' strategy, restored by a client with the 'copy' strategy
+        self.testAwsClient._create_volume(valid_volume_size, valid_snapshot)
+        kwargs = self.testAwsClient.ec2.create_volume_kwargs
+        assert kwargs['Encrypted'] == True
+        assert 'KmsKeyId' not in kwargs
+
+    def test_create_volume_unencrypted_for_copy_encryption(self, monkeypatch):
+        monkeypatch.setattr(self.testAwsClient.ec2, 'Snapshot', lambda snapshot_id: SimpleNamespace(encrypted=True))
+        self.testAwsClient._create_volume(valid_volume_size, valid_snapshot)
+        kwargs = self.testAwsClient.ec2.create_volume_kwargs
+        assert 'Encrypted' not in kwargs
+        assert 'KmsKeyId' not in kwargs
+        self.testAwsClient._create_volume(valid_volume_size)
+        assert 'Encrypted' not in self.testAwsClient.ec2.create_volume_kwargs
+
     def test_get_container_exception(self):
         with pytest.raises(Exception):
             container = self.testAwsClient.s3.Bucket(invalid_container)
             assert container is None
+
+    def test_container_access_strategies(self, monkeypatch):
+        monkeypatch.setattr('lib.clients.BaseClient.container_access_cache', ContainerAccessCache(None))
+        # (strategy, put requests, head requests)
+        for strategy, puts, heads in [('probe', 1, 0), ('head', 0, 1), ('cached', 1, 0), ('cached', 0, 0),
+                                      ('lazy', 0, 0)]:
+            monkeypatch.setattr(container_access, 'CONTAINER_ACCESS_CHECK', strategy)
+            before = S3Dummy.Bucket.puts, S3ClientDummy.heads
+            assert self.testAwsClientBlobOps.get_container() is not None
+            assert (S3Dummy.Bucket.puts - before[0], S3ClientDummy.heads - before[1]) == (puts, heads)
+
+        monkeypatch.setattr(container_access, 'CONTAINER_ACCESS_CHECK', 'unknown')
+        assert self.testAwsClientBlobOps.get_container() is None
+
+    def test_lazy_container_access_check(self, monkeypatch):
+        class UploadDenied(Exception):
+            status_code = 400
+
+        def upload(blob_to_upload_path, blob_target_name):
+            raise UploadDenied('Access Denied')
+
+        monkeypatch.setattr(container_access, 'CONTAINER_ACCESS_CHECK', 'lazy')
+        client = AwsClient(operation_name_blob_ops, configuration_blob_ops, directory_persistent, directory_work_list,
+                           poll_delay_time, poll_maximum_time)
+        monkeypatch.setattr(client, '_upload_to_blobstore', upload)
+        with pytest.raises(Exception) as error:
+            client.upload_to_blobstore('/tmp/blob', 'blob', throw_exception=True)
+        assert str(error.value).startswith(container_access.ACCESS_ERROR)
+        client.last_operation.assert_called_with(container_access.ACCESS_ERROR, 'failed')
+
+        # once an upload succeeded, failures are reported as they are
+        monkeypatch.setattr(client, '_upload_to_blobstore', lambda *args: True)
+        assert client.upload_to_blobstore('/tmp/blob', 'blob') == True
+        monkeypatch.setattr(client, '_upload_to_blobstore', upload)
+        assert client.upload_to_blobstore('/tmp/blob', 'blob') is None
+        with pytest.raises(UploadDenied):
+            client.upload_to_blobstore('/tmp/blob', 'blob', throw_exception=True)
+
+    def test_shards_are_uploaded_before_the_manifest(self, tmpdir, monkeypatch):
+        manifest = shards.create_manifest(['.'], [(1024, ['./a']), (1024, ['./b'])])
+        manifest_path = tmpdir.join('files.tar.gz' + shards.MANIFEST_SUFFIX)
+        shards.write_manifest(str(manifest_path), manifest)
+        for suffix in ('.directories', '.shard-0000', '.shard-0001'):
+            tmpdir.join('files.tar.gz' + suffix).write_binary(b'x' * 100)
+        uploaded = []
+        monkeypatch.setattr(self.testAwsClientBlobOps, '_upload_to_blobstore',
+                            lambda path, name: uploaded.append(name) or True)
+        monkeypatch.setattr(self.testAwsClientBlobOps, 'metrics', Metrics())
+        assert self.testAwsClientBlobOps.upload_shards_to_blobstore(str(tmpdir.join('files.tar.gz')), 'guid/files')
+        assert sorted(uploaded[:3]) == ['guid/files.directories', 'guid/files.shard-0000', 'guid/files.shard-0001']
+        assert uploaded[3:] == ['guid/files.manifest.json']
+        # the threads upload within the stage of the shards, not as stages of their own
+        stages = self.testAwsClientBlobOps.metrics.as_dict()['stages']
+        assert list(stages) == ['upload_shards']
+        assert (stages['upload_shards']['count'], stages['upload_shards']['bytesOut']) == (1, 300 + manifest_path.size())
+
+        # without all shards, the manifest is not uploaded
+        del uploaded[:]
+        monkeypatch.setattr(self.testAwsClientBlobOps, '_upload_to_blobstore',
+                            lambda path, name: uploaded.append(name) or not name.endswith('0001'))
+        assert self.testAwsClientBlobOps.upload_shards_to_blobstore(str(tmpdir.join('files.tar.gz')), 'guid/files') \
+            is None
+        assert 'guid/files.manifest.json' not in uploaded
+
+    def test_abortion_in_shard_threads_is_left_to_the_main_thread(self, tmpdir, monkeypatch):
+        shards.write_manifest(str(tmpdir.join('files.tar.gz' + shards.MANIFEST_SUFFIX)),
+                              shards.create_manifest(['.'], [(1024, ['./a'])]))
+        monkeypatch.setattr(self.testAwsClientBlobOps, '_upload_to_blobstore', lambda path, name: True)
+        token = self.testAwsClientBlobOps._BaseClient__cancellation
+        token.cancel()
+        try:
+            # the wrapped methods raise in other threads instead of cleaning up, the request stays pending
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                with pytest.raises(OperationCancelled):
+                    executor.submit(self.testAwsClientBlobOps.upload_to_blobstore, '/tmp/blob', 'blob').result()
+                with pytest.raises(OperationCancelled):
+                    executor.submit(self.testAwsClientBlobOps._BaseClient__upload_shard, '/tmp/blob', 'blob').result()
+            assert token.cancelled
+        finally:
+            token.reset()
+
+    def test_shards_are_restored_before_the_directories(self, monkeypatch):
+        def download(blob_to_download_name, blob_download_target_path, throw_exception=None):
+            shards.write_manifest(blob_download_target_path, shards.create_manifest(
+                ['.'], [(1024, ['./a']), (1024, ['./b'])]))
+            return True
+
+        restored = []
+        monkeypatch.setattr(self.testAwsClientBlobOps, 'download_from_blobstore', download)
+        monkeypatch.setattr(self.testAwsClientBlobOps, '_download_from_blobstore_decrypt_extract',
+                            lambda name, target: restored.append(name) or True)
+        assert self.testAwsClientBlobOps.download_from_blobstore_decrypt_extract_shards('guid/files', '/data')
+        assert sorted(restored[:2]) == ['guid/files.shard-0000', 'guid/files.shard-0001']
+        assert restored[2:] == ['guid/files.directories']
+
+        monkeypatch.setattr(self.testAwsClientBlobOps, '_download_from_blobstore_decrypt_extract', lambda *args: None)
+        with pytest.raises(Exception):
+            self.testAwsClientBlobOps.download_from_blobstore_decrypt_extract_shards('guid/files', '/data')
@@ -0,0 +1,101 @@
+import tests.utils.setup_constants
+import itertools
+import pytest
+from types import SimpleNamespace
+from lib.clients.AzureClient import AzureClient
+from lib.clients.BaseClient import BaseClient
+
+configuration = {
+    'credhub_url': None,
+    'type': 'online',
+    'backup_guid': 'backup-guid',
+    'instance_id': 'vm-id',
+    'secret': 'xyz',
+    'job_name': 'service-job-name',
+    'container': 'backup-container',
+    'client_id': 'client-id',
+    'client_secret': 'client-secret',
+    'tenant_id': 'tenant-id',
+    'resource_group': 'resource-group',
+    'storageAccount': 'storage-account',
+    'storageAccessKey': 'storage-key',
+    'subscription_id': 'subscription-id'
+}
+valid_disk = 'disk-id'
+disk_uri = '/subscriptions/subscription-id/resourceGroups/resource-group/providers/Microsoft.Compute/disks/disk-id'
+
+
+class OperationDummy:
+    def __init__(self, result=None):
+        self.__result = result
+
+    def done(self):
+        return True
+
+    def result(self):
+        return self.__result
+
+
+class NotFound(Exception):
+    status_code = 404
+
+
+class DisksDummy:
+    def get(self, resource_group, disk_name):
+        return SimpleNamespace(name=disk_name, location='westeurope', id=disk_uri)
+
+
+class SnapshotsDummy:
+    def __init__(self):
+        self.snapshots = {}
+        self.bodies = []
+        self.created = itertools.count()
+
+    def create_or_update(self, resource_group, snapshot_name, body):
+        self.bodies.append(body)
+        self.snapshots[snapshot_name] = SimpleNamespace(
+            name=snapshot_name, disk_size_gb=10, time_created=next(self.created), provisioning_state='Succeeded',
+            creation_data=SimpleNamespace(source_uri=body['creation_data']['source_uri'], source_resource_id=None))
+        return OperationDummy(self.snapshots[snapshot_name])
+
+    def get(self, resource_group, snapshot_name):
+        if snapshot_name not in self.snapshots:
+            raise NotFound('snapshot {} not found'.format(snapshot_name))
+        return self.snapshots[snapshot_name]
+
+    def delete(self, resource_group, snapshot_name):
+        self.snapshots.pop(snapshot_name, None)
+        return OperationDummy()
+
+
+class ComputeDummy:
+    def __init__(self):
+        self.disks = DisksDummy()
+        self.snapshots = SnapshotsDummy()
+
+
+@pytest.fixture
+def create_client(monkeypatch, tmpdir):
+    monkeypatch.setenv('SF_BACKUP_RESTORE_LOG_DIRECTORY', str(tmpdir))
+    monkeypatch.setenv('SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY', str(tmpdir))
+    monkeypatch.setattr(BaseClient, 'last_operation', lambda *args: None)
+    monkeypatch.setattr(AzureClient, 'create_block_blob_service', lambda self: object())
+    monkeypatch.setattr(AzureClient, 'get_container', lambda self: True)
+    monkeypatch.setattr(AzureClient, 'access_container', lambda self: True)
+    monkeypatch.setattr(AzureClient, 'create_compute_client', lambda self: ComputeDummy())
+    monkeypatch.setattr(AzureClient, 'get_instance_location', lambda self, instance_id: 'westeurope')
+    monkeypatch.setattr(AzureClient, 'get_host_number_of_data_volumes', lambda self: '5')
+    monkeypatch.setattr(AzureClient, '_get_availability_zone_of_server', lambda self, instance_id: None)
+
+    def create_client(**options):
+        return AzureClient('backup', dict(configuration, **options), '/var/vcap/store', '/tmp', 0, 60)
+    return create_client
+
+
+def test_snapshots_are_cleaned_up(create_client):
+    client = create_client()
+    snapshot = client.create_snapshot(valid_disk)
+    assert 'incremental' not in client.compute_client.snapshots.bodies[0]
+    assert client.compute_client.snapshots.bodies[0]['sku'] == {'name': 'Standard_ZRS'}
+    assert client.output_json['snapshotId'] == snapshot.id and client.output_json['snapshotSizeGb'] == 10
+    assert client._BaseClient__snapshots_ids == [snapshot.id]
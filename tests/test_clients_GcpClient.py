@@ -1,4 +1,6 @@
 import os
+import threading
+import time
 import unittest.mock
 from tests.utils.utilities import create_start_patcher, stop_all_patchers
 import pytest
@@ -15,6 +17,7 @@ from google.cloud.exceptions import GoogleCloudError
 from google.cloud.storage import Blob
 from lib.models.Snapshot import Snapshot
 from lib.models.Volume import Volume
+from lib.utils.cancellation import OperationCancelled
 from unittest.mock import Mock
 
 operation_name = 'backup'
@@ -308,6 +311,24 @@ class ComputeClient:
                     headers={}
                 )
 
+        def list(self, project, zone, filter):
+            assert filter == 'name eq ({}|{})'.format(ephemeral_disk_name, valid_disk_name)
+            http = HttpMock('tests/data/gcp/disks.list.json',
+                            {'status': '200'})
+            model = JsonModel()
+            uri = 'some_uri'
+            method = 'GET'
+            return HttpRequest(
+                http,
+                model.response,
+                uri,
+                method=method,
+                headers={}
+            )
+
+        def list_next(self, previous_request, previous_response):
+            return None
+
         def delete(self, project, zone, disk):
             if disk == delete_disk_name or disk == valid_disk_name:
                 http = HttpMock(
@@ -465,10 +486,9 @@ class StorageClient:
             raise NotFound()
 
 
-def upload_from_filename(filename):
-    if filename == valid_blob_path:
-        pass
-    else:
+def upload_from_file(file_obj, size=None, content_type=None):
+    # the content type guessed by upload_from_filename is kept
+    if file_obj.read() != b'blob' or size != 4 or content_type != 'text/plain':
         raise GoogleCloudError('Error')
 
 
@@ -480,12 +500,19 @@ def download_to_filename(filename):
 
 
 def shell(command):
-    if command == ('readlink -e ' + ephemeral_disk_device_path):
+    return None
+
+
+def resolve_device(path):
+    if path == ephemeral_disk_device_path:
         return ephemeral_disk_device_id
-    elif command == ('readlink -e ' + persistent_disk_device_path):
+    elif path == persistent_disk_device_path:
         return persistent_disk_device_id
-    elif command == ('cat /proc/mounts | grep ' + directory_persistent):
-        return persistent_disk_device_id + '1 ' + directory_persistent + ' ext4 rw,relatime,data=ordered 0 0'
+
+
+def get_mounted_device(directory, mounts_file=None):
+    if directory == directory_persistent:
+        return persistent_disk_device_id + '1'
 
 
 def mockglob(path):
@@ -526,12 +553,18 @@ class TestGcpClient:
                                                   patch_object=BaseClient, side_effect=generate_name_by_prefix)['patcher'])
         self.patchers.append(create_start_patcher(
             patch_function='shell', patch_object=BaseClient, side_effect=shell)['patcher'])
+        self.patchers.append(create_start_patcher(
+            patch_function='lib.utils.devices.resolve_device', side_effect=resolve_device)['patcher'])
+        self.patchers.append(create_start_patcher(
+            patch_function='lib.utils.devices.get_mounted_device', side_effect=get_mounted_device)['patcher'])
         self.patchers.append(create_start_patcher(
             patch_function='last_operation', patch_object=BaseClient)['patcher'])
         self.patchers.append(create_start_patcher(
             patch_function='google.oauth2.service_account.Credentials.from_service_account_info')['patcher'])
         self.patchers.append(create_start_patcher(
-            patch_function='googleapiclient.discovery.build', return_value=ComputeClient())['patcher'])
+            patch_function='googleapiclient.discovery.build_from_document', return_value=ComputeClient())['patcher'])
+        self.patchers.append(create_start_patcher(
+            patch_function='lib.clients.GcpClient.discovery_document', return_value={})['patcher'])
         self.patchers.append(create_start_patcher(
             patch_function='google.cloud.storage.Client', return_value=StorageClient())['patcher'])
         self.patchers.append(create_start_patcher(
@@ -539,7 +572,7 @@ class TestGcpClient:
         self.patchers.append(create_start_patcher(
             patch_function='google.cloud.storage.Blob.delete')['patcher'])
         self.patchers.append(create_start_patcher(
-            patch_function='upload_from_filename', patch_object=Blob, side_effect=upload_from_filename)['patcher'])
+            patch_function='upload_from_file', patch_object=Blob, side_effect=upload_from_file)['patcher'])
         self.patchers.append(create_start_patcher(
             patch_function='download_to_filename', patch_object=Blob, side_effect=download_to_filename)['patcher'])
 
@@ -560,6 +593,14 @@ class TestGcpClient:
         assert self.gcpClient.container == bucket
         assert self.gcpClient.availability_zone == availability_zone
 
+    def test_blob_operation_does_not_create_the_compute_client(self):
+        blob_configuration = {key: configuration[key] for key in ('credhub_url', 'type', 'container', 'projectId',
+                                                                  'credentials')}
+        gcpClient = GcpClient('blob_operation', blob_configuration, directory_persistent, directory_work_list,
+                              poll_delay_time, poll_maximum_time)
+        assert gcpClient._GcpClient__compute_client is None
+        assert gcpClient.storage_client is not None
+
     def test_get_container_exception(self):
         self.gcpClient.CONTAINER = invalid_container
         pytest.raises(Exception, self.gcpClient.get_container)
@@ -619,6 +660,22 @@ class TestGcpClient:
         assert volume_list[1].size == '40'
         assert volume_list[1].device == persistent_disk_device_id
 
+    def test_disks_missing_from_the_list_are_fetched(self, monkeypatch):
+        compute_client = Mock()
+        compute_client.disks().list().execute.return_value = {'items': [{'name': valid_disk_name}]}
+        compute_client.disks().list_next.return_value = None
+        compute_client.disks().get().execute.return_value = {'name': some_disk_name}
+        monkeypatch.setattr(self.gcpClient, 'compute_client', compute_client)
+        disks = self.gcpClient._list_disks([valid_disk_name, some_disk_name])
+        assert disks == {valid_disk_name: {'name': valid_disk_name}, some_disk_name: {'name': some_disk_name}}
+        compute_client.disks().get.assert_called_with(
+            project=project_id, zone=self.gcpClient.availability_zone, disk=some_disk_name)
+
+        # a disk which cannot be fetched either is an error, as with one get per disk
+        compute_client.disks().get().execute.side_effect = NotFound('disk not found')
+        with pytest.raises(NotFound):
+            self.gcpClient._list_disks([valid_disk_name, some_disk_name])
+
     def test_get_attached_volumes_for_instance_returns_empty(self):
         assert self.gcpClient.get_attached_volumes_for_instance(
             invalid_vm_id) == []
@@ -646,6 +703,11 @@ class TestGcpClient:
         assert snapshot.id == valid_snapshot_name
         assert snapshot.status == 'READY'
         assert snapshot.size == '40'
+        progress = self.gcpClient.output_json['progress']['snapshot']
+        assert progress['percent'] == 100
+        # storageBytes of the snapshot is its stored (compressed) size, only the percentage of the operation is known
+        assert progress['bytes'] is None
+        assert progress['eta'] == 0
         self.gcpClient.output_json['snapshotId'] = valid_snapshot_name
 
     def test_create_snapshot_exception(self):
@@ -677,6 +739,18 @@ class TestGcpClient:
         assert self.gcpClient._find_volume_device(
             valid_disk_name) == persistent_disk_device_id
 
+    def test_wait_stops_when_cancelled(self):
+        token = self.gcpClient._BaseClient__cancellation
+        timer = threading.Timer(0.1, token.cancel)
+        timer.start()
+        start = time.time()
+        try:
+            pytest.raises(OperationCancelled, self.gcpClient._wait, 'Waiting...', lambda: False, None)
+        finally:
+            timer.join()
+            token.reset()
+        assert time.time() - start < poll_delay_time
+
     def test_find_volume_device_returns_none(self):
         assert self.gcpClient._find_volume_device('invalid_disk_name') is None
 
@@ -736,6 +810,8 @@ class TestGcpClient:
                       invalid_disk_name, invalid_vm_id)
 
     def test_upload_to_blobstore(self):
+        with open(valid_blob_path, 'wb') as blob_file:
+            blob_file.write(b'blob')
         assert self.gcpClient._upload_to_blobstore(
             valid_blob_path, 'blob') == True
 
@@ -765,8 +841,8 @@ class TestGcpClient:
             Exception, self.gcpClient._download_from_blobstore, 'blob', invalid_blob_path)
         self.gcpClient.container = prev_container
 
-    @patch('lib.clients.BaseClient.requests.post')
-    @patch('lib.clients.BaseClient.requests.get')
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
     def test_gcp_client_creation_with_credhub(self,  mock_get, mock_post):
         credhub_config = {
             'type': 'online',
@@ -822,10 +898,16 @@ class TestGcpClientExceptions:
 
     @classmethod
     def setup_class(self):
+        # the probe of the container runs for every client, not only once (cached)
+        probe_patcher = patch('lib.utils.container_access.CONTAINER_ACCESS_CHECK', 'probe')
+        probe_patcher.start()
+        self.patchers.append(probe_patcher)
         self.patchers.append(create_start_patcher(
             patch_function='google.oauth2.service_account.Credentials.from_service_account_info')['patcher'])
         self.patchers.append(create_start_patcher(
-            patch_function='googleapiclient.discovery.build', return_value=ComputeClient())['patcher'])
+            patch_function='googleapiclient.discovery.build_from_document', return_value=ComputeClient())['patcher'])
+        self.patchers.append(create_start_patcher(
+            patch_function='lib.clients.GcpClient.discovery_document', return_value={})['patcher'])
         self.patchers.append(create_start_patcher(
             patch_function='google.cloud.storage.Client', return_value=StorageClient())['patcher'])
 
@@ -135,6 +135,11 @@ class SwiftClient:
     def get_auth(self):
         return [{}]
 
+    def put_object(self, container, obj, contents, content_length=None, headers=None):
+        if not hasattr(self, 'objects'):
+            self.objects = []
+        self.objects.append((obj, contents if isinstance(contents, str) else contents.read(), headers))
+
 
 class SwiftService:
     def upload():
@@ -246,3 +251,23 @@ class TestOpenstackClient:
     def test_delete_attachment_exception(self):
         pytest.raises(Exception, self.osClient._delete_attachment,
                       invalid_disk_name, valid_vm_id)
+
+    def test_throttled_upload_to_blobstore(self, tmpdir):
+        from lib.utils.throttle import UPLOAD
+        blob = tmpdir.join('blob')
+        blob.write_binary(b'0123456789')
+        self.osClient.throttle.configure({UPLOAD: (1e9, 1e9)})
+        try:
+            assert self.osClient._upload_to_blobstore(str(blob), 'small') == True
+            # larger than a segment: the segments, then the manifest
+            assert [response['action'] for response in self.osClient._OpenstackClient__upload_throttled(
+                str(blob), 'large', 4)] == ['upload_segment'] * 3 + ['upload_object']
+        finally:
+            self.osClient.throttle.configure({UPLOAD: None})
+        objects = self.osClient.swift.objects
+        assert [(name, contents) for name, contents, headers in objects[:1]] == [('small', b'0123456789')]
+        prefix = objects[1][0][:-len('00000000')]
+        assert prefix.startswith('large/') and prefix.endswith('/10/4/')
+        assert [contents for name, contents, headers in objects[1:4]] == [b'0123', b'4567', b'89']
+        assert objects[4][0] == 'large' and objects[4][2]['x-object-manifest'] == '{}/{}'.format(
+            self.osClient.CONTAINER, prefix)
@@ -0,0 +1,121 @@
+import tests.utils.setup_constants
+import json
+import os
+import pytest
+import stat
+from lib import daemon as daemon_module
+from lib.daemon import Daemon, request
+from lib.utils import warm_clients as warm_clients_module
+
+arguments = ['--iaas=boshlite', '--type=online', '--backup_guid=guid', '--instance_id=vm-1', '--secret=secret',
+             '--container=daemon-test', '--job_name=service']
+
+
+@pytest.fixture
+def agent(tmpdir, monkeypatch):
+    monkeypatch.setenv('SF_BACKUP_RESTORE_LOG_DIRECTORY', str(tmpdir))
+    monkeypatch.setenv('SF_BACKUP_RESTORE_LAST_OPERATION_DIRECTORY', str(tmpdir))
+    monkeypatch.setattr(warm_clients_module.warm_clients, 'enabled', False)
+    agent = Daemon(os.path.join(str(tmpdir), 'agent.sock'))
+    yield agent
+    agent.close()
+
+
+def read_last_operation(tmpdir, operation):
+    with open(os.path.join(str(tmpdir), operation + '.lastoperation.json')) as f:
+        return json.load(f)
+
+
+def test_jobs_write_the_last_operation_files(agent, tmpdir):
+    clients = []
+
+    def backup(iaas_client, configuration):
+        clients.append(iaas_client)
+        assert configuration['backup_guid'] == 'guid'
+        iaas_client.finalize()
+
+    agent.register('backup', backup, '/var/vcap/store', ['/tmp'])
+    job = agent.run(agent.submit('backup', arguments))
+    assert job.state == daemon_module.SUCCEEDED and job.error is None
+    assert read_last_operation(tmpdir, 'backup')['state'] == 'succeeded'
+    assert os.path.exists(os.path.join(str(tmpdir), 'backup.output.json'))
+    assert warm_clients_module.warm_clients.enabled
+
+    # a second job gets a new client, but runs in the same process
+    agent.run(agent.submit('backup', arguments))
+    assert len(clients) == 2 and clients[0] is not clients[1]
+
+
+def test_failing_jobs(agent, tmpdir):
+    def backup(iaas_client, configuration):
+        raise Exception('Induced exception')
+
+    agent.register('backup', backup, '/var/vcap/store', ['/tmp'])
+    job = agent.run(agent.submit('backup', arguments))
+    assert job.state == daemon_module.FAILED
+    assert job.error == 'Induced exception'
+    assert read_last_operation(tmpdir, 'backup')['state'] == 'failed'
+
+    job = agent.run(agent.submit('backup', ['--iaas=boshlite']))
+    assert job.state == daemon_module.FAILED
+    assert job.error == 'Exited with status 2'
+
+
+def test_submit_validates_the_request(agent):
+    agent.register('backup', lambda *args: None, '/var/vcap/store', ['/tmp'])
+    with pytest.raises(ValueError):
+        agent.submit('restore', arguments)
+    with pytest.raises(ValueError):
+        agent.submit('backup', '--iaas=boshlite')
+
+
+def test_api(agent):
+    agent.register('backup', lambda *args: None, '/var/vcap/store', ['/tmp'])
+    agent.start()
+    status, health = request(agent.address, 'GET', '/health')
+    assert status == 200 and health['status'] == 'ok'
+
+    status, job = request(agent.address, 'POST', '/jobs', {'operation': 'backup', 'arguments': arguments})
+    assert status == 202 and job['state'] == 'queued'
+    status, content = request(agent.address, 'GET', '/jobs/{}'.format(job['id']))
+    assert status == 200 and content['id'] == job['id']
+    assert request(agent.address, 'GET', '/health')[1]['queued'] == 1
+
+    status, content = request(agent.address, 'POST', '/jobs/{}/abort'.format(job['id']))
+    assert status == 202 and content['state'] == 'aborted'
+    assert request(agent.address, 'GET', '/jobs')[1][0]['state'] == 'aborted'
+
+    status, content = request(agent.address, 'POST', '/jobs', {'operation': 'unknown'})
+    assert status == 400
+    assert request(agent.address, 'GET', '/jobs/unknown')[0] == 404
+
+
+def test_api_requires_the_token(tmpdir, monkeypatch):
+    monkeypatch.setattr(warm_clients_module.warm_clients, 'enabled', False)
+    monkeypatch.setattr(daemon_module, 'DAEMON_TOKEN', None)
+    token_file = tmpdir.join('token')
+    token_file.write('secret-token\n')
+    monkeypatch.setattr(daemon_module, 'DAEMON_TOKEN_FILE', str(token_file))
+    agent = Daemon(os.path.join(str(tmpdir), 'agent.sock'))
+    try:
+        agent.start()
+        assert stat.S_IMODE(os.stat(agent.address).st_mode) & 0o077 == 0
+        assert request(agent.address, 'GET', '/health')[0] == 200
+        assert request(agent.address, 'GET', '/health', token='wrong')[0] == 401
+        monkeypatch.setattr(daemon_module, 'DAEMON_TOKEN_FILE', None)
+        assert request(agent.address, 'POST', '/jobs', {'operation': 'backup', 'arguments': arguments})[0] == 401
+    finally:
+        agent.close()
+
+
+def test_tcp_addresses_must_be_loopback_with_a_token(monkeypatch):
+    monkeypatch.setattr(warm_clients_module.warm_clients, 'enabled', False)
+    monkeypatch.setattr(daemon_module, 'DAEMON_TOKEN', None)
+    monkeypatch.setattr(daemon_module, 'DAEMON_TOKEN_FILE', None)
+    with pytest.raises(ValueError):
+        Daemon('0.0.0.0:0', token='secret-token').start()
+    with pytest.raises(ValueError):
+        Daemon('127.0.0.1:0').start()
+    agent = Daemon('127.0.0.1:0', token='secret-token')
+    agent.start()
+    agent.close()
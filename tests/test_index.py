@@ -2,12 +2,14 @@ from tests.utils.utilities import create_start_patcher, stop_all_patchers
 import tests.utils.setup_constants
 import os
 import pytest
+import subprocess
+import sys
 import unittest.mock as mock
 from lib.clients.AwsClient import AwsClient
 from lib.clients.AzureClient import AzureClient
 from lib.clients.GcpClient import GcpClient
 from lib.clients.OpenstackClient import OpenstackClient
-from lib.clients.index import create_iaas_client
+from lib.clients.index import _create_retry_policy, create_iaas_client
 
 # test data
 class DummyIaasInfo:
@@ -34,6 +36,7 @@ configuration_openstack = {
 }
 directory_persistent = '/var/vcap/store'
 directory_work_list = '/tmp'
+root_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 def dummy_iaas_client_constructor(operation_name, configuration, directory_persistent, directory_work_list, poll_delay_time=None,poll_maximum_time=None):
     if operation_name == 'invalid':
@@ -89,4 +92,31 @@ class TestIndex:
     def test_exception_in_constructor(self):
         with mock.patch('sys.exit') as mock_sys_exit:
             dummy_iaas_client = create_iaas_client('invalid', configuration_aws, directory_persistent, directory_work_list)
-            mock_sys_exit.call_count == 1
\ No newline at end of file
+            mock_sys_exit.call_count == 1
+
+@pytest.mark.parametrize('module, sdks', [
+    ('lib.clients.AwsClient', ['boto3', 'botocore']),
+    ('lib.clients.AzureClient', ['azure', 'msrestazure']),
+    ('lib.clients.GcpClient', ['googleapiclient', 'google.cloud', 'google.oauth2']),
+    ('lib.clients.AliClient', ['oss2', 'aliyunsdkcore']),
+    ('lib.clients.OpenstackClient', ['keystoneauth1', 'novaclient', 'cinderclient', 'swiftclient']),
+    ('lib.clients.index', ['requests', 'cryptography'])
+])
+def test_client_modules_do_not_import_the_sdks(module, sdks):
+    # the SDKs are imported by the code paths using them, e.g. blob operations never import the compute SDKs
+    script = 'import sys, {}; print(",".join(name for name in {!r} if name in sys.modules))'.format(module, sdks)
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=root_directory)
+    assert output.decode().strip() == ''
+
+@pytest.mark.parametrize('max_retries', [1, 8])
+def test_max_retries_are_the_attempts_on_transient_errors(max_retries):
+    policy = _create_retry_policy(max_retries)
+    policy.sleep = lambda seconds: None
+    attempts = []
+
+    def attempt_function(attempt):
+        attempts.append(attempt)
+        raise ConnectionError('connection reset')
+    with pytest.raises(ConnectionError):
+        policy.run(attempt_function)
+    assert len(attempts) == max_retries
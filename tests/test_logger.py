@@ -0,0 +1,116 @@
+import io
+import logging
+import logging.handlers
+import pytest
+from lib import logger as logger_module
+from lib.logger import LazyJson, LogListener, LogQueueHandler
+
+FORMAT = '{"level": "%(levelname)s", "msg": %(message)s}'
+
+
+class CountingStream(io.StringIO):
+    def __init__(self):
+        super(CountingStream, self).__init__()
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return super(CountingStream, self).write(text)
+
+
+@pytest.fixture
+def pipeline():
+    stream = CountingStream()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    listener = LogListener([handler], batch_size=100, repeat_interval=60)
+    logger = logging.getLogger('test-logger')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    queue_handler = LogQueueHandler(listener.queue)
+    logger.addHandler(queue_handler)
+    yield logger, listener, stream
+    logger.removeHandler(queue_handler)
+    listener.stop()
+
+
+def lines(stream):
+    return stream.getvalue().splitlines()
+
+
+def test_lazy_json():
+    message = LazyJson('say "hello"')
+    assert str(message) == '"say \\"hello\\""'
+    assert str(LazyJson({'a': 1})) == '{"a": 1}'
+    assert str(LazyJson(object)) == str(object)
+
+
+def test_records_are_written_by_the_listener_in_batches(pipeline):
+    logger, listener, stream = pipeline
+    for i in range(10):
+        logger.info(LazyJson('message {}'.format(i)))
+    # nothing is written before the listener runs
+    assert stream.getvalue() == ''
+    listener.start()
+    assert listener.flush()
+    assert lines(stream) == ['{{"level": "INFO", "msg": "message {}"}}'.format(i) for i in range(10)]
+    assert stream.writes == 1
+
+
+def test_repeated_messages_are_suppressed(pipeline):
+    logger, listener, stream = pipeline
+    listener.start()
+    for _ in range(5):
+        logger.info(LazyJson('Waiting for the snapshot to get ready...'))
+    logger.error(LazyJson('Waiting for the snapshot to get ready...'))
+    logger.info(LazyJson('Snapshot ready'))
+    logger.info(LazyJson('Snapshot ready'))
+    listener.flush()
+    assert lines(stream) == [
+        '{"level": "INFO", "msg": "Waiting for the snapshot to get ready..."}',
+        '{"level": "INFO", "msg": "[LOG] The previous message was repeated 4 times"}',
+        '{"level": "ERROR", "msg": "Waiting for the snapshot to get ready..."}',
+        '{"level": "INFO", "msg": "Snapshot ready"}',
+        # written by the flush
+        '{"level": "INFO", "msg": "[LOG] The previous message was repeated 1 times"}'
+    ]
+
+
+def test_repeated_messages_are_written_after_the_interval(pipeline):
+    logger, listener, stream = pipeline
+    listener.repeat_interval = 0
+    listener.start()
+    logger.info(LazyJson('Waiting...'))
+    logger.info(LazyJson('Waiting...'))
+    listener.flush()
+    assert len(lines(stream)) == 2
+
+
+def test_stop_writes_the_queued_records(pipeline):
+    logger, listener, stream = pipeline
+    listener.start()
+    logger.warning(LazyJson('last words'))
+    listener.stop()
+    assert lines(stream) == ['{"level": "WARNING", "msg": "last words"}']
+    assert not listener.flush()
+
+
+def test_rotation(tmpdir):
+    path = str(tmpdir.join('operation.log'))
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=200, backupCount=1)
+    handler.setFormatter(logging.Formatter(FORMAT))
+    listener = LogListener([handler])
+    for i in range(10):
+        listener.queue.put(logging.makeLogRecord({'msg': LazyJson('message {}'.format(i)), 'levelno': logging.INFO,
+                                                  'levelname': 'INFO'}))
+    listener.start()
+    listener.stop()
+    handler.close()
+    assert tmpdir.join('operation.log.1').size() < 200
+    assert 'message 9' in tmpdir.join('operation.log').read()
+
+
+def test_flush_logger_without_listener(monkeypatch):
+    monkeypatch.setattr(logger_module, '_listener', None)
+    logger_module.flush_logger()
+    logger_module.stop_logger()
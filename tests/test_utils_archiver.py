@@ -0,0 +1,62 @@
+import gzip
+import io
+import os
+import subprocess
+import tarfile
+from lib.utils import archiver, extractor
+
+
+def create_tree(root):
+    data = root.mkdir('data')
+    data.join('text.txt').write('\n'.join(str(i) for i in range(100000)))
+    data.join('random.bin').write_binary(os.urandom(300000))
+    data.join('small').write('small')
+    data.mkdir('empty')
+    os.link(str(data.join('text.txt')), str(root.join('hard')))
+    os.symlink('data/small', str(root.join('symlink')))
+    os.chmod(str(data.join('small')), 0o600)
+    os.utime(str(data), (1400000000, 1400000000))
+
+
+def test_write_archive(tmpdir):
+    source = tmpdir.mkdir('source')
+    create_tree(source)
+    output = io.BytesIO()
+    report = archiver.write_archive(str(source), output)
+
+    assert report and report.errors == []
+    assert (report.files_compressed, report.files_stored) == (2, 1)
+    assert report.bytes_stored == 300000 and report.bytes_compressed == source.join('data', 'text.txt').size() + 5
+    # the random file is stored: the archive is a bit larger than it, the text shrinks
+    assert 300000 < report.archive_size < 300000 + report.bytes_compressed / 2
+    assert report.archive_size == len(output.getvalue())
+    assert report.compression_time_saved > 0
+    # a gzip stream of several members, padded to records like GNU tar
+    assert len(gzip.decompress(output.getvalue())) % tarfile.RECORDSIZE == 0
+
+    with tarfile.open(fileobj=io.BytesIO(output.getvalue()), mode='r:gz') as tar:
+        members = {member.name: member for member in tar.getmembers()}
+    assert list(members) == ['.', './data', './data/empty', './data/random.bin', './data/small', './data/text.txt',
+                             './hard', './symlink']
+    assert members['./hard'].islnk() and members['./hard'].linkname == './data/text.txt'
+    assert members['./symlink'].linkname == 'data/small'
+    assert members['./data/small'].mode == 0o600 and members['./data'].mtime == 1400000000
+
+    tarball = tmpdir.join('archive.tar.gz')
+    tarball.write_binary(output.getvalue())
+    for target, extract in [('tar', lambda target: subprocess.check_call(['tar', '-xzf', str(tarball), '-C', target])),
+                            ('extractor', lambda target: extractor.extract_file(str(tarball), target))]:
+        extract(str(tmpdir.mkdir(target)))
+        assert tmpdir.join(target, 'data', 'random.bin').read_binary() == source.join('data', 'random.bin').read_binary()
+        assert tmpdir.join(target, 'hard').read() == source.join('data', 'text.txt').read()
+        assert os.stat(str(tmpdir.join(target, 'data'))).st_mtime == 1400000000
+
+
+def test_write_archive_of_names(tmpdir):
+    source = tmpdir.mkdir('source')
+    create_tree(source)
+    output = io.BytesIO()
+    report = archiver.write_archive(str(source), output, ['./data', './data/small', './missing'], level=1)
+    assert not report and len(report.errors) == 1 and 'missing' in report.errors[0]
+    with tarfile.open(fileobj=io.BytesIO(output.getvalue()), mode='r:gz') as tar:
+        assert tar.getnames() == ['./data', './data/small']
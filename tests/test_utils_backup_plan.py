@@ -0,0 +1,33 @@
+from lib.models.DirectorySurvey import DirectorySurvey
+from lib.utils.backup_plan import MIB, plan_backup
+
+GIB = 1024 * MIB
+
+
+def test_small_compressible_directory():
+    plan = plan_backup(DirectorySurvey('/data', files=100, directories=10, size=10 * MIB, allocated=10 * MIB,
+                                       compression_ratio=0.3), poll_maximum_time=600)
+    assert plan.codec == 'gzip' and not plan.sparse
+    assert 3 * MIB < plan.archive_size < 4 * MIB
+    assert plan.part_size == 8 * MIB and plan.concurrency == 1
+    # the configured maximum polling time is never lowered
+    assert plan.poll_maximum_time == 600
+    assert plan.as_dict()['survey']['files'] == 100
+
+
+def test_large_incompressible_directory():
+    plan = plan_backup(DirectorySurvey('/data', files=1000, directories=1, size=200 * GIB, allocated=200 * GIB,
+                                       sparse_files=1, compression_ratio=0.98))
+    assert plan.codec == 'gzip-fast' and plan.sparse
+    # S3 allows 10000 parts
+    assert plan.part_size == 21 * MIB and plan.archive_size / plan.part_size <= 10000
+    assert plan.concurrency == 10
+    assert plan.poll_maximum_time == 300 + 200 * 1024 // 32
+
+
+def test_many_small_files_without_sample():
+    plan = plan_backup(DirectorySurvey('/data', files=1000000, directories=1000, size=GIB, allocated=4 * GIB))
+    assert plan.codec == 'gzip-fast'
+    # the tar headers and padding are part of the archive
+    assert plan.archive_size > GIB + 1000000 * 512
+    assert plan.poll_maximum_time == 300 + 4 * 1024 // 32
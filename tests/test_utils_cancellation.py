@@ -0,0 +1,26 @@
+import threading
+import time
+import pytest
+from lib.utils.cancellation import CancellationToken, OperationCancelled
+
+
+def test_token_check():
+    token = CancellationToken()
+    token.check()
+    token.cancel()
+    assert token.cancelled
+    with pytest.raises(OperationCancelled):
+        token.check()
+    token.reset()
+    assert not token.cancelled
+
+
+def test_token_wait_is_interrupted_by_cancel():
+    token = CancellationToken()
+    assert token.wait(0.01) == False
+    timer = threading.Timer(0.1, token.cancel)
+    timer.start()
+    start = time.time()
+    assert token.wait(10) == True
+    assert time.time() - start < 5
+    timer.join()
@@ -0,0 +1,76 @@
+import os
+import stat
+from lib.utils.container_access import CONTAINER_ACCESS_CACHE_DIRECTORY, ContainerAccessCache, access_key
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_access_key():
+    key = access_key('aws', 'container', {'access_key_id': 'key', 'secret_access_key': 'secret'})
+    assert 'secret' not in key
+    assert key == access_key('aws', 'container', {'secret_access_key': 'secret', 'access_key_id': 'key'})
+    assert key != access_key('aws', 'other-container', {'access_key_id': 'key', 'secret_access_key': 'secret'})
+    assert key != access_key('ali', 'container', {'access_key_id': 'key', 'secret_access_key': 'secret'})
+
+
+def test_verified_containers_expire():
+    clock = FakeClock()
+    cache = ContainerAccessCache(None, ttl=60, clock=clock)
+    assert not cache.is_verified('key')
+    cache.verified('key')
+    clock.now += 59
+    assert cache.is_verified('key')
+    clock.now += 1
+    assert not cache.is_verified('key')
+
+
+def test_markers_are_shared_and_forgotten(tmpdir):
+    directory = str(tmpdir.join('containers'))
+    clock = FakeClock()
+    cache = ContainerAccessCache(directory, ttl=60, clock=clock)
+    cache.verified('key')
+    assert os.listdir(directory) == ['key']
+
+    # another process trusts the probe of the first one
+    other = ContainerAccessCache(directory, ttl=60, clock=clock)
+    assert other.is_verified('key')
+    other.forget('key')
+    assert os.listdir(directory) == []
+    assert not ContainerAccessCache(directory, ttl=60, clock=clock).is_verified('key')
+
+
+def test_markers_of_other_users_are_not_trusted(tmpdir):
+    directory = tmpdir.join('containers')
+    clock = FakeClock()
+    cache = ContainerAccessCache(str(directory), ttl=60, clock=clock)
+    cache.verified('key')
+    assert stat.S_IMODE(directory.stat().mode) == 0o700
+    assert stat.S_IMODE(directory.join('key').stat().mode) == 0o600
+    assert CONTAINER_ACCESS_CACHE_DIRECTORY.endswith('-{}'.format(os.geteuid()))
+
+    # a directory others can write to is neither read nor written
+    directory.chmod(0o777)
+    assert not ContainerAccessCache(str(directory), ttl=60, clock=clock).is_verified('key')
+    ContainerAccessCache(str(directory), ttl=60, clock=clock).verified('other')
+    assert not directory.join('other').exists()
+    directory.chmod(0o700)
+
+    # a marker replaced by a symbolic link is not followed
+    target = tmpdir.join('target')
+    target.write('content')
+    directory.join('key').remove()
+    directory.join('key').mksymlinkto(target)
+    assert not ContainerAccessCache(str(directory), ttl=60, clock=clock).is_verified('key')
+    ContainerAccessCache(str(directory), ttl=60, clock=clock).verified('key')
+    assert target.read() == 'content'
+    if os.geteuid() == 0:
+        directory.join('key').remove()
+        cache.verified('key')
+        os.chown(str(directory.join('key')), 12345, -1)
+        assert not ContainerAccessCache(str(directory), ttl=60, clock=clock).is_verified('key')
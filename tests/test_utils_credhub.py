@@ -0,0 +1,140 @@
+import os
+import pytest
+from unittest.mock import Mock
+from lib.utils import credhub as credhub_module
+from lib.utils.credhub import Credhub, CredentialsCache
+
+configuration = {
+    'credhub_url': 'https://credhub/',
+    'credhub_uaa_url': 'https://uaa',
+    'credhub_key': '/iaas/credentials',
+    'credhub_client_id': 'client',
+    'credhub_client_secret': 'client-secret',
+    'credhub_username': 'user',
+    'credhub_user_password': 'password'
+}
+credentials = {'access_key_id': 'key', 'secret_access_key': 'secret', 'region_name': 'eu-central-1'}
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSession(object):
+    def __init__(self, expires_in=600):
+        self.tokens = 0
+        self.gets = []
+        self.expires_in = expires_in
+        self.fail_token = False
+
+    def post(self, url, data, verify):
+        assert url == 'https://uaa/oauth/token' and data['grant_type'] == 'password'
+        if self.fail_token:
+            raise Exception('UAA unavailable')
+        self.tokens += 1
+        return Mock(json=Mock(return_value={'access_token': 'token-{}'.format(self.tokens),
+                                            'expires_in': self.expires_in}))
+
+    def get(self, url, headers, params, verify):
+        assert url == 'https://credhub/v1/data' and params['name'] == '/iaas/credentials'
+        self.gets.append(headers['authorization'])
+        return Mock(json=Mock(return_value={'data': [{'value': credentials}]}))
+
+
+def create_credhub(directory=None):
+    clock = FakeClock()
+    session = FakeSession()
+    return Credhub(CredentialsCache(directory, clock), session, clock), session, clock
+
+
+def test_credentials_are_cached():
+    client, session, clock = create_credhub()
+    session.expires_in = 3600
+    assert client.get_credentials(configuration) == credentials
+    assert client.get_credentials(configuration) == credentials
+    assert session.tokens == 1 and len(session.gets) == 1
+    clock.now += credhub_module.CREDENTIALS_TTL
+    assert client.get_credentials(configuration) == credentials
+    # the token is still valid
+    assert session.gets == ['bearer token-1', 'bearer token-1']
+
+
+def test_cached_credentials_need_the_secrets():
+    client, session, clock = create_credhub()
+    assert client.get_credentials(configuration) == credentials
+    # a caller with wrong secrets does not get the cached token or credentials, it has to ask UAA and CredHub
+    session.fail_token = True
+    for name in ('credhub_client_secret', 'credhub_user_password'):
+        with pytest.raises(Exception):
+            client.get_credentials(dict(configuration, **{name: 'wrong'}))
+    assert len(session.gets) == 1
+    assert client.get_credentials(configuration) == credentials
+
+
+def test_token_is_refreshed_ahead_of_its_expiry():
+    client, session, clock = create_credhub()
+    assert client.get_access_token(configuration) == 'token-1'
+    clock.now += 400
+    assert client.get_access_token(configuration) == 'token-1'
+    # within the last 20% of its lifetime a new token is requested, the old one is used while UAA fails
+    clock.now += 60
+    session.fail_token = True
+    assert client.get_access_token(configuration) == 'token-1'
+    session.fail_token = False
+    assert client.get_access_token(configuration) == 'token-2'
+    # an expired token is never used
+    clock.now += 1000
+    session.fail_token = True
+    with pytest.raises(Exception):
+        client.get_access_token(configuration)
+
+
+def test_tokens_without_expiry_are_not_cached():
+    client, session, clock = create_credhub()
+    session.expires_in = None
+    client.get_access_token(configuration)
+    client.get_access_token(configuration)
+    assert session.tokens == 2
+
+
+def test_invalidate():
+    client, session, clock = create_credhub()
+    client.get_credentials(configuration)
+    client.invalidate(configuration)
+    client.get_credentials(configuration)
+    assert session.tokens == 2 and len(session.gets) == 2
+
+
+@pytest.mark.skipif(credhub_module._fernet() is None, reason='cryptography is not installed')
+def test_cache_files_need_the_cryptography_package(tmpdir, monkeypatch, capsys):
+    monkeypatch.setattr(credhub_module, '_fernet', lambda: None)
+    cache = CredentialsCache(str(tmpdir))
+    assert cache.directory is None
+    assert 'cryptography package is not installed' in capsys.readouterr().err
+
+
+def test_cache_files_are_encrypted_and_shared(tmpdir):
+    directory = str(tmpdir)
+    client, session, clock = create_credhub(directory)
+    client.get_credentials(configuration)
+    files = os.listdir(directory)
+    assert len(files) == 2
+    for name in files:
+        assert oct(os.stat(os.path.join(directory, name)).st_mode & 0o777) == '0o600'
+        with open(os.path.join(directory, name), 'rb') as cache_file:
+            content = cache_file.read()
+        assert b'secret' not in content and b'token-1' not in content
+
+    # another process with the same secrets skips both requests
+    other, other_session, other_clock = create_credhub(directory)
+    assert other.get_credentials(configuration) == credentials
+    assert other_session.tokens == 0 and other_session.gets == []
+
+    # the files cannot be read with other secrets
+    rotated, rotated_session, rotated_clock = create_credhub(directory)
+    assert rotated.get_credentials(dict(configuration, credhub_user_password='rotated')) == credentials
+    assert rotated_session.tokens == 1
@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+import pytest
+from lib.utils import devices
+
+mounts = '''sysfs /sys sysfs rw,nosuid,nodev,noexec,relatime 0 0
+/dev/sda1 /var/vcap/data ext4 rw,relatime,data=ordered 0 0
+/dev/sdb1 /var/vcap/store/backup ext4 rw,relatime,data=ordered 0 0
+/dev/nvme1n1p1 /var/vcap/store ext4 rw,relatime,data=ordered 0 0
+/dev/sdc1 /mnt/with\\040space ext4 rw,relatime 0 0
+'''
+
+
+def write_file(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def create_sys_block(root):
+    # Mimic /sys/class/block where partitions are symlinks below their disk
+    devices_dir = os.path.join(root, 'devices')
+    sys_block = os.path.join(root, 'class_block')
+    os.makedirs(sys_block)
+    for disk, serial, partitions in [('nvme0n1', 'vol0aaaaaaaaaaaaaaaa  ', ['nvme0n1p1']),
+                                     ('nvme1n1', 'vol0bbbbbbbbbbbbbbbb  ', ['nvme1n1p1']),
+                                     ('xvda', None, ['xvda1'])]:
+        os.makedirs(os.path.join(devices_dir, disk, 'device'))
+        if serial:
+            write_file(os.path.join(devices_dir, disk, 'device', 'serial'), serial)
+        os.symlink(os.path.join(devices_dir, disk), os.path.join(sys_block, disk))
+        for partition in partitions:
+            os.makedirs(os.path.join(devices_dir, disk, partition))
+            write_file(os.path.join(devices_dir, disk, partition, 'partition'), '1')
+            os.symlink(os.path.join(devices_dir, disk, partition), os.path.join(sys_block, partition))
+    return sys_block
+
+
+def test_get_mounted_device_prefers_exact_mountpoint(tmpdir):
+    mounts_file = os.path.join(str(tmpdir), 'mounts')
+    write_file(mounts_file, mounts)
+    assert devices.get_mounted_device('/var/vcap/store', mounts_file) == '/dev/nvme1n1p1'
+    assert devices.get_mounted_device('/var/vcap/store/', mounts_file) == '/dev/nvme1n1p1'
+    assert devices.get_mounted_device('/var/vcap/sto', mounts_file) == '/dev/sdb1'
+    assert devices.get_mounted_device('/mnt/with space', mounts_file) == '/dev/sdc1'
+    assert devices.get_mounted_device('/not/mounted', mounts_file) is None
+
+
+def test_resolve_device(tmpdir):
+    target = os.path.join(str(tmpdir), 'sdb')
+    link = os.path.join(str(tmpdir), 'google-disk-id')
+    write_file(target, '')
+    os.symlink(target, link)
+    assert devices.resolve_device(link) == os.path.realpath(target)
+    assert devices.resolve_device(os.path.join(str(tmpdir), 'missing')) is None
+
+
+def test_list_partitions(tmpdir):
+    sys_block = create_sys_block(str(tmpdir))
+    assert devices.list_partitions(sys_block) == ['/dev/nvme0n1p1', '/dev/nvme1n1p1', '/dev/xvda1']
+
+
+def test_get_nvme_volume_id(tmpdir):
+    sys_block = create_sys_block(str(tmpdir))
+    assert devices.get_nvme_volume_id('/dev/nvme1n1p1', sys_block) == 'vol-0bbbbbbbbbbbbbbbb'
+    assert devices.get_nvme_volume_id('/dev/nvme0n1', sys_block) == 'vol-0aaaaaaaaaaaaaaaa'
+    assert devices.get_nvme_volume_id('/dev/xvda1', sys_block) is None
+
+
+def test_find_by_id_links(tmpdir):
+    for name in ['virtio-9a8b7c6d-5e4f-4a3b-a', 'virtio-0a1b2c3d-4e5f', 'ata-disk']:
+        write_file(os.path.join(str(tmpdir), name), '')
+    pattern = '9a8b7c6d-5e4f-4a3b-a2c1'[:20].replace('-', '-?')
+    assert devices.find_by_id_links(pattern, str(tmpdir)) == ['virtio-9a8b7c6d-5e4f-4a3b-a']
+    assert devices.find_by_id_links('virtio', str(tmpdir)) == ['virtio-0a1b2c3d-4e5f', 'virtio-9a8b7c6d-5e4f-4a3b-a']
+    assert devices.find_by_id_links('virtio', os.path.join(str(tmpdir), 'missing')) == []
+
+
+def test_wait_for_returns_when_entry_is_created(tmpdir):
+    path = os.path.join(str(tmpdir), 'virtio-volume')
+    timer = threading.Timer(0.2, write_file, [path, ''])
+    timer.start()
+    start = time.time()
+    assert devices.wait_for(lambda: os.path.exists(path), str(tmpdir), 10) == True
+    assert time.time() - start < 5
+    timer.join()
+
+
+def test_wait_for_times_out(tmpdir):
+    assert devices.wait_for(lambda: None, str(tmpdir), 0.2) is None
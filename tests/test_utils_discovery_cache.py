@@ -0,0 +1,74 @@
+import json
+import os
+import stat
+import pytest
+from lib.utils.discovery_cache import DISCOVERY_CACHE_DIRECTORY, cache_path, discovery_document
+
+document = {'kind': 'discovery#restDescription', 'name': 'compute', 'version': 'v1', 'revision': '1'}
+
+
+class Fetcher(object):
+    def __init__(self):
+        self.calls = 0
+        self.error = None
+
+    def __call__(self, api, version):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return json.dumps(dict(document, revision=str(self.calls)))
+
+
+def test_document_is_cached_on_disk(tmpdir):
+    fetch = Fetcher()
+    assert discovery_document('compute', 'v1', str(tmpdir), fetch=fetch)['revision'] == '1'
+    assert discovery_document('compute', 'v1', str(tmpdir), fetch=fetch)['revision'] == '1'
+    assert fetch.calls == 1
+    assert os.path.basename(cache_path('compute', 'v1', str(tmpdir))).startswith('compute.v1.')
+
+
+def test_stale_documents_are_fetched_again(tmpdir):
+    fetch = Fetcher()
+    discovery_document('compute', 'v1', str(tmpdir), fetch=fetch)
+    assert discovery_document('compute', 'v1', str(tmpdir), max_age=0, fetch=fetch)['revision'] == '2'
+    # a stale document is better than none
+    fetch.error = IOError('unreachable')
+    assert discovery_document('compute', 'v1', str(tmpdir), max_age=0, fetch=fetch)['revision'] == '2'
+
+
+def test_broken_cache_files_are_replaced(tmpdir):
+    fetch = Fetcher()
+    with open(cache_path('compute', 'v1', str(tmpdir)), 'w') as cache_file:
+        cache_file.write('{"truncated')
+    assert discovery_document('compute', 'v1', str(tmpdir), fetch=fetch)['revision'] == '1'
+    fetch.error = IOError('unreachable')
+    assert discovery_document('compute', 'v1', str(tmpdir), fetch=fetch)['revision'] == '1'
+    with pytest.raises(IOError):
+        discovery_document('storage', 'v1', str(tmpdir), fetch=fetch)
+
+
+def test_cache_directory_is_private(tmpdir):
+    fetch = Fetcher()
+    directory = tmpdir.join('discovery')
+    discovery_document('compute', 'v1', str(directory), fetch=fetch)
+    assert stat.S_IMODE(directory.stat().mode) == 0o700
+    assert stat.S_IMODE(os.stat(cache_path('compute', 'v1', str(directory))).st_mode) == 0o600
+    assert DISCOVERY_CACHE_DIRECTORY.endswith('-{}'.format(os.geteuid()))
+
+
+def test_cache_of_other_users_is_not_used(tmpdir):
+    fetch = Fetcher()
+    directory = tmpdir.join('discovery')
+    discovery_document('compute', 'v1', str(directory), fetch=fetch)
+    path = cache_path('compute', 'v1', str(directory))
+    os.chmod(path, 0o666)
+    assert discovery_document('compute', 'v1', str(directory), fetch=fetch)['revision'] == '2'
+    # a directory writable by others is neither read nor written
+    directory.chmod(0o777)
+    assert discovery_document('compute', 'v1', str(directory), fetch=fetch)['revision'] == '3'
+    assert discovery_document('compute', 'v1', str(directory), fetch=fetch)['revision'] == '4'
+    directory.chmod(0o700)
+    assert discovery_document('compute', 'v1', str(directory), fetch=fetch)['revision'] == '2'
+    if os.geteuid() == 0:
+        os.chown(path, 12345, -1)
+        assert discovery_document('compute', 'v1', str(directory), fetch=fetch)['revision'] == '5'
@@ -0,0 +1,141 @@
+import io
+import os
+import subprocess
+import tarfile
+import pytest
+from lib.utils import extractor
+
+
+def add(tar, name, data=None, mode=0o644, mtime=1500000000, kind=tarfile.REGTYPE, linkname=''):
+    member = tarfile.TarInfo(name)
+    member.mode = mode
+    member.mtime = mtime
+    member.type = kind
+    member.linkname = linkname
+    if data is not None:
+        member.size = len(data)
+        tar.addfile(member, io.BytesIO(data))
+    else:
+        tar.addfile(member)
+
+
+def create_archive(mode='w:gz'):
+    content = io.BytesIO()
+    with tarfile.open(fileobj=content, mode=mode) as tar:
+        add(tar, '.', mode=0o755, kind=tarfile.DIRTYPE)
+        add(tar, './config', mode=0o700, mtime=1400000000, kind=tarfile.DIRTYPE)
+        add(tar, './config/settings.json', b'{"a": 1}', mode=0o600)
+        add(tar, './data', mode=0o555, kind=tarfile.DIRTYPE)
+        for i in range(100):
+            add(tar, './data/{}.txt'.format(i), 'file {}'.format(i).encode())
+        add(tar, './data/large.bin', os.urandom(3000))
+        add(tar, './data/link', kind=tarfile.SYMTYPE, linkname='0.txt')
+        add(tar, './data/hard', kind=tarfile.LNKTYPE, linkname='./data/large.bin')
+        add(tar, '../escape.txt', b'outside')
+    return content.getvalue()
+
+
+class Stream(io.RawIOBase):
+    # a pipe: readable, but neither seekable nor tellable
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.data.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+@pytest.mark.parametrize('workers, fsync', [(1, False), (4, True)])
+def test_extract_stream(tmpdir, monkeypatch, workers, fsync):
+    # the large file is streamed by the reading thread
+    monkeypatch.setattr(extractor, 'SMALL_FILE_SIZE', 1024)
+    monkeypatch.setattr(extractor, 'FSYNC_BATCH', 7)
+    target = tmpdir.mkdir('target')
+    result = extractor.extract_stream(Stream(create_archive()), str(target), workers, fsync)
+
+    assert result.files == 102 and result.directories == 3
+    assert len(result.errors) == 1 and '../escape.txt' in result.errors[0]
+    assert not tmpdir.join('escape.txt').exists()
+    assert target.join('config', 'settings.json').read() == '{"a": 1}'
+    assert oct(os.stat(str(target.join('config', 'settings.json'))).st_mode & 0o777) == '0o600'
+    assert os.stat(str(target.join('config', 'settings.json'))).st_mtime == 1500000000
+    for i in range(100):
+        assert target.join('data', '{}.txt'.format(i)).read() == 'file {}'.format(i)
+    # the attributes of the directories are set after their files were written
+    assert oct(os.stat(str(target.join('data'))).st_mode & 0o777) == '0o555'
+    assert os.stat(str(target.join('config'))).st_mtime == 1400000000
+    assert os.readlink(str(target.join('data', 'link'))) == '0.txt'
+    assert os.path.samefile(str(target.join('data', 'hard')), str(target.join('data', 'large.bin')))
+    os.chmod(str(target.join('data')), 0o755)
+
+
+def test_only_a_window_of_writes_is_tracked(tmpdir, monkeypatch):
+    monkeypatch.setattr(extractor, 'WRITE_WINDOW', 4)
+    tracked = []
+    track = extractor._Extraction.track
+
+    def spy(extraction, path, future):
+        track(extraction, path, future)
+        tracked.append(len(extraction.written))
+    monkeypatch.setattr(extractor._Extraction, 'track', spy)
+    content = io.BytesIO()
+    with tarfile.open(fileobj=content, mode='w') as tar:
+        add(tar, './first', b'first')
+        for i in range(10):
+            add(tar, './{}.txt'.format(i), 'file {}'.format(i).encode())
+        add(tar, './hard', kind=tarfile.LNKTYPE, linkname='./first')
+    target = tmpdir.mkdir('target')
+    result = extractor.extract_stream(Stream(content.getvalue()), str(target), 4)
+
+    assert result.files == 11 and not result.errors and max(tracked) == 4
+    # the hard link to a file beyond the window finds it written
+    assert target.join('hard').read_binary() == b'first'
+
+
+def test_extract_file_like_gnu_tar(tmpdir):
+    source = tmpdir.mkdir('source')
+    source.mkdir('a').mkdir('b').join('file').write('content')
+    source.join('top').write('top')
+    tarball = str(tmpdir.join('archive.tar.gz'))
+    subprocess.check_call(['tar', '-cpzf', tarball, '-C', str(source), '.'])
+
+    result = extractor.extract_file(tarball, str(tmpdir.mkdir('target')))
+    assert result and result.files == 2 and result.directories == 3
+    assert tmpdir.join('target', 'a', 'b', 'file').read() == 'content'
+
+
+def test_broken_archives(tmpdir):
+    target = str(tmpdir.mkdir('target'))
+    assert not extractor.extract_stream(Stream(create_archive()[:500]), target)
+    assert not extractor.extract_file(str(tmpdir.join('missing.tar.gz')), target)
+
+
+def test_members_are_not_extracted_through_symlinks(tmpdir):
+    outside = tmpdir.mkdir('outside')
+    target = tmpdir.mkdir('target')
+    # a link to the outside which exists before, e.g. left by an earlier restore
+    os.symlink(str(outside), str(target.join('old')))
+    content = io.BytesIO()
+    with tarfile.open(fileobj=content, mode='w') as tar:
+        add(tar, '.', mode=0o755, kind=tarfile.DIRTYPE)
+        add(tar, './link', kind=tarfile.SYMTYPE, linkname=str(outside))
+        add(tar, './link/evil', b'evil')
+        add(tar, './up', kind=tarfile.SYMTYPE, linkname='../outside')
+        add(tar, './up/evil', b'evil')
+        add(tar, './file', kind=tarfile.SYMTYPE, linkname=str(outside.join('file')))
+        add(tar, './file', b'evil')
+        add(tar, './old/evil', b'evil')
+        add(tar, './hard', kind=tarfile.LNKTYPE, linkname='./old/secret')
+    result = extractor.extract_stream(Stream(content.getvalue()), str(target))
+
+    assert outside.listdir() == []
+    errors = dict(error.split(': ', 1) for error in result.errors)
+    assert 'symbolic link' in errors['./old/evil'] and 'symbolic link' in errors['./hard']
+    # the links are created last: the members below them were extracted into directories, which they do not replace
+    assert target.join('link', 'evil').read() == 'evil' and target.join('up', 'evil').read() == 'evil'
+    assert sorted(errors) == sorted(['./old/evil', './hard', str(target.join('link')), str(target.join('up'))])
+    assert os.readlink(str(target.join('file'))) == str(outside.join('file'))
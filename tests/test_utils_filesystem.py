@@ -0,0 +1,130 @@
+import os
+import pytest
+from lib.utils import filesystem
+
+
+def write_file(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+
+def create_tree(root):
+    os.makedirs(os.path.join(root, 'a', 'b'))
+    os.makedirs(os.path.join(root, 'empty'))
+    write_file(os.path.join(root, 'top.txt'), 'top')
+    write_file(os.path.join(root, 'a', 'one.txt'), 'one' * 1000)
+    write_file(os.path.join(root, 'a', 'b', 'two.txt'), 'two')
+    write_file(os.path.join(root, '.hidden'), 'hidden')
+    os.chmod(os.path.join(root, 'a', 'b', 'two.txt'), 0o600)
+    os.symlink('top.txt', os.path.join(root, 'link'))
+
+
+def test_make_directory(tmpdir):
+    path = os.path.join(str(tmpdir), 'x', 'y')
+    assert filesystem.make_directory(path)
+    assert os.path.isdir(path)
+    assert filesystem.make_directory(path)
+    write_file(os.path.join(str(tmpdir), 'file'), '')
+    assert not filesystem.make_directory(os.path.join(str(tmpdir), 'file'))
+
+
+def test_remove_tree(tmpdir):
+    root = os.path.join(str(tmpdir), 'root')
+    create_tree(root)
+    result = filesystem.remove_tree(root)
+    assert result
+    assert result.files == 5
+    assert result.directories == 4
+    assert not os.path.lexists(root)
+    assert filesystem.remove_tree(root)
+
+
+def test_remove_tree_removes_single_file(tmpdir):
+    path = os.path.join(str(tmpdir), 'file')
+    write_file(path, 'data')
+    assert filesystem.remove_tree(path).files == 1
+    assert not os.path.exists(path)
+
+
+def test_clear_directory_keeps_hidden_entries(tmpdir):
+    root = os.path.join(str(tmpdir), 'root')
+    create_tree(root)
+    assert filesystem.clear_directory(root)
+    assert os.listdir(root) == ['.hidden']
+    assert filesystem.clear_directory(os.path.join(str(tmpdir), 'missing'))
+
+
+def test_copy_tree(tmpdir):
+    source = os.path.join(str(tmpdir), 'source')
+    destination = os.path.join(str(tmpdir), 'destination')
+    create_tree(source)
+    result = filesystem.copy_tree(source, destination)
+    assert result
+    assert result.files == 5
+    assert read_file(os.path.join(destination, 'a', 'one.txt')) == 'one' * 1000
+    assert read_file(os.path.join(destination, 'a', 'b', 'two.txt')) == 'two'
+    assert os.stat(os.path.join(destination, 'a', 'b', 'two.txt')).st_mode & 0o777 == 0o600
+    assert os.readlink(os.path.join(destination, 'link')) == 'top.txt'
+    assert os.path.isdir(os.path.join(destination, 'empty'))
+
+
+def test_copy_tree_into_existing_directory(tmpdir):
+    source = os.path.join(str(tmpdir), 'source')
+    destination = os.path.join(str(tmpdir), 'destination')
+    create_tree(source)
+    os.makedirs(destination)
+    assert filesystem.copy_tree(source, destination)
+    assert read_file(os.path.join(destination, 'source', 'top.txt')) == 'top'
+
+
+def test_copy_file(tmpdir):
+    source = os.path.join(str(tmpdir), 'blob')
+    write_file(source, 'x' * 100000)
+    result = filesystem.copy_tree(source, os.path.join(str(tmpdir), 'copy'))
+    assert result.size == 100000
+    assert read_file(os.path.join(str(tmpdir), 'copy')) == 'x' * 100000
+
+
+def test_copy_missing_source_fails(tmpdir):
+    result = filesystem.copy_tree(os.path.join(str(tmpdir), 'missing'), os.path.join(str(tmpdir), 'copy'))
+    assert not result
+    assert len(result.errors) == 1
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_survey_tree(tmpdir, workers):
+    root = str(tmpdir)
+    create_tree(root)
+    with open(os.path.join(root, 'random.bin'), 'wb') as f:
+        f.write(os.urandom(100000))
+    # a sparse file: 8 MiB apparent size, a few bytes allocated
+    with open(os.path.join(root, 'a', 'sparse.img'), 'wb') as f:
+        f.truncate(8 * 1024 * 1024)
+
+    survey = filesystem.survey_tree(root, workers=workers, sample_files=2)
+    assert survey
+    assert survey.files == 6 and survey.directories == 4 and survey.symlinks == 1
+    assert survey.size == 3 + 3000 + 3 + 6 + 100000 + 8 * 1024 * 1024
+    assert survey.sparse_files == 1 and survey.sparse_bytes >= 7 * 1024 * 1024
+    assert survey.histogram == [4, 0, 1, 1, 0, 0, 0]
+    # the two largest files are sampled: the zeros of the sparse file compress, the random data does not
+    assert survey.sampled_bytes == 256 * 1024 + 100000
+    assert 0 < survey.compression_ratio < 0.1
+    assert survey.as_dict()['sizeDistribution']['<4KiB'] == 4
+
+
+def test_survey_tree_of_incompressible_data(tmpdir):
+    with open(os.path.join(str(tmpdir), 'random.bin'), 'wb') as f:
+        f.write(os.urandom(100000))
+    assert filesystem.survey_tree(str(tmpdir)).compression_ratio > 0.99
+
+
+def test_survey_missing_tree(tmpdir):
+    survey = filesystem.survey_tree(os.path.join(str(tmpdir), 'missing'))
+    assert not survey
+    assert survey.files == 0 and survey.directories == 0 and survey.compression_ratio is None
@@ -0,0 +1,60 @@
+import json
+import os
+import time
+import pytest
+from lib.utils.last_operation import LastOperationWriter, replace_symlink
+
+
+def read_last_operation(writer):
+    with open(writer.symlink) as f:
+        return json.load(f)
+
+
+def test_replace_symlink(tmpdir):
+    link = os.path.join(str(tmpdir), 'link')
+    replace_symlink('blue', link)
+    assert os.readlink(link) == 'blue'
+    replace_symlink('green', link)
+    assert os.readlink(link) == 'green'
+    assert os.listdir(str(tmpdir)) == ['link']
+
+
+def test_writer_swaps_blue_and_green(tmpdir):
+    writer = LastOperationWriter(str(tmpdir), 'backup', interval=0)
+    writer.write({'state': 'processing', 'stage': 'one'})
+    assert os.readlink(writer.symlink) == writer.blue
+    writer.write({'state': 'processing', 'stage': 'two'})
+    assert os.readlink(writer.symlink) == writer.green
+    assert read_last_operation(writer)['stage'] == 'two'
+    writer.close()
+
+
+def test_writer_coalesces_updates(tmpdir):
+    writer = LastOperationWriter(str(tmpdir), 'backup', interval=60)
+    writer.write({'state': 'processing', 'stage': 'one'})
+    writer.write({'state': 'processing', 'stage': 'two'})
+    writer.write({'state': 'processing', 'stage': 'three'})
+    assert read_last_operation(writer)['stage'] == 'one'
+    writer.flush()
+    assert read_last_operation(writer)['stage'] == 'three'
+    writer.close()
+
+
+def test_writer_writes_state_changes_immediately(tmpdir):
+    writer = LastOperationWriter(str(tmpdir), 'backup', interval=60)
+    writer.write({'state': 'processing', 'stage': 'one'})
+    writer.write({'state': 'processing', 'stage': 'two'})
+    writer.write({'state': 'succeeded', 'stage': 'done'})
+    assert read_last_operation(writer) == {'state': 'succeeded', 'stage': 'done'}
+    # the pending update was superseded and must not overwrite the final state
+    writer.close()
+    assert read_last_operation(writer) == {'state': 'succeeded', 'stage': 'done'}
+
+
+def test_writer_flushes_pending_update_after_interval(tmpdir):
+    writer = LastOperationWriter(str(tmpdir), 'backup', interval=0.2)
+    writer.write({'state': 'processing', 'stage': 'one'})
+    writer.write({'state': 'processing', 'stage': 'two'})
+    time.sleep(0.5)
+    assert read_last_operation(writer)['stage'] == 'two'
+    writer.close()
@@ -0,0 +1,140 @@
+import os
+import pytest
+import threading
+from lib.utils.metrics import Metrics
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_stage_records_wall_time_and_count():
+    clock = FakeClock()
+    metrics = Metrics(clock)
+    with metrics.stage('snapshot'):
+        clock.now += 5
+    with metrics.stage('snapshot'):
+        clock.now += 3
+    stage = metrics.as_dict()['stages']['snapshot']
+    assert stage['count'] == 2
+    assert stage['wallTime'] == 8
+    assert stage['errors'] == 0
+
+
+def test_counters_go_to_innermost_stage():
+    metrics = Metrics(FakeClock())
+    with metrics.stage('upload'):
+        metrics.add('attempts')
+        with metrics.stage('encrypt'):
+            metrics.add('bytesOut', 10)
+        metrics.add('bytesOut', 20)
+    metrics.add('retries')
+    stages = metrics.as_dict()['stages']
+    assert stages['encrypt']['bytesOut'] == 10
+    assert stages['upload']['bytesOut'] == 20
+    assert stages['upload']['attempts'] == 1
+    assert stages['other']['retries'] == 1
+
+
+def test_reentered_stage_is_counted_once():
+    clock = FakeClock()
+    metrics = Metrics(clock)
+    with metrics.stage('mount') as outer:
+        with metrics.stage('mount') as inner:
+            clock.now += 2
+    assert outer.active and not inner.active
+    stage = metrics.as_dict()['stages']['mount']
+    assert stage['count'] == 1
+    assert stage['wallTime'] == 2
+
+
+def test_stages_of_threads_do_not_mix():
+    metrics = Metrics(FakeClock())
+    entered = threading.Barrier(4)
+
+    def upload():
+        with metrics.stage('upload'):
+            entered.wait()
+            metrics.add('bytesOut', 100)
+            entered.wait()
+
+    with metrics.stage('upload_shards'):
+        threads = [threading.Thread(target=upload) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # a thread without a stage of its own adds to the stage of the main thread
+        thread = threading.Thread(target=metrics.add, args=('retries',))
+        thread.start()
+        thread.join()
+    stages = metrics.as_dict()['stages']
+    assert (stages['upload']['count'], stages['upload']['bytesOut']) == (4, 400)
+    assert stages['upload_shards']['count'] == 1 and stages['upload_shards']['retries'] == 1
+
+
+def test_failed_stage_counts_error_but_not_system_exit():
+    metrics = Metrics(FakeClock())
+    with pytest.raises(Exception):
+        with metrics.stage('attach'):
+            raise Exception('failed')
+    with pytest.raises(SystemExit):
+        with metrics.stage('detach'):
+            raise SystemExit()
+    stages = metrics.as_dict()['stages']
+    assert stages['attach']['errors'] == 1
+    assert stages['detach']['errors'] == 0
+
+
+def test_throughput():
+    clock = FakeClock()
+    metrics = Metrics(clock)
+    with metrics.stage('download'):
+        clock.now += 4
+        metrics.add('bytesIn', 400)
+    with metrics.stage('mount'):
+        clock.now += 1
+    stages = metrics.as_dict()['stages']
+    assert stages['download']['throughput'] == 100
+    assert stages['mount']['throughput'] is None
+
+
+def test_optional_counters_are_added_when_used(tmpdir):
+    metrics = Metrics(FakeClock())
+    with metrics.stage('tar_encrypt'):
+        metrics.add('filesStored', 2)
+        metrics.add('compressionTimeSaved', 1.5)
+    with metrics.stage('upload'):
+        pass
+    stages = metrics.as_dict()['stages']
+    assert stages['tar_encrypt']['filesStored'] == 2 and stages['tar_encrypt']['compressionTimeSaved'] == 1.5
+    assert 'filesStored' not in stages['upload']
+    with pytest.raises(KeyError):
+        metrics.add('unknown')
+
+    path = os.path.join(str(tmpdir), 'backup.prom')
+    metrics.write_prometheus(path, {'operation': 'backup'})
+    with open(path) as f:
+        content = f.read()
+    assert 'sf_backup_restore_stage_files_stored{operation="backup",stage="tar_encrypt"} 2' in content
+    assert 'sf_backup_restore_stage_files_stored{operation="backup",stage="upload"}' not in content
+
+
+def test_write_prometheus(tmpdir):
+    clock = FakeClock()
+    metrics = Metrics(clock)
+    with metrics.stage('upload'):
+        clock.now += 2
+        metrics.add('bytesOut', 1024)
+    path = os.path.join(str(tmpdir), 'backup.prom')
+    metrics.write_prometheus(path, {'operation': 'backup', 'type': 'online'})
+    with open(path) as f:
+        content = f.read()
+    assert 'sf_backup_restore_stage_duration_seconds{operation="backup",stage="upload",type="online"} 2.0' in content
+    assert 'sf_backup_restore_stage_bytes_out{operation="backup",stage="upload",type="online"} 1024' in content
+    assert 'sf_backup_restore_duration_seconds{operation="backup",type="online"} 2.0' in content
+    assert os.listdir(str(tmpdir)) == ['backup.prom']
@@ -0,0 +1,60 @@
+import os
+import pstats
+import time
+import pytest
+from lib.utils import profiling
+from lib.utils.profiling import Profiler, parse_modes, start_profiling
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    data = []
+    while time.time() < end:
+        data.append(sum(range(1000)))
+    return data
+
+
+def test_parse_modes():
+    assert parse_modes(None) == ()
+    assert parse_modes('false') == ()
+    assert parse_modes('all') == ('cpu', 'sample', 'memory')
+    assert parse_modes('true') == ('cpu', 'sample', 'memory')
+    assert parse_modes('memory, cpu') == ('cpu', 'memory')
+    with pytest.raises(Exception):
+        parse_modes('cpu,gpu')
+
+
+def test_profiler_writes_results(tmpdir):
+    profiler = Profiler(str(tmpdir), 'backup', ('cpu', 'sample', 'memory'), sample_interval=0.005,
+                        memory_interval=0.1, memory_top=5)
+    profiler.start()
+    busy(0.3)
+    profiler.stop()
+    stats = pstats.Stats(profiler.path_pstats)
+    assert any(function == 'busy' for _, _, function in stats.stats)
+    with open(profiler.path_collapsed) as f:
+        lines = f.read().splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any('busy (test_utils_profiling.py' in line for line in lines)
+    with open(profiler.path_memory) as f:
+        snapshots = f.read().strip().split('\n\n')
+    assert len(snapshots) >= 2
+    assert 'peak=' in snapshots[-1]
+    # stopping twice (atexit after an explicit stop) is a no-op
+    profiler.stop()
+
+
+def test_start_profiling_is_disabled_by_default(tmpdir, monkeypatch):
+    monkeypatch.delenv('SF_BACKUP_RESTORE_PROFILE', raising=False)
+    assert start_profiling(str(tmpdir), 'restore') is None
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_start_profiling_from_environment(tmpdir, monkeypatch):
+    monkeypatch.setenv('SF_BACKUP_RESTORE_PROFILE', 'sample')
+    monkeypatch.setattr(profiling, '_active_profiler', None)
+    profiler = start_profiling(str(tmpdir), 'restore')
+    assert profiler.modes == ('sample',)
+    assert start_profiling(str(tmpdir), 'restore') is profiler
+    profiler.stop()
+    assert os.listdir(str(tmpdir)) == ['restore.collapsed']
@@ -0,0 +1,66 @@
+import pytest
+from lib.utils.progress import ProgressTracker, parse_percent, GIB
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_percent():
+    assert parse_percent('42%') == 42.0
+    assert parse_percent(' 7 ') == 7.0
+    assert parse_percent(100) == 100.0
+    assert parse_percent('') is None
+    assert parse_percent(None) is None
+
+
+def test_progress_without_samples():
+    clock = Clock()
+    tracker = ProgressTracker('snapshot', clock=clock)
+    clock.now += 5
+    progress = tracker.as_dict()
+    assert progress['name'] == 'snapshot'
+    assert progress['percent'] is None
+    assert progress['eta'] is None
+    assert progress['elapsed'] == 5
+
+
+def test_progress_derives_bytes_throughput_and_eta():
+    clock = Clock()
+    tracker = ProgressTracker('snapshot', 10 * GIB, clock=clock)
+    clock.now += 10
+    tracker.update('25%')
+    progress = tracker.as_dict()
+    assert progress['percent'] == 25
+    assert progress['bytes'] == int(2.5 * GIB)
+    assert progress['throughput'] == round(2.5 * GIB / 10, 3)
+    assert progress['eta'] == 30
+
+
+def test_progress_keeps_last_known_values():
+    clock = Clock()
+    tracker = ProgressTracker('snapshot', clock=clock)
+    clock.now += 2
+    tracker.update(percent=50)
+    tracker.update(bytes_done=2048)
+    tracker.update()
+    assert len(tracker.samples) == 2
+    progress = tracker.as_dict()
+    assert progress['percent'] == 50
+    assert progress['bytes'] == 2048
+    assert progress['eta'] == 2
+
+
+def test_progress_finish():
+    clock = Clock()
+    tracker = ProgressTracker('snapshot', 4 * GIB, clock=clock)
+    clock.now += 8
+    tracker.finish()
+    progress = tracker.as_dict()
+    assert progress['percent'] == 100
+    assert progress['bytes'] == 4 * GIB
+    assert progress['eta'] == 0
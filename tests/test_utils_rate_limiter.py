@@ -0,0 +1,119 @@
+import threading
+import pytest
+from lib.utils import rate_limiter
+from lib.utils.rate_limiter import (DESCRIBE, MUTATE, STORAGE, RateLimiter, TokenBucket, api_family,
+                                    get_rate_limiter, parse_rate_limit)
+from lib.utils.tracing import Tracer, TracedProxy
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+def test_api_family():
+    assert api_family('ec2.DescribeSnapshots') == DESCRIBE
+    assert api_family('compute.snapshots.get') == DESCRIBE
+    assert api_family('compute.instances.aggregatedList') == DESCRIBE
+    assert api_family('nova.volumes.get_server_volumes') == DESCRIBE
+    assert api_family('ec2.CreateSnapshot') == MUTATE
+    assert api_family('compute.disks.insert') == MUTATE
+
+
+def test_parse_rate_limit():
+    assert parse_rate_limit('5/10') == (5, 10)
+    assert parse_rate_limit('2.5') == (2.5, 2.5)
+    assert parse_rate_limit('0.5') == (0.5, 1)
+    assert parse_rate_limit('off') is None
+    assert parse_rate_limit(None) is None
+
+
+def test_bucket_allows_burst_then_queues():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock, sleep=clock.sleep)
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.acquire() == 0.5
+    assert bucket.acquire() == 0.5
+    clock.now += 10
+    # the bucket never holds more than the burst
+    assert [bucket.acquire() for _ in range(4)] == [0, 0, 0, 0.5]
+
+
+def test_concurrent_callers_queue_in_order():
+    # the clock stands still, so every caller has to wait for the reservations of the callers before it
+    bucket = TokenBucket(rate=100, burst=1, clock=lambda: 0.0, sleep=lambda seconds: None)
+    waits = []
+
+    def call():
+        waits.append(bucket.acquire())
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(round(wait, 2) for wait in waits) == [0, 0.01, 0.02, 0.03, 0.04]
+
+
+def test_bucket_adapts_to_throttling():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, burst=10, clock=clock, sleep=clock.sleep)
+    bucket.throttled()
+    assert bucket.rate == 5
+    assert bucket.tokens == 0
+    bucket.throttled()
+    bucket.throttled()
+    assert bucket.rate == 1.25
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 10
+
+
+def test_limits_from_environment(monkeypatch):
+    monkeypatch.setenv('SF_BACKUP_RESTORE_RATE_LIMIT_MUTATE', '1/2')
+    monkeypatch.setenv('SF_BACKUP_RESTORE_RATE_LIMIT_AWS_STORAGE', 'off')
+    limiter = RateLimiter('aws')
+    assert limiter.buckets[MUTATE].rate == 1 and limiter.buckets[MUTATE].burst == 2
+    assert limiter.buckets[DESCRIBE].rate == rate_limiter.DEFAULT_RATE_LIMITS['aws'][DESCRIBE][0]
+    assert STORAGE not in limiter.buckets
+    assert limiter.acquire(STORAGE) == 0
+
+
+def test_rate_limiter_is_shared_per_provider():
+    assert get_rate_limiter('gcp') is get_rate_limiter('gcp')
+    assert get_rate_limiter('gcp') is not get_rate_limiter('azure')
+
+
+def test_traced_proxy_passes_the_rate_limiter():
+    clock = FakeClock()
+    limiter = RateLimiter('azure', {DESCRIBE: (1, 1), MUTATE: (1, 1)}, clock=clock, sleep=clock.sleep)
+    tracer = Tracer('azure', clock=clock)
+
+    class Disks(object):
+        def get(self, name):
+            return name
+
+        def create_or_update(self, name):
+            raise Throttled('Too many requests')
+
+    proxy = TracedProxy(Disks(), tracer, 'compute.disks', limiter=limiter)
+    proxy.get('disk')
+    proxy.get('disk')
+    assert clock.slept == [1]
+    assert tracer.spans[1].attributes['queued'] == 1
+    with pytest.raises(Throttled):
+        proxy.create_or_update('disk')
+    assert limiter.buckets[MUTATE].rate == 0.5
+    assert limiter.buckets[DESCRIBE].rate == 1
@@ -0,0 +1,56 @@
+import os
+import pytest
+from lib.utils import reader
+from lib.utils.reader import SequentialReader
+
+
+def read_all(source, size):
+    chunks = []
+    chunk = source.read(size)
+    while chunk:
+        chunks.append(chunk)
+        chunk = source.read(size)
+    return b''.join(chunks)
+
+
+@pytest.fixture
+def data_file(tmpdir):
+    path = tmpdir.join('data')
+    path.write_binary(os.urandom(5 * 4096 + 100))
+    return str(path)
+
+
+def test_advice(data_file, monkeypatch):
+    advice = []
+    monkeypatch.setattr(os, 'posix_fadvise', lambda fd, offset, length, kind: advice.append((offset, length, kind)))
+    with SequentialReader(data_file, read_ahead=8192, drop_cache=True) as source:
+        assert read_all(source, 4096) == open(data_file, 'rb').read()
+    assert advice[0] == (0, 0, os.POSIX_FADV_SEQUENTIAL)
+    # the read-ahead is renewed once half of it was read, every read block is dropped
+    assert [entry[:2] for entry in advice if entry[2] == os.POSIX_FADV_WILLNEED] == [
+        (0, 8192), (8192, 8192), (16384, 8192), (24576, 20580 + 8192 - 24576)]
+    assert [entry[:2] for entry in advice if entry[2] == os.POSIX_FADV_DONTNEED] == [
+        (0, 4096), (4096, 4096), (8192, 4096), (12288, 4096), (16384, 4096), (20480, 100), (0, 0)]
+
+
+def test_without_drop_cache_nothing_is_dropped(data_file, monkeypatch):
+    advice = []
+    monkeypatch.setattr(os, 'posix_fadvise', lambda fd, offset, length, kind: advice.append(kind))
+    with SequentialReader(data_file, read_ahead=0) as source:
+        assert len(read_all(source, 8192)) == 5 * 4096 + 100
+    assert advice == [os.POSIX_FADV_SEQUENTIAL]
+
+
+def test_direct(data_file):
+    with SequentialReader(data_file, buffer_size=8192, direct=True) as source:
+        # reads are rounded up to the alignment, but return the requested size
+        assert read_all(source, 8192) == open(data_file, 'rb').read()
+        if source.direct:
+            with pytest.raises(ValueError):
+                source.read(8193)
+
+
+def test_drop_cache_setting():
+    assert reader.drop_cache('online') and not reader.drop_cache('offline')
+    assert reader.drop_cache('offline', reader.ALWAYS)
+    assert not reader.drop_cache('online', reader.NEVER)
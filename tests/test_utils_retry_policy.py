@@ -0,0 +1,165 @@
+import socket
+import pytest
+from lib.utils.cancellation import OperationCancelled
+from lib.utils.retry_policy import (AUTH, NOT_FOUND, PERMANENT, THROTTLING, TRANSIENT, Backoff, CircuitBreaker,
+                                    RetryBudgetExceeded, RetryPolicy, classify_error)
+
+
+class ClientError(Exception):
+    # shape of botocore.exceptions.ClientError
+    def __init__(self, code, status):
+        super(ClientError, self).__init__(code)
+        self.response = {'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}
+
+
+class HttpError(Exception):
+    # shape of googleapiclient.errors.HttpError
+    class Response(object):
+        def __init__(self, status):
+            self.status = status
+
+    def __init__(self, status):
+        super(HttpError, self).__init__('HTTP {}'.format(status))
+        self.resp = self.Response(status)
+
+
+class ServerException(Exception):
+    # shape of aliyunsdkcore.acs_exception.exceptions.ServerException
+    def __init__(self, code, status):
+        super(ServerException, self).__init__(code)
+        self.code = code
+        self.status = status
+
+    def get_error_code(self):
+        return self.code
+
+    def get_http_status(self):
+        return self.status
+
+
+class ReadTimeoutError(Exception):
+    pass
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_classify_error():
+    assert classify_error(ClientError('RequestLimitExceeded', 400)) == THROTTLING
+    assert classify_error(ClientError('InvalidSnapshot.NotFound', 400)) == NOT_FOUND
+    assert classify_error(ClientError('UnauthorizedOperation', 403)) == AUTH
+    assert classify_error(ClientError('InvalidParameterValue', 400)) == PERMANENT
+    assert classify_error(ClientError('InternalError', 500)) == TRANSIENT
+    assert classify_error(HttpError(429)) == THROTTLING
+    assert classify_error(HttpError(404)) == NOT_FOUND
+    assert classify_error(ServerException('Throttling.User', 400)) == THROTTLING
+    assert classify_error(ServerException('InvalidDiskId.NotFound', 404)) == NOT_FOUND
+    assert classify_error(socket.timeout()) == TRANSIENT
+    assert classify_error(ReadTimeoutError()) == TRANSIENT
+    assert classify_error(ImportError()) == PERMANENT
+    assert classify_error(OperationCancelled()) == PERMANENT
+    assert classify_error(Exception('Volume vol-1 could not be found. Status: not found')) == NOT_FOUND
+    assert classify_error(Exception('something unexpected')) == TRANSIENT
+
+
+def test_classify_error_follows_the_cause():
+    try:
+        try:
+            raise HttpError(403)
+        except HttpError as error:
+            raise Exception('Getting container failed: {}'.format(error))
+    except Exception as error:
+        assert classify_error(error) == AUTH
+
+
+def test_backoff_is_exponential_with_jitter_and_capped():
+    backoff = Backoff(max_attempts=5, base=2, cap=10)
+    assert backoff.delay(1, lambda: 1.0) == 2
+    assert backoff.delay(3, lambda: 1.0) == 8
+    assert backoff.delay(4, lambda: 1.0) == 10
+    assert backoff.delay(4, lambda: 0.5) == 5
+    assert Backoff(max_attempts=1, base=0, cap=0).delay(1) == 0
+
+
+def run_failing(policy, errors):
+    calls = []
+
+    def attempt_function(attempt):
+        calls.append(attempt)
+        error = errors.pop(0) if errors else None
+        if error:
+            raise error
+        return 'done'
+    return calls, policy.run(attempt_function)
+
+
+def test_retries_until_success():
+    clock = FakeClock()
+    policy = RetryPolicy(sleep=clock.sleep, clock=clock)
+    calls, result = run_failing(policy, [HttpError(503), HttpError(500)])
+    assert result == 'done'
+    assert calls == [1, 2, 3]
+
+
+def test_permanent_errors_are_not_retried():
+    clock = FakeClock()
+    retries = []
+    policy = RetryPolicy(sleep=clock.sleep, clock=clock, on_retry=lambda *args: retries.append(args))
+    with pytest.raises(ClientError):
+        run_failing(policy, [ClientError('InvalidParameterValue', 400)] * 5)
+    assert retries == []
+    assert clock.now == 0
+
+
+def test_attempts_per_error_class():
+    clock = FakeClock()
+    retries = []
+    policy = RetryPolicy(sleep=clock.sleep, clock=clock, on_retry=lambda *args: retries.append(args[1]))
+    with pytest.raises(HttpError):
+        run_failing(policy, [HttpError(404)] * 10)
+    assert retries == [NOT_FOUND, NOT_FOUND]
+
+
+def test_budget_limits_retries():
+    clock = FakeClock()
+    policy = RetryPolicy(backoffs={TRANSIENT: Backoff(max_attempts=10, base=20, cap=20)}, budget=50,
+                         sleep=clock.sleep, clock=clock)
+    policy.backoffs[TRANSIENT].delay = lambda attempt: 20
+    with pytest.raises(RetryBudgetExceeded):
+        run_failing(policy, [HttpError(500)] * 10)
+    assert clock.now == 40
+
+
+def test_open_circuit_allows_a_single_attempt():
+    clock = FakeClock()
+    breaker = CircuitBreaker(threshold=2, reset_timeout=100, clock=clock)
+    policy = RetryPolicy(max_attempts=2, breaker=breaker, sleep=clock.sleep, clock=clock)
+    for _ in range(2):
+        with pytest.raises(HttpError):
+            run_failing(policy, [HttpError(500)] * 2)
+    assert breaker.open
+    # would succeed with a retry, but the open circuit allows one attempt only
+    with pytest.raises(HttpError):
+        run_failing(policy, [HttpError(500), None])
+    calls, result = run_failing(policy, [])
+    assert result == 'done' and not breaker.open
+
+
+def test_circuit_closes_after_reset_timeout():
+    clock = FakeClock()
+    breaker = CircuitBreaker(threshold=2, reset_timeout=100, clock=clock)
+    breaker.record_failure(NOT_FOUND)
+    breaker.record_failure(TRANSIENT)
+    assert not breaker.open
+    breaker.record_failure(THROTTLING)
+    assert breaker.open
+    clock.now += 100
+    assert not breaker.open
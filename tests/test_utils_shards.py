@@ -0,0 +1,67 @@
+import os
+import subprocess
+from lib.utils import shards
+
+
+def create_tree(root):
+    root.mkdir('empty')
+    data = root.mkdir('data')
+    data.join('large').write('x' * 100000)
+    data.join('medium').write('x' * 60000)
+    for i in range(20):
+        data.mkdir('d{}'.format(i)).join('small').write('x' * 2000)
+    os.link(str(data.join('large')), str(root.join('large-link')))
+    os.symlink('data/medium', str(root.join('symlink')))
+    os.chmod(str(data), 0o750)
+    os.utime(str(data), (1400000000, 1400000000))
+
+
+def test_partition_tree(tmpdir):
+    create_tree(tmpdir)
+    directories, partition = shards.partition_tree(str(tmpdir), 3)
+    assert directories[:3] == ['.', './empty', './data'] and len(directories) == 23
+    assert len(partition) == 3
+    names = [name for _, shard_names in partition for name in shard_names]
+    assert sorted(names) == sorted(['./data/large', './large-link', './data/medium', './symlink'] +
+                                   ['./data/d{}/small'.format(i) for i in range(20)])
+    # the hard links are archived together, the other shards are balanced
+    assert ['./large-link', './data/large'] in [shard_names for _, shard_names in partition]
+    weights = sorted(weight for weight, _ in partition)
+    assert weights[-1] == 100000 + 2 * shards.MEMBER_OVERHEAD
+    assert weights[1] - weights[0] <= 2000 + shards.MEMBER_OVERHEAD
+
+    manifest = shards.create_manifest(directories, partition)
+    assert sum(shard['files'] for shard in manifest.shards) == 24
+    assert sum(shard['size'] for shard in manifest.shards) == 100000 + 60000 + 20 * 2000
+    shards.write_manifest(str(tmpdir.join('manifest.json')), manifest)
+    assert shards.read_manifest(str(tmpdir.join('manifest.json'))).as_dict() == manifest.as_dict()
+
+
+def test_more_shards_than_files(tmpdir):
+    tmpdir.join('file').write('content')
+    assert shards.partition_tree(str(tmpdir), 8) == (['.'], [(7 + shards.MEMBER_OVERHEAD, ['./file'])])
+    assert shards.partition_tree(str(tmpdir.mkdir('empty')), 8) == (['.'], [])
+
+
+def test_shards_restore_the_tree_with_gnu_tar(tmpdir):
+    source = tmpdir.mkdir('source')
+    create_tree(source)
+    directories, partition = shards.partition_tree(str(source), 4)
+    archives = [('directories', directories)] + [(str(index), names) for index, (_, names) in enumerate(partition)]
+    for name, names in archives:
+        shards.write_list(str(tmpdir.join(name + shards.LIST_SUFFIX)), names)
+        subprocess.check_call('tar -cpz -C {} --no-recursion --null -T {} -f {}'.format(
+            source, tmpdir.join(name + shards.LIST_SUFFIX), tmpdir.join(name)), shell=True)
+
+    target = tmpdir.mkdir('target')
+    extractions = [subprocess.Popen(['tar', '-xzf', str(tmpdir.join(name)), '-C', str(target)])
+                   for name, _ in archives[1:]]
+    assert [extraction.wait() for extraction in extractions] == [0] * len(partition)
+    subprocess.check_call(['tar', '-xzf', str(tmpdir.join('directories')), '-C', str(target)])
+
+    assert target.join('data', 'd7', 'small').size() == 2000
+    assert os.path.samefile(str(target.join('large-link')), str(target.join('data', 'large')))
+    assert os.readlink(str(target.join('symlink'))) == 'data/medium'
+    assert target.join('empty').isdir()
+    assert oct(os.stat(str(target.join('data'))).st_mode & 0o777) == '0o750'
+    assert os.stat(str(target.join('data'))).st_mtime == 1400000000
@@ -0,0 +1,115 @@
+import io
+import json
+import os
+import threading
+from lib.utils import throttle
+from lib.utils.reader import SequentialReader
+from lib.utils.throttle import DISK_READ, UPLOAD, Throttle, ThrottledFile, increments, parse_byte_rate
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_parse_byte_rate():
+    assert parse_byte_rate('20M') == (20 * 1024 ** 2, 20 * 1024 ** 2)
+    assert parse_byte_rate('512k/1G') == (512 * 1024, 1024 ** 3)
+    assert parse_byte_rate(1048576) == (1048576, 1048576)
+    assert parse_byte_rate('off') is None and parse_byte_rate('') is None and parse_byte_rate(None) is None
+
+
+def test_acquire_waits_in_pieces_of_the_burst():
+    clock = FakeClock()
+    waits = []
+    limits = Throttle({UPLOAD: (1000, 500), DISK_READ: None}, on_wait=lambda kind, seconds: waits.append(kind),
+                      clock=clock, sleep=clock.sleep)
+    assert limits.acquire(DISK_READ, 10 ** 9) == 0
+    # the burst is spent at once, then every piece of 500 bytes waits for the refill
+    assert limits.acquire(UPLOAD, 2000) == 1.5
+    assert clock.slept == [0.5, 0.5, 0.5] and waits == [UPLOAD]
+    limits.configure({UPLOAD: None})
+    assert limits.acquire(UPLOAD, 2000) == 0 and not limits.limited(UPLOAD)
+
+
+def test_acquire_is_shared_by_threads():
+    slept = []
+    limits = Throttle({UPLOAD: (100, 100)}, clock=lambda: 0.0, sleep=slept.append)
+    threads = [threading.Thread(target=limits.acquire, args=(UPLOAD, 100)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the first thread takes the burst, the others queue behind each other
+    assert sorted(slept) == [1, 2, 3, 4]
+
+
+def test_control_file(tmpdir, monkeypatch):
+    monkeypatch.setattr(throttle, 'CONTROL_FILE_INTERVAL', 5)
+    clock = FakeClock()
+    changes = []
+    control_file = tmpdir.join('backup.throttle.json')
+    control_file.write(json.dumps({'upload': '1M'}))
+    limits = Throttle({UPLOAD: (100, 100)}, on_change=lambda limits, error: changes.append((limits, error)),
+                      clock=clock, sleep=clock.sleep)
+    limits.watch(str(control_file))
+    # a control file left from before is ignored until it changes or a reload is requested
+    clock.now = 10
+    limits.acquire(UPLOAD, 1)
+    assert limits.limits()[UPLOAD] == (100, 100) and changes == []
+    limits.reload()
+    limits.acquire(UPLOAD, 1)
+    assert limits.limits() == {UPLOAD: (1024 ** 2, 1024 ** 2), DISK_READ: None} and changes[-1][1] is None
+
+    control_file.write(json.dumps({'upload': 'off', 'diskRead': '10M/20M'}))
+    os.utime(str(control_file), (1, 1))
+    limits.acquire(UPLOAD, 1)
+    assert limits.limited(UPLOAD)
+    clock.now += 5
+    limits.acquire(UPLOAD, 1)
+    assert limits.limits() == {UPLOAD: None, DISK_READ: (10 * 1024 ** 2, 20 * 1024 ** 2)}
+
+    control_file.write('{"diskRead": "fast"}')
+    os.utime(str(control_file), (2, 2))
+    clock.now += 5
+    limits.acquire(DISK_READ, 1)
+    assert isinstance(changes[-1][1], ValueError) and limits.limited(DISK_READ)
+
+
+def test_throttled_file():
+    clock = FakeClock()
+    limits = Throttle({UPLOAD: (10, 10)}, clock=clock, sleep=clock.sleep)
+    source = io.BytesIO(b'0123456789' * 3)
+    source.seek(5)
+    throttled = ThrottledFile(source, limits, length=20)
+    assert throttled.read(8) == b'56789012' and throttled.read() == b'345678901234'
+    assert throttled.read(8) == b'' and sum(clock.slept) == 1
+    throttled.seek(5)
+    assert throttled.tell() == 5 and throttled.read(3) == b'567'
+
+
+def test_increments():
+    transferred = []
+    progress = increments(transferred.append)
+    for current in (0, 100, 250, 250, 400):
+        progress(current, 400)
+    assert transferred == [0, 100, 150, 0, 150]
+
+
+def test_sequential_reader_takes_the_disk_read_limit(tmpdir):
+    clock = FakeClock()
+    limits = Throttle({DISK_READ: (4096, 4096)}, clock=clock, sleep=clock.sleep)
+    path = tmpdir.join('data')
+    path.write_binary(b'x' * 4 * 4096)
+    with SequentialReader(str(path), read_ahead=0, throttle=limits) as source:
+        while source.read(4096):
+            pass
+    assert sum(clock.slept) == 3
@@ -0,0 +1,116 @@
+import json
+import os
+import pytest
+from lib.utils.tracing import Tracer, TracedProxy
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Snapshots(object):
+    def __init__(self, clock):
+        self.clock = clock
+
+    def create(self, name):
+        self.clock.now += 2
+        return name
+
+    def delete(self, name):
+        raise Exception('not found')
+
+
+class ComputeClient(object):
+    api_version = 'v1'
+
+    def __init__(self, clock):
+        self.snapshots = Snapshots(clock)
+
+
+def test_spans_nest_and_record_outcome():
+    clock = FakeClock()
+    tracer = Tracer('gcp', clock=clock)
+    with tracer.span('create_snapshot', stage='snapshot') as outer:
+        with tracer.span('insert', attempt=2) as inner:
+            clock.now += 1
+    with pytest.raises(Exception):
+        with tracer.span('delete_snapshot'):
+            raise Exception('failed')
+    spans = list(tracer.spans)
+    assert [span.name for span in spans] == ['insert', 'create_snapshot', 'delete_snapshot']
+    assert inner.parent_id == outer.span_id
+    assert inner.attempt == 2 and inner.duration == 1
+    assert spans[2].outcome == 'error' and spans[2].error == 'failed'
+
+
+def test_ring_buffer_drops_oldest_spans():
+    tracer = Tracer('aws', capacity=3, clock=FakeClock())
+    for i in range(5):
+        tracer.finish_span(tracer.start_span('call{}'.format(i), 'client'))
+    assert [span.name for span in tracer.spans] == ['call2', 'call3', 'call4']
+    assert tracer.dropped == 2
+
+
+def test_histogram():
+    clock = FakeClock()
+    tracer = Tracer('aws', clock=clock)
+    for duration in (0.02, 0.2, 3):
+        span = tracer.start_span('ec2.CreateSnapshot', 'client')
+        clock.now += duration
+        tracer.finish_span(span)
+    summary = tracer.histogram()['ec2.CreateSnapshot']
+    assert summary['count'] == 3
+    assert summary['p50'] == 0.2
+    assert summary['max'] == 3
+    assert summary['buckets']['0.01'] == 0
+    assert summary['buckets']['0.25'] == 2
+    assert summary['buckets']['+Inf'] == 3
+    assert len(tracer.format_histogram()) == 2
+
+
+def test_export_otlp_json(tmpdir):
+    clock = FakeClock()
+    tracer = Tracer('azure', clock=clock)
+    with tracer.span('upload_to_blobstore', stage='upload'):
+        clock.now += 1
+    path = os.path.join(str(tmpdir), 'backup.traces.json')
+    tracer.export(path, {'operation': 'backup'})
+    with open(path) as f:
+        document = json.load(f)
+    resource_spans = document['resourceSpans'][0]
+    assert {'key': 'cloud.provider', 'value': {'stringValue': 'azure'}} in resource_spans['resource']['attributes']
+    span = resource_spans['scopeSpans'][0]['spans'][0]
+    assert span['name'] == 'upload_to_blobstore'
+    assert span['traceId'] == tracer.trace_id and len(span['traceId']) == 32
+    assert span['endTimeUnixNano'] == str(1001 * 10 ** 9)
+    assert span['status'] == {'code': 1}
+    assert {'key': 'attempt', 'value': {'intValue': '1'}} in span['attributes']
+    assert os.listdir(str(tmpdir)) == ['backup.traces.json']
+
+
+def test_traced_proxy():
+    clock = FakeClock()
+    finished = []
+    tracer = Tracer('azure', clock=clock, on_finish=finished.append)
+    client = ComputeClient(clock)
+    proxy = TracedProxy(client, tracer, 'compute')
+    assert isinstance(proxy, ComputeClient)
+    assert proxy.api_version == 'v1'
+    assert proxy.snapshots.create('snap') == 'snap'
+    with pytest.raises(Exception):
+        proxy.snapshots.delete('snap')
+    assert [(span.name, span.kind, span.duration, span.outcome) for span in finished] == [
+        ('compute.snapshots.create', 'client', 2, 'ok'), ('compute.snapshots.delete', 'client', 0, 'error')]
+    proxy.region = 'westeurope'
+    assert client.region == 'westeurope'
+
+
+def test_traced_proxy_describe():
+    tracer = Tracer('ali', clock=FakeClock())
+    proxy = TracedProxy(Snapshots(FakeClock()), tracer, 'ecs', depth=0, describe=lambda name, args: args[0])
+    proxy.create('CreateSnapshot')
+    assert tracer.spans[0].name == 'ecs.CreateSnapshot'
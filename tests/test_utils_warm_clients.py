@@ -0,0 +1,54 @@
+from lib.utils.warm_clients import Binding, WarmClients, cache_key
+
+
+class Client(object):
+    def __init__(self, name):
+        self.name = name
+
+    def hook(self, value):
+        return '{}:{}'.format(self.name, value)
+
+
+def test_disabled_cache_creates_every_time():
+    cache = WarmClients()
+    created = []
+    first = cache.get('key', lambda binding: created.append(binding) or object(), Client('one'))
+    second = cache.get('key', lambda binding: created.append(binding) or object(), Client('two'))
+    assert first is not second
+    assert len(created) == 2 and len(cache) == 0
+
+
+def test_warm_client_is_rebound_to_its_current_owner():
+    cache = WarmClients()
+    cache.enabled = True
+    hooks = []
+
+    def factory(binding):
+        hooks.append(binding.method('hook'))
+        return object()
+
+    first = cache.get('key', factory, Client('one'))
+    assert hooks[0]('call') == 'one:call'
+    second = cache.get('key', factory, Client('two'))
+    assert first is second
+    assert len(hooks) == 1
+    # hooks registered by the first owner now call the second one
+    assert hooks[0]('call') == 'two:call'
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.clear()
+    assert cache.get('key', factory, Client('three')) is not first
+
+
+def test_binding_calls_the_current_client():
+    binding = Binding(Client('one'))
+    hook = binding.method('hook')
+    binding.client = Client('two')
+    assert hook(1) == 'two:1'
+
+
+def test_cache_key_hides_credentials():
+    key = cache_key('aws', 'ec2.client', {'access_key_id': 'id', 'secret_access_key': 'secret'})
+    assert key[:2] == ('aws', 'ec2.client')
+    assert 'secret' not in key[2]
+    assert key == cache_key('aws', 'ec2.client', {'secret_access_key': 'secret', 'access_key_id': 'id'})
+    assert key != cache_key('aws', 'ec2.client', {'access_key_id': 'id', 'secret_access_key': 'rotated'})